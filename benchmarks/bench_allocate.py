@@ -0,0 +1,72 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Measure the rate at which a voucher system attributes barcodes to new orders.
+
+Run from the repository root with::
+
+    $ python benchmarks/bench_allocate.py --rows 1000000 --quantity 3
+
+"""
+
+import argparse
+from array import array
+import time
+
+from mini_vouchers.csv_utils import BarcodeBatch
+from mini_vouchers.voucher_system import VoucherSystem
+
+
+def make_system(rows: int) -> VoucherSystem:
+    """Build a system where every barcode is available."""
+    barcodes = [f"{i:012d}" for i in range(rows)]
+    system = VoucherSystem()
+    system.populate_batches([BarcodeBatch(barcodes, array("q", bytes(8 * rows)))], [])
+    # Sort the index ahead, it is not part of the allocation.
+    system.get_available_barcodes()
+    return system
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--quantity", type=int, default=3)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    orders = args.rows // args.quantity
+
+    system = make_system(args.rows)
+    start = time.perf_counter()
+    for customer_id in range(orders):
+        system.place_order(customer_id % 1000 + 1, args.quantity)
+    elapsed = time.perf_counter() - start
+    print(f"{'place_order':<32} {orders * args.quantity / elapsed:12,.0f} barcodes/s")
+
+    system = make_system(args.rows)
+    requests = [(i % 1000 + 1, args.quantity) for i in range(args.batch)]
+    start = time.perf_counter()
+    for _ in range(orders // args.batch):
+        system.place_orders(requests)
+    elapsed = time.perf_counter() - start
+    placed = orders // args.batch * args.batch * args.quantity
+    print(f"{'place_orders':<32} {placed / elapsed:12,.0f} barcodes/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Compare the line-based CSV parsers with the block-based readers.
+
+Run from the repository root with::
+
+    $ python benchmarks/bench_csv.py --rows 1000000
+
+"""
+
+import argparse
+from io import StringIO
+import os
+import tempfile
+import time
+import tracemalloc
+
+from mini_vouchers.__main__ import trim_lines
+from mini_vouchers.csv_utils import (
+    parse_barcodes,
+    parse_orders,
+    read_barcode_batches,
+    read_barcodes,
+    read_orders,
+)
+from mini_vouchers.mapped import read_mapped_barcode_batches
+
+
+def make_barcodes_csv(rows: int) -> str:
+    """Build a barcodes CSV document where one barcode out of three is free."""
+    lines = ["barcode,order_id"]
+    for i in range(rows):
+        lines.append(f"{i:012d},{i // 3 if i % 3 else ''}")
+    return "\n".join(lines) + "\n"
+
+
+def make_orders_csv(rows: int) -> str:
+    """Build an orders CSV document spread over a tenth as many customers."""
+    lines = ["order_id,customer_id"]
+    for i in range(1, rows + 1):
+        lines.append(f"{i},{i % max(1, rows // 10) + 1}")
+    return "\n".join(lines) + "\n"
+
+
+def timed(label: str, function, document: str) -> float:
+    """Time a full consumption of a parser over a document."""
+    start = time.perf_counter()
+    count = sum(1 for _ in function(StringIO(document)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {count:>10} rows {elapsed:8.3f} s")
+    return elapsed
+
+
+def timed_file(label: str, function, path: str):
+    """Time a full consumption of a batch reader over a file, and its memory.
+
+    The memory is traced in a second run so as not to slow the timed one down.
+    """
+    start = time.perf_counter()
+    count = sum(len(batch.barcodes) for batch in function(path))
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for _ in function(path):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<32} {count:>10} rows {elapsed:8.3f} s {peak >> 10:>8} KiB peak")
+
+
+def read_text_batches(path: str):
+    """Read a barcodes file as a text stream, batch by batch."""
+    with open(path) as csv_file:
+        yield from read_barcode_batches(csv_file)
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    barcodes = make_barcodes_csv(args.rows)
+    orders = make_orders_csv(args.rows // 3)
+
+    slow = timed(
+        "parse_barcodes(trim_lines(...))",
+        lambda stream: parse_barcodes(trim_lines(stream)),
+        barcodes,
+    )
+    fast = timed("read_barcodes(...)", read_barcodes, barcodes)
+    print(f"{'speedup':<32} {slow / fast:>10.2f}x")
+
+    slow = timed(
+        "parse_orders(trim_lines(...))",
+        lambda stream: parse_orders(trim_lines(stream)),
+        orders,
+    )
+    fast = timed("read_orders(...)", read_orders, orders)
+    print(f"{'speedup':<32} {slow / fast:>10.2f}x")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "barcodes.csv")
+        with open(path, "w") as csv_file:
+            csv_file.write(barcodes)
+        del barcodes
+
+        timed_file("read_barcode_batches(open(...))", read_text_batches, path)
+        timed_file(
+            "read_mapped_barcode_batches(...)", read_mapped_barcode_batches, path
+        )
+
+
+if __name__ == "__main__":
+    main()
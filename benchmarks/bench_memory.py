@@ -0,0 +1,78 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Compare the memory held by the voucher system storages.
+
+Run from the repository root with::
+
+    $ python benchmarks/bench_memory.py --rows 1000000
+
+"""
+
+import argparse
+from io import StringIO
+import logging
+import time
+import tracemalloc
+
+from bench_csv import make_barcodes_csv, make_orders_csv
+from mini_vouchers.compact import CompactVoucherSystem
+from mini_vouchers.csv_utils import read_barcode_batches, read_order_batches
+from mini_vouchers.voucher_system import VoucherSystem
+
+
+def measure(label: str, factory, barcodes: str, orders: str):
+    """Populate a system and report the memory it retains and its peak."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    system = factory()
+    system.populate_batches(
+        read_barcode_batches(StringIO(barcodes)), read_order_batches(StringIO(orders))
+    )
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rows = barcodes.count("\n") - 1
+    print(
+        f"{label:<10} {elapsed:8.3f} s (traced) {retained >> 20:>6} MiB retained "
+        f"{peak >> 20:>6} MiB peak {retained / rows:>8.1f} B/barcode"
+    )
+    return system
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    # The benchmark is about the storage, not about the logs.
+    logging.disable(logging.WARNING)
+
+    barcodes = make_barcodes_csv(args.rows)
+    orders = make_orders_csv(args.rows // 3)
+
+    for label, factory in [
+        ("memory", VoucherSystem),
+        ("compact", CompactVoucherSystem),
+    ]:
+        measure(label, factory, barcodes, orders)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Compare the row-based and the columnar ingestion of a voucher system.
+
+Run from the repository root with::
+
+    $ python benchmarks/bench_populate.py --rows 1000000
+
+"""
+
+import argparse
+from io import StringIO
+import logging
+import time
+
+from bench_csv import make_barcodes_csv, make_orders_csv
+from mini_vouchers.csv_utils import (
+    read_barcode_batches,
+    read_barcodes,
+    read_order_batches,
+    read_orders,
+)
+from mini_vouchers.voucher_system import VoucherSystem
+
+
+def populate_rows(barcodes: str, orders: str) -> VoucherSystem:
+    """Populate a system one exported tuple at a time."""
+    system = VoucherSystem()
+    system.populate(read_barcodes(StringIO(barcodes)), read_orders(StringIO(orders)))
+    return system
+
+
+def populate_batches(barcodes: str, orders: str) -> VoucherSystem:
+    """Populate a system one columnar batch at a time."""
+    system = VoucherSystem()
+    system.populate_batches(
+        read_barcode_batches(StringIO(barcodes)), read_order_batches(StringIO(orders))
+    )
+    return system
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    # The benchmark is about the ingestion, not about the logs.
+    logging.disable(logging.WARNING)
+
+    barcodes = make_barcodes_csv(args.rows)
+    orders = make_orders_csv(args.rows // 3)
+
+    timings = {}
+    for label, function in [("populate", populate_rows), ("batches", populate_batches)]:
+        start = time.perf_counter()
+        function(barcodes, orders)
+        timings[label] = time.perf_counter() - start
+        print(f"{label:<32} {timings[label]:8.3f} s")
+    print(f"{'speedup':<32} {timings['populate'] / timings['batches']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Generate a synthetic dataset of barcodes and orders.
+
+The dataset is fully determined by its parameters and its seed. It is written
+as it is generated, so that its size is only bounded by the disk:
+
+    $ python benchmarks/generate.py --rows 100000000 --directory /tmp/dataset
+
+The rows hold the flaws the voucher system is meant to clean: duplicate
+barcodes and orders, barcodes attributed to unknown orders, and orders without
+barcodes. The customers are spread on a log-uniform scale, a few of them
+placing most of the orders.
+"""
+
+import argparse
+import os
+import random
+from typing import NamedTuple
+
+
+BARCODE_MODULUS = 10**12
+"""The amount of distinct barcodes, all of them 12 digits long."""
+BARCODE_STRIDE = 761_838_257_287
+"""A multiplier coprime with :py:const:`BARCODE_MODULUS`, scattering the
+barcodes without repeating them."""
+EMPTY_ORDER_STRIDE = 7919
+"""A multiplier scattering the orders without barcodes."""
+FLUSH_ROWS = 1 << 16
+"""The amount of rows written at once."""
+
+
+class Rates(NamedTuple):
+    """The proportions of each kind of row of a dataset."""
+
+    duplicate: float = 0.001
+    """The proportion of duplicate barcodes and duplicate orders."""
+    orphan: float = 0.005
+    """The proportion of barcodes attributed to unknown orders."""
+    available: float = 0.3
+    """The proportion of available barcodes."""
+    empty_order: float = 0.02
+    """The proportion of orders without barcodes."""
+
+
+def barcode_value(index: int) -> str:
+    """Get the distinct barcode value of a given index.
+
+    >>> barcode_value(0), barcode_value(1)
+    ('000000000000', '761838257287')
+
+    """
+    return f"{index * BARCODE_STRIDE % BARCODE_MODULUS:012d}"
+
+
+def is_empty_order(order_id: int, rate: float) -> bool:
+    """Whether an order is meant to have no barcodes."""
+    return order_id * EMPTY_ORDER_STRIDE % 1000 < rate * 1000
+
+
+def write_orders(path: str, orders: int, rates: Rates, seed: int) -> int:
+    """Write the orders CSV file.
+
+    :param path: The path of the file to write.
+    :param orders: The amount of orders, duplicates included.
+    :param rates: The proportions of each kind of row.
+    :param seed: The seed of the generator.
+    :returns: The amount of distinct orders, identified from `1` up to it.
+
+    """
+    rng = random.Random(seed)
+    customers = max(2, orders // 4)
+
+    with open(path, "w") as csv_file:
+        csv_file.write("order_id,customer_id\n")
+        lines = []
+        order_id = 0
+        for _ in range(orders):
+            if order_id and rng.random() < rates.duplicate:
+                # Export the last order again, for another customer.
+                lines.append(f"{order_id},{rng.randint(1, customers)}\n")
+            else:
+                order_id += 1
+                lines.append(f"{order_id},{int(customers ** rng.random())}\n")
+
+            if len(lines) >= FLUSH_ROWS:
+                csv_file.write("".join(lines))
+                lines.clear()
+        csv_file.write("".join(lines))
+    return order_id
+
+
+def write_barcodes(path: str, barcodes: int, orders: int, rates: Rates, seed: int):
+    """Write the barcodes CSV file.
+
+    :param path: The path of the file to write.
+    :param barcodes: The amount of barcodes, duplicates included.
+    :param orders: The amount of distinct orders the barcodes may be attributed
+        to, identified from `1` up to it.
+    :param rates: The proportions of each kind of row.
+    :param seed: The seed of the generator.
+    :raises ValueError: If every order is meant to have no barcodes.
+
+    """
+    orders = max(1, orders)
+    # The orders without barcodes repeat every 1000 identifiers.
+    if all(
+        is_empty_order(order_id, rates.empty_order)
+        for order_id in range(1, min(orders, 1000) + 1)
+    ):
+        raise ValueError(
+            f"No order may have barcodes at an empty order rate of "
+            f"{rates.empty_order}"
+        )
+
+    rng = random.Random(seed)
+    duplicate = rates.duplicate
+    orphan = duplicate + rates.orphan
+    available = orphan + rates.available
+
+    with open(path, "w") as csv_file:
+        csv_file.write("barcode,order_id\n")
+        lines = []
+        index = 0
+        attributed = 0
+        for _ in range(barcodes):
+            draw = rng.random()
+            if index and draw < duplicate:
+                # Export the last barcode again, possibly attributed elsewhere.
+                barcode = barcode_value(index - 1)
+                lines.append(f"{barcode},{rng.randint(1, orders)}\n")
+                continue
+
+            barcode = barcode_value(index)
+            index += 1
+            if draw < orphan:
+                order_id = orders + rng.randint(1, orders)
+                lines.append(f"{barcode},{order_id}\n")
+            elif draw < available:
+                lines.append(f"{barcode},\n")
+            else:
+                # Attribute a barcode to every order first, then at random.
+                order_id = attributed + 1 if attributed < orders else None
+                order_id = order_id or rng.randint(1, orders)
+                attributed += 1
+                while is_empty_order(order_id, rates.empty_order):
+                    order_id = order_id % orders + 1
+                lines.append(f"{barcode},{order_id}\n")
+
+            if len(lines) >= FLUSH_ROWS:
+                csv_file.write("".join(lines))
+                lines.clear()
+        csv_file.write("".join(lines))
+
+
+def generate(
+    directory: str, barcodes: int, orders: int, rates: Rates = Rates(), seed: int = 0
+):
+    """Write a dataset as `barcodes.csv` and `orders.csv` files.
+
+    :param directory: The directory to write the files to.
+    :param barcodes: The amount of barcodes, duplicates included.
+    :param orders: The amount of orders, duplicates included.
+    :param rates: The proportions of each kind of row.
+    :param seed: The seed of the generator. Each file is generated from its
+        own seed, so that the amount of rows of one does not change the other.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    distinct_orders = write_orders(
+        os.path.join(directory, "orders.csv"), orders, rates, seed
+    )
+    write_barcodes(
+        os.path.join(directory, "barcodes.csv"),
+        barcodes,
+        distinct_orders,
+        rates,
+        seed + 1,
+    )
+
+
+def main():
+    """Generate a dataset."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument(
+        "--orders", type=int, help="Defaults to a third of the amount of rows."
+    )
+    parser.add_argument("--directory", default=".")
+    parser.add_argument("--seed", type=int, default=0)
+    defaults = Rates()
+    for rate in Rates._fields:
+        parser.add_argument(
+            f"--{rate.replace('_', '-')}-rate",
+            dest=rate,
+            type=float,
+            default=getattr(defaults, rate),
+        )
+    args = parser.parse_args()
+
+    orders = args.orders if args.orders is not None else args.rows // 3
+    rates = Rates(*(getattr(args, rate) for rate in Rates._fields))
+    try:
+        generate(args.directory, args.rows, orders, rates, args.seed)
+    except ValueError as error:
+        parser.error(str(error))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Time the parsers, the population and the CLI actions against a baseline.
+
+Run from the repository root with::
+
+    $ python benchmarks/suite.py --rows 100000
+
+A synthetic dataset is generated (see `generate.py`) and each benchmark is
+timed, keeping the best of several runs, and its peak memory is measured. The
+results are compared with the stored baseline, and the suite fails if any of
+them regressed beyond a tolerance. The timings depend on the machine: refresh
+the baseline with `--save` when changing machines, or to accept a change.
+
+The peak memory of the library benchmarks is the one traced by
+:py:mod:`tracemalloc`, in a run of its own, while the peak memory of the CLI
+actions is the maximum resident set size of their process. That process is
+started by a small launcher rather than by the suite, as a process starts with
+the resident set size of the process it is forked from.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from generate import generate
+from mini_vouchers.__main__ import trim_lines
+from mini_vouchers.csv_utils import parse_barcodes, parse_orders
+from mini_vouchers.voucher_system import VoucherSystem
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+"""The path of the stored baseline."""
+ACTIONS = ("print", "summary", "top5")
+"""The CLI actions to time."""
+
+LAUNCHER = """
+import resource, subprocess, sys, time
+start = time.perf_counter()
+subprocess.run(sys.argv[1:], stdout=subprocess.DEVNULL, check=True)
+seconds = time.perf_counter() - start
+print(seconds, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+"""
+"""The script running a command and printing its time and peak resident memory."""
+
+Result = Dict[str, float]
+
+
+def measure(function: Callable[[], object], repeat: int) -> Result:
+    """Time a function, keeping the best run, and trace its peak memory.
+
+    The garbage collector is paused while timing, as :py:mod:`timeit` does.
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function()
+            seconds = min(seconds, time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_kib": peak >> 10}
+
+
+def measure_command(command: List[str], repeat: int) -> Result:
+    """Time a command, keeping the best run, and get its peak resident memory."""
+    seconds = float("inf")
+    peak = 0
+    for _ in range(repeat):
+        launched = subprocess.run(
+            [sys.executable, "-c", LAUNCHER, *command],
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        )
+        run_seconds, run_peak = launched.stdout.split()
+        seconds = min(seconds, float(run_seconds))
+
+        # The resident set size is in KiB on Linux.
+        peak = max(peak, int(run_peak))
+    return {"seconds": seconds, "peak_kib": peak}
+
+
+def read_lines(path: str) -> List[str]:
+    """Read the trimmed lines of a file."""
+    with open(path) as csv_file:
+        return list(trim_lines(csv_file))
+
+
+def run(directory: str, repeat: int) -> Dict[str, Result]:
+    """Run the benchmarks over a dataset.
+
+    :param directory: The directory holding the dataset.
+    :param repeat: The amount of timed runs of each benchmark.
+    :returns: The results, by benchmark.
+
+    """
+    barcodes_path = os.path.join(directory, "barcodes.csv")
+    orders_path = os.path.join(directory, "orders.csv")
+    barcode_lines = read_lines(barcodes_path)
+    order_lines = read_lines(orders_path)
+    exported_barcodes = list(parse_barcodes(barcode_lines))
+    exported_orders = list(parse_orders(order_lines))
+
+    benchmarks: List[Tuple[str, Callable[[], object]]] = [
+        ("parse_barcodes", lambda: list(parse_barcodes(barcode_lines))),
+        ("parse_orders", lambda: list(parse_orders(order_lines))),
+        (
+            "populate",
+            lambda: VoucherSystem().populate(exported_barcodes, exported_orders),
+        ),
+    ]
+
+    results = {}
+    for name, function in benchmarks:
+        results[name] = measure(function, repeat)
+
+    for action in ACTIONS:
+        command = [sys.executable, "-m", "mini_vouchers", "-q", action]
+        command += ["--barcodes", barcodes_path, "--orders", orders_path]
+        results[f"cli {action}"] = measure_command(command, repeat)
+
+    return results
+
+
+def compare(
+    results: Dict[str, Result], baseline: Dict[str, Result], tolerance: float
+) -> int:
+    """Print the results along with their ratio to the baseline.
+
+    :returns: The amount of results beyond the tolerance.
+
+    """
+    regressions = 0
+    print(
+        f"{'benchmark':<20} {'seconds':>10} {'ratio':>7} {'peak KiB':>10} {'ratio':>7}"
+    )
+    for name, result in results.items():
+        line = f"{name:<20} {result['seconds']:>10.3f}"
+        reference = baseline.get(name)
+        if reference is None:
+            print(f"{line} {'':>7} {result['peak_kib']:>10.0f}")
+            continue
+
+        time_ratio = result["seconds"] / reference["seconds"]
+        memory_ratio = result["peak_kib"] / max(1, reference["peak_kib"])
+        line += (
+            f" {time_ratio:>6.2f}x {result['peak_kib']:>10.0f} {memory_ratio:>6.2f}x"
+        )
+        if max(time_ratio, memory_ratio) > 1 + tolerance:
+            line += "  REGRESSION"
+            regressions += 1
+        print(line)
+    return regressions
+
+
+def main():
+    """Run the benchmark suite."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="The slowdown or memory growth tolerated, e.g. `0.25` for 25%%.",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Store the results as the baseline."
+    )
+    args = parser.parse_args()
+
+    # The benchmark is about the ingestion, not about the logs.
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        generate(directory, args.rows, args.rows // 3, seed=args.seed)
+        results = run(directory, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            stored = json.load(baseline_file)
+        if stored["rows"] == args.rows and stored["seed"] == args.seed:
+            baseline = stored["results"]
+        else:
+            print(f"The baseline was measured over {stored['rows']} rows, ignoring it")
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(
+                {"rows": args.rows, "seed": args.seed, "results": results},
+                baseline_file,
+                indent=2,
+                sort_keys=True,
+            )
+            baseline_file.write("\n")
+    elif regressions:
+        sys.exit(f"{regressions} benchmarks regressed beyond the tolerance")
+
+
+if __name__ == "__main__":
+    main()
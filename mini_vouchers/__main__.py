@@ -18,13 +18,62 @@
 """Main entry point of the Mini Vouchers command line interface."""
 
 import argparse
+from contextlib import ExitStack, contextmanager
+import cProfile
+from functools import partial
+import itertools
+import json
 import logging
+import os
+import signal
 import sys
-from typing import TextIO
+import threading
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 
-from mini_vouchers.csv_utils import parse_barcodes, parse_orders
-from mini_vouchers.voucher_system import VoucherSystem
+from mini_vouchers.compact import CompactVoucherSystem
+from mini_vouchers.compressed import READ_ERRORS, detect_compression, open_text
+from mini_vouchers.csv_utils import (
+    BarcodeBatch,
+    OrderBatch,
+    read_barcode_batches,
+    read_order_batches,
+)
+from mini_vouchers.dedup import (
+    DEFAULT_BUDGET,
+    deduplicate,
+    deduplicate_batches,
+    write_barcodes,
+)
+from mini_vouchers.external_sort import external_sorted, parse_size
+from mini_vouchers.follow import DEFAULT_INTERVAL, Follower
+from mini_vouchers.mapped import read_mapped_order_batches
+from mini_vouchers.parallel import expand_paths, read_barcode_files
+from mini_vouchers.profiling import NULL_PROFILER, NullProfiler, Profiler
+from mini_vouchers.report import IngestionReport
+from mini_vouchers.server import (
+    DEFAULT_HOST,
+    DEFAULT_MAX_BATCH,
+    DEFAULT_PORT,
+    VoucherServer,
+    serve,
+)
+from mini_vouchers.sharded import ShardedVoucherSystem
+from mini_vouchers.sketch import TopCustomersSketch
+from mini_vouchers.sqlite import SqliteVoucherSystem
+from mini_vouchers.snapshot import load_snapshot, save_snapshot
+from mini_vouchers.voucher_system import VoucherSystem, customer_order_key
+from mini_vouchers.writers import FORMATS, VoucherWriter
 
 
 LOG_FORMAT = "%(asctime)s | [%(levelname)s] %(name)s: %(message)s"
@@ -37,6 +86,99 @@ LOG_LEVELS = [
     logging.CRITICAL,
 ]
 DEFAULT_LOG_LEVEL = logging.WARNING
+DEFAULT_TOP_LIMIT = 5
+RECORD_OVERHEAD = 128
+"""The approximate size of a sort record besides its line, in bytes."""
+STORAGES = {
+    "memory": VoucherSystem,
+    "compact": CompactVoucherSystem,
+    "sqlite": SqliteVoucherSystem,
+}
+AnyProfiler = Union[Profiler, NullProfiler]
+ACTIONS = ("print", "summary", "top", "top5", "lookup", "serve", "dedup")
+"""The actions of the command line."""
+
+
+class Action(NamedTuple):
+    """An action of the command line."""
+
+    name: str
+    """The name of the action, e.g. `top`."""
+    limit: Optional[int] = None
+    """The amount of customers printed by `top`."""
+    path: Optional[str] = None
+    """The path of the file to print to, or `-` for `stdout`. Defaults to the
+    output of the command line."""
+
+
+def parse_actions(tokens: List[str]) -> List[Action]:
+    """Parse the actions given on the command line.
+
+    Each action may be suffixed by `=PATH` to print to its own file, and `top`
+    may be followed by its limit.
+
+    >>> parse_actions(["print=vouchers.txt", "summary", "top", "3", "top5=-"])
+    [Action(name='print', limit=None, path='vouchers.txt'), \
+Action(name='summary', limit=None, path=None), \
+Action(name='top', limit=3, path=None), Action(name='top', limit=5, path='-')]
+
+    Actions printing the same output twice are rejected:
+
+    >>> parse_actions(["print", "top", "print"])
+    Traceback (most recent call last):
+        ...
+    ValueError: argument action: `print` given twice to the same output
+
+    :param tokens: The positional arguments of the command line.
+    :returns: A fresh list of actions, `print` if there are none.
+    :raises ValueError: If an action is unknown or given twice, or a limit is
+        misplaced.
+
+    """
+    actions: List[Action] = []
+    for token in tokens:
+        if token.lstrip("-").isdigit():
+            if (
+                not actions
+                or actions[-1].name != "top"
+                or actions[-1].limit is not None
+            ):
+                raise ValueError("argument limit: only allowed with the `top` action")
+            if int(token) < 0:
+                raise ValueError("argument limit: must not be negative")
+            actions[-1] = actions[-1]._replace(limit=int(token))
+            continue
+
+        name, _, path = token.partition("=")
+        if name not in ACTIONS:
+            raise ValueError(f"argument action: invalid choice: {name!r}")
+        if token.endswith("=") and not path:
+            raise ValueError(f"argument action: missing path: {token!r}")
+
+        action = Action(name, None, path or None)
+        if name == "top5":
+            action = action._replace(name="top", limit=5)
+        actions.append(action)
+
+    # Only the limits that were omitted are defaulted, `top 0` being valid.
+    actions = [
+        (
+            action._replace(limit=DEFAULT_TOP_LIMIT)
+            if action.name == "top" and action.limit is None
+            else action
+        )
+        for action in actions
+    ]
+    if [action.name for action in actions].count("serve") > 1:
+        raise ValueError("argument action: `serve` may only be given once")
+    for index, action in enumerate(actions):
+        if action.path is None and action in actions[:index]:
+            raise ValueError(
+                f"argument action: `{action.name}` given twice to the same output"
+            )
+    if len(actions) > 1 and any(action.name == "dedup" for action in actions):
+        raise ValueError("argument action: `dedup` may only be given alone")
+    return actions or [Action("print")]
 
 
 def get_log_level(verbose: int, quiet: int) -> int:
@@ -57,8 +199,23 @@ def get_log_level(verbose: int, quiet: int) -> int:
     return LOG_LEVELS[index]
 
 
-def cmdline_args():
-    """Define and parse command line arguments.
+def cmdline_args(argv: List[str] = None):
+    r"""Define and parse command line arguments.
+
+    Compressed files cannot be followed, their offsets being meaningless:
+
+    >>> import gzip, tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".csv.gz") as compressed_file:
+    ...     _ = compressed_file.write(gzip.compress(b"barcode,order_id\n"))
+    ...     compressed_file.flush()
+    ...     cmdline_args(["summary", "--follow", "--barcodes",
+    ...                   compressed_file.name, "--orders", __file__])
+    Traceback (most recent call last):
+        ...
+    SystemExit: 2
+
+    Args:
+        argv: The command line arguments. Defaults to those of the process.
 
     Returns:
         The populated :py:class:`argparse.Namespace` from the command line
@@ -68,35 +225,210 @@ def cmdline_args():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
-        "action",
-        choices=["print", "summary", "top5"],
-        default="print",
-        nargs="?",
+        "actions",
+        nargs="*",
+        metavar="action",
         help=(
-            "The action to execute. Print all vouchers in the system "
-            "(`print`). Briefly describe the dataset (`summary`). Print the "
-            "identifier of the customers who bought the most tickets in a "
-            "machine-readable format where each line is `customer_id, "
-            "amount_of_barcodes` (`top5`). Defaults to `%(default)s`."
+            "The actions to execute, from a single load of the dataset. Print "
+            "all vouchers in the system (`print`). Briefly describe the "
+            "dataset (`summary`). Print the identifier of the `N` customers "
+            "who bought the most tickets in a machine-readable format where "
+            "each line is `customer_id, amount_of_barcodes` (`top N`, `N` "
+            f"defaulting to `{DEFAULT_TOP_LIMIT}` and `top5` being an alias of "
+            "`top 5`). Answer the queries read from `stdin`, one per line, "
+            "in batches and in the protocol of `serve` but for `place`, e.g. "
+            "`owner BARCODE`, `customer ID` or `order ID` (`lookup`). Load the "
+            "system once and "
+            "answer queries over a socket (`serve`), after the other actions. "
+            "Only deduplicate the barcodes files, without loading the system, "
+            "and write the first occurrence of each barcode as CSV (`dedup`, "
+            "alone). "
+            "Each action prints to the output unless suffixed with `=PATH`, "
+            "e.g. `summary=summary.txt`. Defaults to `print`."
         ),
     )
 
     parser.add_argument(
         "--barcodes",
-        default="barcodes.csv",
-        type=argparse.FileType("r"),
+        action="append",
         help=(
-            "List of barcodes, in a CSV file. The expected data is a set of "
-            "unique `barcode`s that are optionally mapped to an `order_id`."
+            "List of barcodes, in a CSV file or `-` for `stdin`. May be used "
+            "several times and accepts glob patterns, the files being read in "
+            "order. The expected data is a set of unique `barcode`s that are "
+            "optionally mapped to an `order_id`. The files may be compressed "
+            "with gzip, xz or bzip2. Defaults to `barcodes.csv`."
         ),
     )
     parser.add_argument(
         "--orders",
         default="orders.csv",
-        type=argparse.FileType("r"),
         help=(
-            "List of customer orders, in a CSV file. The expected data is a "
-            "set of unique `order_id`s each mapped to a `customer_id`."
+            "List of customer orders, in a CSV file or `-` for `stdin`. The "
+            "expected data is a set of unique `order_id`s each mapped to a "
+            "`customer_id`, both signed 64-bit integers. The file may be "
+            "compressed with gzip, xz or bzip2. Defaults to `%(default)s`."
+        ),
+    )
+    parser.add_argument(
+        "--mmap",
+        action="store_true",
+        help=(
+            "Map the input files in memory and parse them straight from the "
+            "mapped bytes instead of reading them as text streams."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=1,
+        type=int,
+        help=(
+            "Amount of processes parsing the barcodes files. Large files are "
+            "split into ranges of lines. Defaults to `%(default)s`."
+        ),
+    )
+    parser.add_argument(
+        "--storage",
+        choices=sorted(STORAGES),
+        default="memory",
+        help=(
+            "How the system stores its data. Plain Python objects (`memory`), "
+            "packed tables that take a fraction of the memory (`compact`), or "
+            "a temporary SQLite database on disk (`sqlite`). Defaults to "
+            "`%(default)s`."
+        ),
+    )
+    parser.add_argument(
+        "--shards",
+        default=1,
+        type=int,
+        help=(
+            "Amount of processes the orders are partitioned across, by "
+            "customer, in `memory` storage. The queries are answered by "
+            "merging the results of each process. Defaults to `%(default)s`."
+        ),
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        help=(
+            "Follow the CSV files as they are appended to, and print the "
+            "`summary` and `top` actions again after each update reading new "
+            "rows. Only the rows appended since the last update are parsed and "
+            "applied to the system. The files must not be compressed. Runs "
+            "until interrupted."
+        ),
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        metavar="SECONDS",
+        help="The time between two updates of `--follow`. Defaults to `%(default)s`.",
+    )
+    parser.add_argument(
+        "--top-sketch",
+        type=int,
+        metavar="CAPACITY",
+        help=(
+            "Estimate the top customers in a single pass over the CSV files, "
+            "counting at most this many customers, without loading the system. "
+            "Only the customer totals are bounded: the customer of every order "
+            "is still held in memory, while the barcodes are not. Each line "
+            "printed by `top` then ends with the maximum overestimation of the "
+            "amount, and only `top` actions may be given. The top customers "
+            "are otherwise exact."
+        ),
+    )
+    parser.add_argument(
+        "--rejects",
+        metavar="PATH",
+        help=(
+            "Write the rows rejected while reading the CSV files to a CSV file, "
+            "along with the reason of their rejection."
+        ),
+    )
+    parser.add_argument(
+        "--log-rows",
+        action="store_true",
+        help=(
+            "Log each row as it is rejected. Only a summary of the rejected rows "
+            "is logged otherwise."
+        ),
+    )
+    parser.add_argument(
+        "--snapshot-in",
+        metavar="PATH",
+        help=(
+            "Load the system from a snapshot file instead of the CSV files. "
+            "Loading in `compact` storage maps the file in memory and is "
+            "almost instant."
+        ),
+    )
+    parser.add_argument(
+        "--snapshot-out",
+        metavar="PATH",
+        help="Save the populated system to a snapshot file.",
+    )
+    parser.add_argument(
+        "--sort-budget",
+        type=parse_size,
+        help=(
+            "Sort the printed vouchers within about this amount of memory, "
+            "e.g. `512M`, spilling sorted runs to temporary files. The "
+            "vouchers are otherwise sorted in memory."
+        ),
+    )
+    parser.add_argument(
+        "--dedup-budget",
+        type=parse_size,
+        default=DEFAULT_BUDGET,
+        help=(
+            "Deduplicate the barcodes with `dedup` or `--top-sketch` within "
+            "about this amount of memory, e.g. `512M`, spilling partitions to "
+            "temporary files. "
+            "Defaults to `256M`."
+        ),
+    )
+    parser.add_argument(
+        "--host",
+        default=DEFAULT_HOST,
+        help="The address `serve` listens on. Defaults to `%(default)s`.",
+    )
+    parser.add_argument(
+        "--port",
+        default=DEFAULT_PORT,
+        type=int,
+        help="The port `serve` listens on. Defaults to `%(default)s`.",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="The Unix socket `serve` listens on instead of a port.",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help=(
+            "Write the wall and CPU time, the throughput and the peak memory of "
+            "each stage of the run to a JSON file, or to `stderr` with `-`. "
+            "The peak memory is traced when tracing is enabled, e.g. by the "
+            "`PYTHONTRACEMALLOC` environment variable."
+        ),
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="PATH",
+        help="Write the cProfile statistics of the run to a file.",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        default="text",
+        help=(
+            "The format of the printed vouchers: lines of comma-separated "
+            "values (`text`), JSON objects (`jsonl`), or a CSV file with a row "
+            "per barcode (`csv`). Defaults to `%(default)s`."
         ),
     )
     parser.add_argument(
@@ -129,7 +461,78 @@ def cmdline_args():
         help="Increase log level verbosity. May be used several times.",
     )
 
-    return parser.parse_args()
+    args = parser.parse_args(argv)
+
+    try:
+        args.actions = parse_actions(args.actions)
+    except ValueError as error:
+        parser.error(str(error))
+
+    if args.jobs < 1:
+        parser.error("argument --jobs/-j: must be at least 1")
+
+    if args.shards < 1:
+        parser.error("argument --shards: must be at least 1")
+    if args.shards > 1 and args.storage != "memory":
+        parser.error("argument --shards: requires the `memory` storage")
+
+    if any(action.name == "lookup" for action in args.actions) and (
+        args.barcodes == ["-"] or args.orders == "-"
+    ):
+        parser.error("argument action: `lookup` reads the queries from `stdin`")
+
+    if args.sort_budget is not None and args.sort_budget <= 0:
+        parser.error("argument --sort-budget: must be positive")
+    if args.dedup_budget <= 0:
+        parser.error("argument --dedup-budget: must be positive")
+
+    if args.top_sketch is not None:
+        if args.top_sketch < 1:
+            parser.error("argument --top-sketch: must be at least 1")
+        if any(action.name != "top" for action in args.actions):
+            parser.error("argument --top-sketch: only allowed with `top` actions")
+        if args.snapshot_in is not None or args.snapshot_out is not None:
+            parser.error("argument --top-sketch: not allowed with snapshots")
+
+    if args.follow:
+        if any(action.name not in ("summary", "top") for action in args.actions):
+            parser.error("argument --follow: only allowed with `summary` and `top`")
+        if args.storage != "memory" or args.shards > 1 or args.top_sketch:
+            parser.error("argument --follow: requires the `memory` storage")
+        if args.snapshot_in is not None or args.snapshot_out is not None:
+            parser.error("argument --follow: not allowed with snapshots")
+        if args.barcodes == ["-"] or args.orders == "-":
+            parser.error("argument --follow: not allowed with `stdin`")
+        if args.interval < 0:
+            parser.error("argument --interval: must be positive")
+
+    deduplicating = args.actions[0].name == "dedup"
+    if deduplicating and args.snapshot_in is not None:
+        parser.error("argument action: `dedup` reads the barcodes files")
+
+    if args.snapshot_in is not None:
+        if not os.path.isfile(args.snapshot_in):
+            parser.error(f"argument --snapshot-in: can't open '{args.snapshot_in}'")
+        return args
+
+    if args.barcodes is None:
+        args.barcodes = ["barcodes.csv"]
+
+    if args.barcodes != ["-"]:
+        args.barcodes = expand_paths(args.barcodes)
+        for path in args.barcodes:
+            if not os.path.isfile(path):
+                parser.error(f"argument --barcodes: can't open '{path}'")
+
+    if not deduplicating and args.orders != "-" and not os.path.isfile(args.orders):
+        parser.error(f"argument --orders: can't open '{args.orders}'")
+
+    if args.follow:
+        for path in [*args.barcodes, args.orders]:
+            if detect_compression(path) is not None:
+                parser.error(f"argument --follow: can't follow compressed '{path}'")
+
+    return args
 
 
 def trim_lines(text_stream: TextIO):
@@ -143,26 +546,127 @@ def trim_lines(text_stream: TextIO):
         yield line.strip()
 
 
-def do_print(system: VoucherSystem, output: TextIO):
+@contextmanager
+def exiting_on_read_errors(path: str, errors: Iterable[type] = READ_ERRORS):
+    """Exit with an error message if a file turns out to be unreadable.
+
+    >>> with exiting_on_read_errors("bad.snap", (ValueError, OSError)):
+    ...     raise ValueError("Not a voucher system snapshot")
+    Traceback (most recent call last):
+        ...
+    SystemExit: can't read 'bad.snap': Not a voucher system snapshot
+
+    :param path: The path of the file read in the context.
+    :param errors: The errors telling the file is unreadable. Defaults to
+        those of corrupt or truncated compressed files.
+
+    """
+    try:
+        yield
+    except tuple(errors) as error:
+        sys.exit(f"can't read '{path}': {error}")
+
+
+def read_barcode_inputs(
+    args: argparse.Namespace, report: IngestionReport = None
+) -> Iterator[BarcodeBatch]:
+    """Read the barcodes files given on the command line.
+
+    Compressed files are decompressed as they are read, one at a time, while
+    the other files may be split and read in parallel.
+
+    :param args: The parsed command line arguments.
+    :param report: The report to account for the rejected rows in, if any.
+    :yields: The barcodes, batch by batch.
+
+    """
+    if args.barcodes == ["-"]:
+        yield from read_barcode_batches(sys.stdin, report=report)
+        return
+
+    for compressed, paths in itertools.groupby(args.barcodes, detect_compression):
+        if compressed is None:
+            yield from read_barcode_files(
+                list(paths), args.jobs, mapped=args.mmap, report=report
+            )
+            continue
+
+        for path in paths:
+            with exiting_on_read_errors(path), open_text(path) as barcodes_file:
+                yield from read_barcode_batches(barcodes_file, report=report)
+
+
+def read_order_inputs(
+    args: argparse.Namespace, report: IngestionReport = None
+) -> Iterator[OrderBatch]:
+    """Read the orders file given on the command line.
+
+    :param args: The parsed command line arguments.
+    :param report: The report to account for the rejected rows in, if any.
+    :yields: The orders, batch by batch.
+
+    """
+    if args.orders == "-":
+        yield from read_order_batches(sys.stdin, report=report)
+    elif args.mmap and detect_compression(args.orders) is None:
+        yield from read_mapped_order_batches(args.orders, report=report)
+    else:
+        with exiting_on_read_errors(args.orders), open_text(args.orders) as orders_file:
+            yield from read_order_batches(orders_file, report=report)
+
+
+def do_print(
+    system: VoucherSystem,
+    output: TextIO,
+    sort_budget: int = None,
+    profiler: AnyProfiler = NULL_PROFILER,
+    format_name: str = "text",
+):
     """Print all vouchers in the system.
 
-    Print a list of vouchers per customer in the form of:
+    Print a list of vouchers per customer, by default in the form of:
 
         customer_id, order_id, barcode[, barcode...]
 
-    The lines are sorted by customer identifer and order identifier.
+    The vouchers are sorted by customer identifer and order identifier, and
+    the barcodes of each voucher by value. See
+    :py:mod:`mini_vouchers.writers` for the other formats.
+
+    The orders are sorted in memory unless a sort budget is given. They are
+    then rendered and sorted by an external merge sort, spilling to temporary
+    files whatever exceeds the budget. Both ways print the same bytes.
 
     :param system: The populated voucher system to print from.
     :param output: The output stream to write to.
+    :param sort_budget: The approximate amount of bytes the sort may hold in
+        memory.
+    :param profiler: The profiler to measure the sort and the writes with.
+        They are measured together by the external merge sort.
+    :param format_name: The name of the format of the vouchers, see
+        :py:const:`mini_vouchers.writers.FORMATS`.
 
     """
-    for order in system.get_orders(
-        key=lambda order: (order.customer_id, order.order_id)
-    ):
-        # Flatten the barcodes into a comma-separated list of barcodes or into
-        # an empty string.
-        barcodes = ", ".join(order.barcodes)
-        output.write(f"{order.customer_id}, {order.order_id}, {barcodes}\n")
+    writer = VoucherWriter(output, format_name)
+
+    if sort_budget is None:
+        with profiler.measure("sort orders"):
+            orders = system.get_orders(key=customer_order_key)
+        with profiler.measure("write vouchers") as stage:
+            stage.rows += writer.write_orders(orders)
+        return
+
+    # The order identifiers are unique, the vouchers are thus never compared.
+    records = (
+        (order.customer_id, order.order_id, writer.render(order))
+        for order in system.iter_orders()
+    )
+    with profiler.measure("sort and write vouchers") as stage:
+        sorted_records = external_sorted(
+            records,
+            budget=sort_budget,
+            sizeof=lambda record: RECORD_OVERHEAD + sys.getsizeof(record[2]),
+        )
+        stage.rows += writer.write_rendered(voucher for _, _, voucher in sorted_records)
 
 
 def do_summary(system: VoucherSystem, output: TextIO):
@@ -175,32 +679,22 @@ def do_summary(system: VoucherSystem, output: TextIO):
     :param output: The output stream to write to.
 
     """
-    customers = set()
-    used_barcodes = 0
-
-    i = -1
-    for i, order in enumerate(system.get_orders()):
-        customers.add(order.customer_id)
-        used_barcodes += len(order.barcodes)
-
-    free_barcodes = len(system.get_available_barcodes())
-    total_barcodes = used_barcodes + free_barcodes
-    total_orders = i + 1
-    total_customers = len(customers)
+    stats = system.stats()
+    total_barcodes = stats.attributed_barcodes + stats.available_barcodes
 
     output.write(
-        f"The dataset contains {total_orders} orders from {total_customers} "
+        f"The dataset contains {stats.orders} orders from {stats.customers} "
         "customers.\n"
-        f"There are {free_barcodes} barcodes available out of a total of "
-        f"{total_barcodes} barcodes.\n"
+        f"There are {stats.available_barcodes} barcodes available out of a total "
+        f"of {total_barcodes} barcodes.\n"
     )
 
 
-def do_top5(system: VoucherSystem, output: TextIO):
-    """Print the top 5 customers.
+def do_top(system: VoucherSystem, output: TextIO, limit: int):
+    """Print the top customers.
 
-    Print a list of the five customers who bought the most barcodes in the form
-    of:
+    Print a list of the `limit` customers who bought the most barcodes in the
+    form of:
 
         customer_id, amount_of_barcodes
 
@@ -208,17 +702,341 @@ def do_top5(system: VoucherSystem, output: TextIO):
 
     :param system: The populated voucher system to print from.
     :param output: The output stream to write to.
+    :param limit: The amount of customers to print.
 
     """
-    for customer_id, amount in system.get_top_customers(5):
+    for customer_id, amount in system.get_top_customers(limit):
         output.write(f"{customer_id}, {amount}\n")
 
 
+def do_top_estimates(sketch: TopCustomersSketch, output: TextIO, limit: int):
+    """Print the estimated top customers.
+
+    Print a list of the `limit` customers who bought the most barcodes in the
+    form of:
+
+        customer_id, amount_of_barcodes, maximum_error
+
+    The actual amount of barcodes of each customer is between the amount minus
+    the error and the amount.
+
+    :param sketch: The populated sketch to print from.
+    :param output: The output stream to write to.
+    :param limit: The amount of customers to print.
+
+    """
+    for customer_id, amount, error in sketch.estimate_top_customers(limit):
+        output.write(f"{customer_id}, {amount}, {error}\n")
+
+
+def do_lookup(
+    system: VoucherSystem,
+    queries: TextIO,
+    output: TextIO,
+    batch_size: int = DEFAULT_MAX_BATCH,
+):
+    r"""Answer queries read from a text stream, a batch at a time.
+
+    The queries are those of :py:mod:`mini_vouchers.server`, and so are the
+    responses, each written as a line of JSON. The system is not modified:
+    placing orders is answered with an error.
+
+    >>> import io
+    >>> from mini_vouchers.csv_utils import ExportedBarcode, ExportedOrder
+    >>> system = VoucherSystem()
+    >>> system.populate([ExportedBarcode('a', 10), ExportedBarcode('b', 11)],
+    ...                 [ExportedOrder(10, 7), ExportedOrder(11, 7)])
+    >>> do_lookup(system, io.StringIO("owner b\n\norder 10\nplace 7 1\n"), sys.stdout)
+    {"order_id": 11, "customer_id": 7, "barcodes": ["b"]}
+    {"order_id": 10, "customer_id": 7, "barcodes": ["a"]}
+    {"error": "The system is read-only"}
+    >>> queries = io.StringIO("order 99999999999999999999\nowner a\n")
+    >>> do_lookup(system, queries, sys.stdout)
+    {"error": "Out of range integer 99999999999999999999"}
+    {"order_id": 10, "customer_id": 7, "barcodes": ["a"]}
+
+    :param system: The populated voucher system to query.
+    :param queries: The text stream to read the queries from, one per line.
+        Blank lines are skipped.
+    :param output: The output stream to write to.
+    :param batch_size: The amount of queries answered at once.
+
+    """
+    assert batch_size > 0
+
+    server = VoucherServer(system, batch_size, read_only=True)
+    lines = filter(None, trim_lines(queries))
+    while True:
+        batch = list(itertools.islice(lines, batch_size))
+        if not batch:
+            return
+        output.write(
+            "".join(
+                json.dumps(response) + "\n" for response in server.answer_safely(batch)
+            )
+        )
+
+
+class Tee:
+    """A text stream writing to several text streams at once."""
+
+    def __init__(self, streams: List[TextIO]):
+        """Initialise the stream.
+
+        :param streams: The streams to write to.
+
+        """
+        self.streams = streams
+
+    def write(self, text: str):
+        """Write a text to all the streams."""
+        for stream in self.streams:
+            stream.write(text)
+
+
+def do_actions(
+    system: VoucherSystem,
+    args: argparse.Namespace,
+    stack: ExitStack,
+    profiler: AnyProfiler = NULL_PROFILER,
+):
+    """Execute the actions of the command line, but `serve`.
+
+    The vouchers are printed in a single traversal of the orders, even to
+    several outputs, while the summary and the top customers are maintained
+    by the system as it is populated.
+
+    :param system: The populated voucher system to print from.
+    :param args: The parsed command line arguments.
+    :param stack: The stack to close the opened files with.
+    :param profiler: The profiler to measure the actions with.
+
+    """
+    # Actions printing to the same path share the same stream, in order.
+    streams: Dict[Optional[str], TextIO] = {None: args.output, "-": sys.stdout}
+
+    def output(action: Action) -> TextIO:
+        if action.path not in streams:
+            streams[action.path] = stack.enter_context(open(action.path, "w"))
+        return streams[action.path]
+
+    prints = [output(action) for action in args.actions if action.name == "print"]
+    printed = False
+
+    for action in args.actions:
+        if action.name == "print" and not printed:
+            with profiler.measure("print"):
+                do_print(
+                    system,
+                    Tee(prints) if len(prints) > 1 else prints[0],
+                    args.sort_budget,
+                    profiler,
+                    args.format,
+                )
+            printed = True
+        elif action.name == "summary":
+            with profiler.measure("summary"):
+                do_summary(system, output(action))
+        elif action.name == "top":
+            with profiler.measure("top"):
+                if isinstance(system, TopCustomersSketch):
+                    do_top_estimates(system, output(action), action.limit)
+                else:
+                    do_top(system, output(action), action.limit)
+        elif action.name == "lookup":
+            with profiler.measure("lookup"):
+                do_lookup(system, sys.stdin, output(action))
+
+
+def do_dedup(args: argparse.Namespace, profiler: AnyProfiler = NULL_PROFILER):
+    """Deduplicate the barcodes files, without loading them in a system.
+
+    The first occurrence of each barcode is written as a barcodes CSV file,
+    while the duplicates are reported as when populating a system.
+
+    :param args: The parsed command line arguments.
+    :param profiler: The profiler to measure the deduplication with.
+
+    """
+    (action,) = args.actions
+    report = IngestionReport(
+        keep_rejects=args.rejects is not None, log_rows=args.log_rows
+    )
+    barcode_batches, _ = read_measured_inputs(args, report, profiler)
+    rows = itertools.chain.from_iterable(
+        zip(batch.barcodes, batch.order_ids) for batch in barcode_batches
+    )
+
+    with ExitStack() as stack:
+        if action.path is None:
+            output = args.output
+        elif action.path == "-":
+            output = sys.stdout
+        else:
+            output = stack.enter_context(open(action.path, "w", newline=""))
+
+        with profiler.measure("deduplicate") as stage:
+            stage.rows = write_barcodes(
+                deduplicate(rows, report, args.dedup_budget), output
+            )
+    logging.info("Kept %d distinct barcodes", stage.rows)
+
+    with profiler.measure("report"):
+        write_report(report, args)
+
+
+def read_measured_inputs(
+    args: argparse.Namespace,
+    report: IngestionReport,
+    profiler: AnyProfiler = NULL_PROFILER,
+) -> Tuple[Iterator[BarcodeBatch], Iterator[OrderBatch]]:
+    """Read the CSV files given on the command line, measuring the reading.
+
+    The files are read as the batches are consumed: the time spent reading is
+    measured apart from the time spent consuming.
+
+    :param args: The parsed command line arguments.
+    :param report: The report to account for the rejected rows in.
+    :param profiler: The profiler to measure the reading with.
+    :returns: The batches of barcodes and the batches of orders, both lazy.
+
+    """
+    barcode_batches = profiler.iterate(
+        "read barcodes",
+        read_barcode_inputs(args, report),
+        lambda batch: len(batch.barcodes),
+    )
+    order_batches = profiler.iterate(
+        "read orders",
+        read_order_inputs(args, report),
+        lambda batch: len(batch.order_ids),
+    )
+    return iter(barcode_batches), iter(order_batches)
+
+
+def sketch_top_customers(
+    args: argparse.Namespace, profiler: AnyProfiler = NULL_PROFILER
+) -> TopCustomersSketch:
+    """Estimate the top customers from the CSV files, in a single pass.
+
+    The barcodes are deduplicated within the budget of `dedup` first, so that
+    the estimates follow the rules of a populated system.
+
+    :param args: The parsed command line arguments.
+    :param profiler: The profiler to measure the pass with.
+    :returns: The populated sketch.
+
+    """
+    report = IngestionReport(
+        keep_rejects=args.rejects is not None, log_rows=args.log_rows
+    )
+    sketch = TopCustomersSketch(args.top_sketch)
+    barcode_batches, order_batches = read_measured_inputs(args, report, profiler)
+    barcode_batches = deduplicate_batches(barcode_batches, report, args.dedup_budget)
+    with profiler.measure("populate") as stage:
+        sketch.populate_batches(barcode_batches, order_batches, report)
+        stage.rows = sketch.summary.total
+    logging.info(
+        "Customers out of the top customers sketch have at most %d barcodes",
+        sketch.summary.error_bound(),
+    )
+
+    with profiler.measure("report"):
+        write_report(report, args)
+    return sketch
+
+
+def do_follow(args: argparse.Namespace, profiler: AnyProfiler = NULL_PROFILER):
+    """Follow the CSV files and print the actions after each update.
+
+    Outputs to files are overwritten at each update, so that they hold the
+    latest figures, while the other outputs are appended to.
+
+    :param args: The parsed command line arguments.
+    :param profiler: The profiler to measure the updates with.
+
+    """
+    report = IngestionReport(
+        keep_rejects=args.rejects is not None, log_rows=args.log_rows
+    )
+    follower = Follower(VoucherSystem(), args.barcodes, [args.orders])
+
+    def on_update(update_report: IngestionReport):
+        with profiler.measure("report"):
+            update_report.log()
+            if args.rejects is not None:
+                with open(args.rejects, "w", newline="") as rejects_file:
+                    report.write_rejects(rejects_file)
+
+        with ExitStack() as stack:
+            do_actions(follower.system, args, stack, profiler)
+        args.output.flush()
+        sys.stdout.flush()
+
+    # Stop between two updates on `SIGTERM`, as `serve` does.
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        follower.run(
+            on_update, args.interval, report, stopping=stopping, profiler=profiler
+        )
+    except KeyboardInterrupt:
+        pass
+    logging.info("Stopped following the CSV files")
+
+
+def write_report(report: IngestionReport, args: argparse.Namespace):
+    """Log the rows rejected, and write them if asked to.
+
+    :param report: The report of the ingestion.
+    :param args: The parsed command line arguments.
+
+    """
+    report.log()
+    if args.rejects is not None:
+        with open(args.rejects, "w", newline="") as rejects_file:
+            report.write_rejects(rejects_file)
+
+
+def write_profile(profiler: Profiler, path: str):
+    """Write the measures of a run as a JSON document.
+
+    :param profiler: The profiler having measured the run.
+    :param path: The path of the file to write to, or `-` for `stderr`.
+
+    """
+    document = json.dumps(profiler.as_dict(), indent=2) + "\n"
+    if path == "-":
+        sys.stderr.write(document)
+    else:
+        with open(path, "w") as profile_file:
+            profile_file.write(document)
+
+
+def finish_profiling(
+    args: argparse.Namespace,
+    profiler: AnyProfiler,
+    cprofile: Optional[cProfile.Profile],
+):
+    """Stop profiling the run, and write the measures if asked to.
+
+    :param args: The parsed command line arguments.
+    :param profiler: The profiler having measured the run.
+    :param cprofile: The function profiler of the run, if any.
+
+    """
+    if cprofile is not None:
+        cprofile.disable()
+        cprofile.dump_stats(args.cprofile)
+    if args.profile is not None:
+        write_profile(profiler, args.profile)
+
+
 def main():
     """Execute the Mini Vouchers program.
 
-    Read the dataset from the barcodes and orders files, and act on the system
-    based on the command line action.
+    Read the dataset from the barcodes and orders files, or from a snapshot,
+    and act on the system based on the command line actions.
 
     """
     args = cmdline_args()
@@ -226,19 +1044,59 @@ def main():
         format=LOG_FORMAT, level=get_log_level(args.verbose, args.quiet)
     )
 
-    exported_barcodes = parse_barcodes(trim_lines(args.barcodes))
-    exported_orders = parse_orders(trim_lines(args.orders))
-    system = VoucherSystem()
-    system.populate(exported_barcodes, exported_orders)
+    profiler = Profiler() if args.profile is not None else NULL_PROFILER
+    cprofile = cProfile.Profile() if args.cprofile is not None else None
+    if cprofile is not None:
+        cprofile.enable()
+
+    if args.actions[0].name == "dedup":
+        do_dedup(args, profiler)
+        finish_profiling(args, profiler, cprofile)
+        return
+
+    storage = STORAGES[args.storage]
+    if args.shards > 1:
+        storage = partial(ShardedVoucherSystem, args.shards)
 
-    if args.action == "print":
-        do_print(system, args.output)
-    elif args.action == "summary":
-        do_summary(system, args.output)
-    elif args.action == "top5":
-        do_top5(system, args.output)
+    if args.follow:
+        do_follow(args, profiler)
+        finish_profiling(args, profiler, cprofile)
+        return
+
+    if args.top_sketch is not None:
+        system = sketch_top_customers(args, profiler)
+    elif args.snapshot_in is not None:
+        with profiler.measure("load snapshot"), exiting_on_read_errors(
+            args.snapshot_in, (ValueError, OSError)
+        ):
+            system = load_snapshot(args.snapshot_in, storage)
     else:
-        raise ValueError(f"Unknown action {args.action}")
+        report = IngestionReport(
+            keep_rejects=args.rejects is not None, log_rows=args.log_rows
+        )
+        system = storage()
+        barcode_batches, order_batches = read_measured_inputs(args, report, profiler)
+        with profiler.measure("populate") as stage:
+            system.populate_batches(barcode_batches, order_batches, report)
+            stats = system.stats()
+            stage.rows = stats.orders + stats.attributed_barcodes
+            stage.rows += stats.available_barcodes + stats.discarded_barcodes
+
+        with profiler.measure("report"):
+            write_report(report, args)
+
+    if args.snapshot_out is not None:
+        with profiler.measure("save snapshot"):
+            with open(args.snapshot_out, "wb") as snapshot_file:
+                save_snapshot(system, snapshot_file)
+
+    with ExitStack() as stack:
+        do_actions(system, args, stack, profiler)
+
+    finish_profiling(args, profiler, cprofile)
+
+    if any(action.name == "serve" for action in args.actions):
+        serve(system, args.host, args.port, args.socket)
 
 
 if __name__ == "__main__":
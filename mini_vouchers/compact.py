@@ -0,0 +1,590 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""A compact, array-backed Voucher System.
+
+The :py:class:`CompactVoucherSystem` answers the same queries as
+:py:class:`~mini_vouchers.voucher_system.VoucherSystem` but stores its data in
+flat tables instead of a dictionary entry, a string and a set slot per barcode:
+
+- The barcodes are sorted and packed in a single UTF-8 buffer, addressed by an
+  array of offsets. Each barcode is then identified by its rank.
+- The orders and the customers are rows of integer arrays.
+- The barcodes of each order are listed in a compressed sparse row layout: the
+  barcodes of the order at row ``i`` are the ranks
+  ``order_barcodes[order_offsets[i]:order_offsets[i + 1]]``.
+
+Python objects are only built on demand, when answering queries.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import Counter
+import heapq
+import itertools
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from mini_vouchers.csv_utils import (
+    NO_ORDER_ID,
+    BarcodeBatch,
+    ExportedBarcode,
+    ExportedOrder,
+    OrderBatch,
+)
+from mini_vouchers.report import (
+    DUPLICATE_BARCODE,
+    DUPLICATE_ORDER,
+    EMPTY_ORDER,
+    UNKNOWN_ORDER,
+    IngestionReport,
+)
+from mini_vouchers.voucher_system import Order, Statistics
+
+
+AVAILABLE = -1
+"""The order row of available barcodes."""
+DISCARDED = -2
+"""The order row of barcodes attributed to an unknown order."""
+BATCH_SIZE = 1 << 16
+"""The amount of exported rows gathered in a batch."""
+
+Buffer = Union[bytes, array, memoryview]
+
+
+def _batch_barcodes(
+    exported_barcodes: Iterable[ExportedBarcode],
+) -> Iterator[BarcodeBatch]:
+    """Gather exported barcodes into columnar batches."""
+    iterator = iter(exported_barcodes)
+    while True:
+        rows = list(itertools.islice(iterator, BATCH_SIZE))
+        if not rows:
+            return
+        yield BarcodeBatch(
+            [barcode for barcode, _ in rows],
+            array("q", [order_id or NO_ORDER_ID for _, order_id in rows]),
+        )
+
+
+def _batch_orders(exported_orders: Iterable[ExportedOrder]) -> Iterator[OrderBatch]:
+    """Gather exported orders into columnar batches."""
+    iterator = iter(exported_orders)
+    while True:
+        rows = list(itertools.islice(iterator, BATCH_SIZE))
+        if not rows:
+            return
+        yield OrderBatch(
+            array("q", [order_id for order_id, _ in rows]),
+            array("q", [customer_id for _, customer_id in rows]),
+        )
+
+
+class CompactTables(NamedTuple):
+    """The tables of a :py:class:`CompactVoucherSystem`.
+
+    The tables are either arrays or read-only buffers of the same item types,
+    e.g. memory views cast over a mapped file.
+    """
+
+    barcode_data: Buffer
+    """The sorted barcodes, encoded in UTF-8 and concatenated."""
+    barcode_offsets: Buffer
+    """The offset of each barcode in :py:attr:`barcode_data`, and its end."""
+    barcode_orders: Buffer
+    """The order row of each barcode, :py:const:`AVAILABLE` or
+    :py:const:`DISCARDED`."""
+    order_ids: Buffer
+    """The order identifiers, sorted."""
+    order_customers: Buffer
+    """The customer identifier of each order."""
+    order_offsets: Buffer
+    """The offset of the barcodes of each order in :py:attr:`order_barcodes`,
+    and its end."""
+    order_barcodes: Buffer
+    """The barcode ranks of each order, grouped by order."""
+    customer_ids: Buffer
+    """The customer identifiers, by first order identifier."""
+    customer_totals: Buffer
+    """The amount of barcodes attributed to each customer."""
+    available_count: int
+    """The amount of available barcodes."""
+    discarded_count: int
+    """The amount of barcodes discarded while populating."""
+
+
+class CompactVoucherSystem:
+    """The Voucher System logic, backed by compact tables.
+
+    The system is immutable once populated: the tables are packed at the end of
+    :py:meth:`populate` or :py:meth:`populate_batches`, which can only be
+    called once.
+
+    >>> exported_barcodes = [ExportedBarcode('b', 10), ExportedBarcode('b', 12)]
+    >>> exported_barcodes += [ExportedBarcode('z'), ExportedBarcode('c', 11)]
+    >>> exported_orders = [ExportedOrder(10, 7), ExportedOrder(12, 7)]
+    >>> system = CompactVoucherSystem()
+    >>> system.populate(exported_barcodes, exported_orders)
+    >>> system.get_available_barcodes()
+    ['z']
+    >>> system.get_orders()
+    [Order(order_id=10, customer_id=7, barcodes={'b'})]
+    >>> system.get_top_customers(1)
+    [(7, 1)]
+
+    """
+
+    _barcode_data: Buffer
+    """The sorted barcodes, see :py:attr:`CompactTables.barcode_data`."""
+    _barcode_offsets: Buffer
+    """See :py:attr:`CompactTables.barcode_offsets`."""
+    _barcode_orders: Buffer
+    """See :py:attr:`CompactTables.barcode_orders`."""
+    _order_ids: Buffer
+    """See :py:attr:`CompactTables.order_ids`."""
+    _order_customers: Buffer
+    """See :py:attr:`CompactTables.order_customers`."""
+    _order_offsets: Buffer
+    """See :py:attr:`CompactTables.order_offsets`."""
+    _order_barcodes: Buffer
+    """See :py:attr:`CompactTables.order_barcodes`."""
+    _customer_ids: Buffer
+    """See :py:attr:`CompactTables.customer_ids`."""
+    _customer_totals: Buffer
+    """See :py:attr:`CompactTables.customer_totals`."""
+    _customer_rows: Optional[Dict[int, List[int]]]
+    """The rows of the orders of each customer, if indexed already."""
+
+    def __init__(self):
+        """Initialise the system."""
+        self._populated = False
+        self._barcode_data = b""
+        self._barcode_offsets = array("Q", [0])
+        self._barcode_orders = array("q")
+        self._order_ids = array("q")
+        self._order_customers = array("q")
+        self._order_offsets = array("Q", [0])
+        self._order_barcodes = array("Q")
+        self._customer_ids = array("q")
+        self._customer_totals = array("q")
+        self._available_count = 0
+        self._discarded_count = 0
+        self._customer_rows = None
+
+    @classmethod
+    def from_tables(cls, tables: CompactTables) -> "CompactVoucherSystem":
+        """Build a populated system straight from its tables.
+
+        The tables are used as is, without being copied nor validated.
+
+        :param tables: The tables, e.g. as returned by :py:meth:`tables`.
+        :returns: A fresh system, immutable.
+
+        """
+        system = cls()
+        system._populated = True
+        (
+            system._barcode_data,
+            system._barcode_offsets,
+            system._barcode_orders,
+            system._order_ids,
+            system._order_customers,
+            system._order_offsets,
+            system._order_barcodes,
+            system._customer_ids,
+            system._customer_totals,
+            system._available_count,
+            system._discarded_count,
+        ) = tables
+        return system
+
+    @classmethod
+    def from_system(cls, system: Any) -> "CompactVoucherSystem":
+        """Pack the data of another populated system.
+
+        Only the public queries of the other system are used. The barcodes it
+        discarded are counted but not kept.
+
+        >>> from mini_vouchers.voucher_system import VoucherSystem
+        >>> system = VoucherSystem()
+        >>> system.populate([ExportedBarcode('a', 10), ExportedBarcode('z')],
+        ...                 [ExportedOrder(10, 7)])
+        >>> compact = CompactVoucherSystem.from_system(system)
+        >>> compact.get_orders() == system.get_orders()
+        True
+        >>> compact.stats() == system.stats()
+        True
+
+        :param system: The system to pack, e.g. a
+            :py:class:`~mini_vouchers.voucher_system.VoucherSystem`.
+        :returns: A fresh system, immutable.
+
+        """
+        compact = cls()
+        compact._populated = True
+
+        order_rows: Dict[int, int] = {}
+        order_customers = array("q")
+        barcode_rows: Dict[str, int] = dict.fromkeys(
+            system.iter_available_barcodes(), AVAILABLE
+        )
+        for order in system.iter_orders():
+            order_rows[order.order_id] = len(order_customers)
+            order_customers.append(order.customer_id)
+            for barcode in order.barcodes:
+                barcode_rows[barcode] = order_rows[order.order_id]
+
+        compact._discarded_count = system.stats().discarded_barcodes
+        compact._pack(order_rows, order_customers, barcode_rows)
+        return compact
+
+    def tables(self) -> CompactTables:
+        """Get the tables of the system.
+
+        :returns: The tables, shared with the system.
+
+        """
+        return CompactTables(
+            self._barcode_data,
+            self._barcode_offsets,
+            self._barcode_orders,
+            self._order_ids,
+            self._order_customers,
+            self._order_offsets,
+            self._order_barcodes,
+            self._customer_ids,
+            self._customer_totals,
+            self._available_count,
+            self._discarded_count,
+        )
+
+    def _barcode(self, rank: int) -> str:
+        """Decode the barcode of a given rank."""
+        start, end = self._barcode_offsets[rank], self._barcode_offsets[rank + 1]
+        return str(self._barcode_data[start:end], "utf-8")
+
+    def stats(self) -> Statistics:
+        """Get the figures describing the dataset, in constant time.
+
+        :returns: The figures, computed once packed.
+
+        """
+        return Statistics(
+            orders=len(self._order_ids),
+            customers=len(self._customer_ids),
+            attributed_barcodes=len(self._order_barcodes),
+            available_barcodes=self._available_count,
+            discarded_barcodes=self._discarded_count,
+        )
+
+    def count_available_barcodes(self) -> int:
+        """Count the available barcodes, in constant time.
+
+        :returns: The amount of available barcodes.
+
+        """
+        return self._available_count
+
+    def iter_available_barcodes(self) -> Iterator[str]:
+        """Iterate over the available barcodes, decoding them lazily.
+
+        :returns: An iterator of the available barcodes, sorted by value.
+
+        """
+        return (
+            self._barcode(rank)
+            for rank, row in enumerate(self._barcode_orders)
+            if row == AVAILABLE
+        )
+
+    def get_available_barcodes(self) -> Sequence[str]:
+        """Get the available barcodes.
+
+        :returns: A fresh sequence of the available barcodes, sorted by value.
+
+        """
+        return list(self.iter_available_barcodes())
+
+    def get_orders(self, key: Callable[[Order], Any] = None) -> Sequence[Order]:
+        """Get the orders known to the system.
+
+        :param key: The sorting function to apply. Defaults to sorted by value.
+        :returns: A fresh sequence of the orders.
+
+        """
+        return sorted(self.iter_orders(), key=key)
+
+    def get_order(self, order_id: int) -> Optional[Order]:
+        """Get an order by identifier, in logarithmic time.
+
+        :param order_id: The identifier of the order.
+        :returns: The order, or `None` if unknown to the system.
+
+        """
+        row = bisect_left(self._order_ids, order_id)
+        if row == len(self._order_ids) or self._order_ids[row] != order_id:
+            return None
+
+        return self._order(row)
+
+    def _order(self, row: int) -> Order:
+        """Build the order at a given row."""
+        return Order(
+            self._order_ids[row],
+            self._order_customers[row],
+            set(self._order_barcode_values(row)),
+        )
+
+    def owner_of(self, barcode: str) -> Optional[Order]:
+        """Get the order a barcode is attributed to, in logarithmic time.
+
+        :param barcode: The barcode value.
+        :returns: The order, or `None` if the barcode is available, discarded
+            or unknown to the system.
+
+        """
+        # Look the barcode up in the sorted barcodes, decoding them lazily.
+        low, high = 0, len(self._barcode_orders)
+        while low < high:
+            middle = (low + high) // 2
+            if self._barcode(middle) < barcode:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == len(self._barcode_orders) or self._barcode(low) != barcode:
+            return None
+        row = self._barcode_orders[low]
+        return self._order(row) if row >= 0 else None
+
+    def orders_for_customer(self, customer_id: int) -> Sequence[Order]:
+        """Get the orders of a customer.
+
+        The orders of all the customers are indexed on the first call.
+
+        >>> system = CompactVoucherSystem()
+        >>> system.populate([ExportedBarcode('a', 12), ExportedBarcode('b', 10)],
+        ...                 [ExportedOrder(12, 7), ExportedOrder(10, 7)])
+        >>> [order.order_id for order in system.orders_for_customer(7)]
+        [10, 12]
+        >>> system.owner_of('a').order_id, system.owner_of('c')
+        (12, None)
+
+        :param customer_id: The identifier of the customer.
+        :returns: A fresh sequence of the orders, sorted by identifier.
+
+        """
+        if self._customer_rows is None:
+            self._customer_rows = {}
+            for row, order_customer in enumerate(self._order_customers):
+                self._customer_rows.setdefault(order_customer, []).append(row)
+
+        return [self._order(row) for row in self._customer_rows.get(customer_id, ())]
+
+    def iter_orders(self) -> Iterator[Order]:
+        """Iterate over the orders known to the system, building them lazily.
+
+        :returns: An iterator of the orders, sorted by identifier.
+
+        """
+        return map(self._order, range(len(self._order_ids)))
+
+    def _order_barcode_values(self, row: int) -> Iterator[str]:
+        """Decode the barcodes of the order at a given row."""
+        start, end = self._order_offsets[row], self._order_offsets[row + 1]
+        return map(self._barcode, self._order_barcodes[start:end])
+
+    def get_top_customers(self, limit: int) -> Sequence[Tuple[int, int]]:
+        """Get the top customers.
+
+        See :py:meth:`mini_vouchers.voucher_system.VoucherSystem.get_top_customers`.
+
+        :param limit: The amount of top customers to return.
+        :returns: A fresh sequence of tuples of customer identifier and their
+            amount of barcodes, ranked from high (most barcodes) to low.
+
+        """
+        assert limit >= 0
+
+        totals = self._customer_totals
+        # The customers are laid out by first order identifier, which ranks ties.
+        rows = heapq.nlargest(
+            limit, range(len(totals)), key=lambda row: (totals[row], -row)
+        )
+        return [(self._customer_ids[row], totals[row]) for row in rows]
+
+    def populate(
+        self,
+        exported_barcodes: Iterable[ExportedBarcode],
+        exported_orders: Iterable[ExportedOrder],
+        report: IngestionReport = None,
+    ):
+        """Populate the system with data previously exported.
+
+        The data is cleaned and validated following the rules of
+        :py:meth:`mini_vouchers.voucher_system.VoucherSystem.populate`.
+
+        >>> system = CompactVoucherSystem()
+        >>> system.populate([ExportedBarcode('a')], [])
+        >>> system.populate([ExportedBarcode('b')], [])
+        Traceback (most recent call last):
+            ...
+        ValueError: The system is populated already
+
+        :param exported_barcodes: The barcodes previously exported.
+        :param exported_orders: The orders previously exported.
+        :param report: The report to account for the rejected rows in, if any.
+        :raises ValueError: If the system is populated already.
+
+        """
+        self.populate_batches(
+            _batch_barcodes(exported_barcodes), _batch_orders(exported_orders), report
+        )
+
+    def populate_batches(
+        self,
+        barcode_batches: Iterable[BarcodeBatch],
+        order_batches: Iterable[OrderBatch],
+        report: IngestionReport = None,
+    ):
+        """Populate the system with columnar batches of data previously exported.
+
+        See :py:meth:`mini_vouchers.voucher_system.VoucherSystem.populate_batches`.
+
+        :param barcode_batches: The batches of barcodes previously exported.
+        :param order_batches: The batches of orders previously exported.
+        :param report: The report to account for the rejected rows in, if any.
+        :raises ValueError: If the system is populated already.
+
+        """
+        if self._populated:
+            raise ValueError("The system is populated already")
+        self._populated = True
+
+        # The first row of each order, by order identifier.
+        order_rows: Dict[int, int] = {}
+        order_customers = array("q")
+
+        for order_ids, customer_ids in order_batches:
+            for order_id, customer_id in zip(order_ids, customer_ids):
+                if order_id not in order_rows:
+                    order_rows[order_id] = len(order_customers)
+                    order_customers.append(customer_id)
+                elif report is not None:
+                    report.reject_order(DUPLICATE_ORDER, order_id, customer_id)
+
+        # The order row of each barcode, by barcode, in order of appearance.
+        barcode_rows: Dict[str, int] = {}
+
+        for barcodes, order_ids in barcode_batches:
+            for barcode, order_id in zip(barcodes, order_ids):
+                if barcode in barcode_rows:
+                    if report is not None:
+                        report.reject_barcode(DUPLICATE_BARCODE, barcode, order_id)
+                    self._discarded_count += 1
+                elif not order_id:
+                    barcode_rows[barcode] = AVAILABLE
+                elif order_id in order_rows:
+                    barcode_rows[barcode] = order_rows[order_id]
+                else:
+                    if report is not None:
+                        report.reject_barcode(UNKNOWN_ORDER, barcode, order_id)
+                    barcode_rows[barcode] = DISCARDED
+
+        self._pack(order_rows, order_customers, barcode_rows, report)
+
+    def _pack(
+        self,
+        order_rows: Dict[int, int],
+        order_customers: array,
+        barcode_rows: Dict[str, int],
+        report: IngestionReport = None,
+    ):
+        """Pack the ingested data into the compact tables.
+
+        :param order_rows: The row of each order, by order identifier.
+        :param order_customers: The customer identifier of each order row.
+        :param barcode_rows: The order row of each barcode, by barcode.
+        :param report: The report to account for the dropped orders in, if any.
+
+        """
+        # Pack the barcodes by value.
+        barcodes = sorted(barcode_rows)
+        offsets = array("Q", [0])
+        position = 0
+        for barcode in barcodes:
+            position += len(barcode.encode("utf-8"))
+            offsets.append(position)
+        self._barcode_data = "".join(barcodes).encode("utf-8")
+        self._barcode_offsets = offsets
+
+        rows = array("q", map(barcode_rows.__getitem__, barcodes))
+        del barcodes
+        barcode_rows.clear()
+
+        # Count the barcodes per order and drop the orders without barcodes.
+        counts = array("Q", bytes(8 * len(order_customers)))
+        for row in rows:
+            if row >= 0:
+                counts[row] += 1
+
+        packed_rows = array("q", bytes(8 * len(order_customers)))
+        for order_id, row in sorted(order_rows.items()):
+            if not counts[row]:
+                if report is not None:
+                    report.reject_order(EMPTY_ORDER, order_id, order_customers[row])
+                packed_rows[row] = DISCARDED
+                continue
+
+            packed_rows[row] = len(self._order_ids)
+            self._order_ids.append(order_id)
+            self._order_customers.append(order_customers[row])
+            self._order_offsets.append(self._order_offsets[-1] + counts[row])
+
+        # Lay the barcodes out by order, in a counting sort.
+        self._barcode_orders = array(
+            "q", (packed_rows[row] if row >= 0 else row for row in rows)
+        )
+        del rows
+        self._available_count = self._barcode_orders.count(AVAILABLE)
+        self._discarded_count += self._barcode_orders.count(DISCARDED)
+        starts = self._order_offsets[:-1]
+        self._order_barcodes = array("Q", bytes(8 * self._order_offsets[-1]))
+        for rank, row in enumerate(self._barcode_orders):
+            if row >= 0:
+                self._order_barcodes[starts[row]] = rank
+                starts[row] += 1
+
+        # Total the barcodes per customer, by first order identifier.
+        customer_totals: Counter = Counter()
+        for row, customer_id in enumerate(self._order_customers):
+            customer_totals[customer_id] += (
+                self._order_offsets[row + 1] - self._order_offsets[row]
+            )
+        self._customer_ids = array("q", customer_totals.keys())
+        self._customer_totals = array("q", customer_totals.values())
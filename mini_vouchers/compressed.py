@@ -0,0 +1,211 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Reading of compressed CSV files.
+
+Files compressed with gzip, xz or bzip2 are detected by their leading bytes
+and decompressed as they are read, without any copy on disk. The
+decompression runs in a background thread, a few blocks ahead of the parser:
+the decompressors release the GIL, so that decompressing and parsing overlap.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import queue
+import threading
+from typing import IO, Callable, Dict, Optional, TextIO
+
+from mini_vouchers.mapped import ENCODING
+
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+"""The amount of decompressed bytes handed over at once."""
+DEFAULT_QUEUE_SIZE = 4
+"""The amount of decompressed blocks held ahead of the parser."""
+
+MAGIC_NUMBERS = {
+    b"\x1f\x8b": "gzip",
+    b"\xfd7zXZ\x00": "xz",
+    b"BZh": "bzip2",
+}
+"""The compression of a file, by the bytes it starts with."""
+DECOMPRESSORS: Dict[str, Callable[[str], IO[bytes]]] = {
+    "gzip": gzip.open,
+    "xz": lzma.open,
+    "bzip2": bz2.open,
+}
+"""The function opening a compressed file for reading, by compression."""
+READ_ERRORS = (EOFError, OSError, lzma.LZMAError)
+"""The errors raised when reading a corrupt or truncated compressed file."""
+
+
+def detect_compression(path: str) -> Optional[str]:
+    r"""Detect the compression of a file from its leading bytes.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".csv.gz") as compressed_file:
+    ...     _ = compressed_file.write(gzip.compress(b"barcode,order_id\n"))
+    ...     compressed_file.flush()
+    ...     detect_compression(compressed_file.name), detect_compression(__file__)
+    ('gzip', None)
+
+    :param path: The path of the file.
+    :returns: The compression, see :py:const:`DECOMPRESSORS`, or `None` if
+        the file is not compressed.
+
+    """
+    with open(path, "rb") as input_file:
+        head = input_file.read(max(map(len, MAGIC_NUMBERS)))
+
+    for magic, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+_END = object()
+"""The end of a decompressed stream."""
+
+
+class PipelinedReader(io.RawIOBase):
+    """A binary stream decompressing a file in a background thread.
+
+    The decompressed blocks are handed over through a bounded queue, so that
+    the thread never gets more than a few blocks ahead of the reader. Errors
+    raised while decompressing are raised again by :py:meth:`readinto`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression: str,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        """Start decompressing a file.
+
+        :param path: The path of the compressed file.
+        :param compression: The compression of the file, see
+            :py:const:`DECOMPRESSORS`.
+        :param block_size: The amount of decompressed bytes handed over at once.
+        :param queue_size: The amount of decompressed blocks held ahead.
+
+        """
+        assert block_size > 0 and queue_size > 0
+
+        super().__init__()
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._stopping = threading.Event()
+        self._pending = memoryview(b"")
+        self._ended = False
+        self._thread = threading.Thread(
+            target=self._decompress,
+            args=(DECOMPRESSORS[compression], path, block_size),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _decompress(self, open_compressed, path: str, block_size: int):
+        """Decompress the file into the queue, until done or stopped."""
+        try:
+            with open_compressed(path) as compressed_file:
+                block = compressed_file.read(block_size)
+                while block and self._put(block):
+                    block = compressed_file.read(block_size)
+        except Exception as error:  # Handed over to the reader.
+            self._put(error)
+        else:
+            self._put(_END)
+
+    def _put(self, item: object) -> bool:
+        """Queue an item unless stopped, waiting for room.
+
+        :returns: Whether the item was queued.
+
+        """
+        while not self._stopping.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def readable(self) -> bool:
+        """Tell the stream is readable."""
+        return True
+
+    def readinto(self, buffer) -> int:
+        """Read decompressed bytes into a buffer.
+
+        :param buffer: The writable buffer to fill.
+        :returns: The amount of bytes read, or `0` at the end of the stream.
+        :raises Exception: The error raised while decompressing, if any.
+
+        """
+        if not self._pending and not self._ended:
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._ended = True
+                raise item
+            if item is _END:
+                self._ended = True
+            else:
+                self._pending = memoryview(item)
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        """Stop decompressing and close the stream."""
+        if not self.closed:
+            self._stopping.set()
+            self._thread.join()
+        super().close()
+
+
+def open_text(
+    path: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+) -> TextIO:
+    r"""Open a text file, decompressing it in the background if need be.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile(suffix=".csv.xz") as compressed_file:
+    ...     _ = compressed_file.write(lzma.compress(b"barcode,order_id\nabc,1\n"))
+    ...     compressed_file.flush()
+    ...     with open_text(compressed_file.name) as text_stream:
+    ...         text_stream.read()
+    'barcode,order_id\nabc,1\n'
+
+    :param path: The path of the file, compressed or not.
+    :param block_size: The amount of decompressed bytes handed over at once.
+    :param queue_size: The amount of decompressed blocks held ahead.
+    :returns: A fresh text stream, to be closed.
+
+    """
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, encoding=ENCODING)
+
+    reader = PipelinedReader(path, compression, block_size, queue_size)
+    return io.TextIOWrapper(io.BufferedReader(reader), encoding=ENCODING)
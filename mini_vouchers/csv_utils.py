@@ -17,9 +17,43 @@
 
 """The representation and utilities to handle CSV serialisation."""
 
+from array import array
 import csv
-import logging
-from typing import Iterator, NamedTuple, Optional, Sequence
+import itertools
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+)
+
+from mini_vouchers.report import (
+    MISSING_BARCODE,
+    MISSING_IDENTIFIERS,
+    OUT_OF_RANGE_IDENTIFIER,
+    IngestionReport,
+)
+
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+"""The amount of characters read at once by the block-based readers."""
+BARCODE_FIELDS = ("barcode", "order_id")
+"""The columns of a barcodes CSV file."""
+ORDER_FIELDS = ("order_id", "customer_id")
+"""The columns of an orders CSV file."""
+NO_ORDER_ID = 0
+"""The order identifier standing for available barcodes in columnar batches.
+
+Order identifiers are only meaningful when they are truthy, see
+:py:meth:`mini_vouchers.voucher_system.VoucherSystem.populate`.
+"""
+IDENTIFIERS = range(-(1 << 63), 1 << 63)
+"""The order and customer identifiers supported, those of a signed 64-bit
+integer. The rows of other identifiers are rejected."""
 
 
 class ExportedBarcode(NamedTuple):
@@ -44,7 +78,34 @@ class ExportedOrder(NamedTuple):
     """The customer identifier."""
 
 
-def parse_barcodes(csv_input: Sequence[str]) -> Iterator[ExportedBarcode]:
+class BarcodeBatch(NamedTuple):
+    """A batch of barcodes as exported in a CSV file, stored by column.
+
+    Both columns have the same length. Available barcodes are mapped to
+    :py:const:`NO_ORDER_ID`.
+    """
+
+    barcodes: List[str]
+    """The barcode values."""
+    order_ids: array
+    """The order identifiers, as signed 64-bit integers."""
+
+
+class OrderBatch(NamedTuple):
+    """A batch of orders as exported in a CSV file, stored by column.
+
+    Both columns have the same length.
+    """
+
+    order_ids: array
+    """The order identifiers, as signed 64-bit integers."""
+    customer_ids: array
+    """The customer identifiers, as signed 64-bit integers."""
+
+
+def parse_barcodes(
+    csv_input: Sequence[str], report: IngestionReport = None
+) -> Iterator[ExportedBarcode]:
     """Yield barcodes optionally assigned to orders from a CSV-like sequence.
 
     >>> data = parse_barcodes(["barcode,order_id", "abc,1", "def,42", "g,"])
@@ -77,6 +138,7 @@ def parse_barcodes(csv_input: Sequence[str]) -> Iterator[ExportedBarcode]:
         0
 
     :param csv_input: The sequence of CSV-like lines to parse.
+    :param report: The report to account for the rejected rows in, if any.
     :yields: The :py:class:`ExportedBarcode` as they are read.
 
     """
@@ -91,13 +153,20 @@ def parse_barcodes(csv_input: Sequence[str]) -> Iterator[ExportedBarcode]:
         order_id = int(row["order_id"]) if row["order_id"] else None
 
         if not barcode:
-            logging.info("Ignoring row without barcode: %s", row)
+            if report is not None:
+                report.reject_barcode(MISSING_BARCODE, barcode, order_id)
+            continue
+        if order_id is not None and order_id not in IDENTIFIERS:
+            if report is not None:
+                report.reject_barcode(OUT_OF_RANGE_IDENTIFIER, barcode, order_id)
             continue
 
         yield ExportedBarcode(barcode, order_id)
 
 
-def parse_orders(csv_input: Sequence[str]) -> Iterator[ExportedOrder]:
+def parse_orders(
+    csv_input: Sequence[str], report: IngestionReport = None
+) -> Iterator[ExportedOrder]:
     """Yield orders and their customers from a CSV-like sequence.
 
     >>> data = parse_orders(["order_id,customer_id", "1,1", "24,42"])
@@ -132,6 +201,7 @@ def parse_orders(csv_input: Sequence[str]) -> Iterator[ExportedOrder]:
         0
 
     :param csv_input: The sequence of CSV-like lines to parse.
+    :param report: The report to account for the rejected rows in, if any.
     :yields: The :py:class:`ExportedOrder` as they are read.
 
     """
@@ -146,7 +216,370 @@ def parse_orders(csv_input: Sequence[str]) -> Iterator[ExportedOrder]:
         customer_id = int(row["customer_id"]) if row["customer_id"] else None
 
         if not order_id or not customer_id:
-            logging.info("Ignoring row missing identifiers: %s", row)
+            if report is not None:
+                report.reject_order(MISSING_IDENTIFIERS, order_id, customer_id)
+            continue
+        if order_id not in IDENTIFIERS or customer_id not in IDENTIFIERS:
+            if report is not None:
+                report.reject_order(OUT_OF_RANGE_IDENTIFIER, order_id, customer_id)
             continue
 
         yield ExportedOrder(order_id, customer_id)
+
+
+def _read_blocks(text_stream: TextIO, block_size: int) -> Iterator[List[str]]:
+    """Yield the lines of a text stream, one block of lines at a time.
+
+    The lines are neither trimmed nor filtered. Blocks are never empty but the
+    last one may hold a single empty line.
+
+    :param text_stream: The text stream to read from.
+    :param block_size: The amount of characters to read at once.
+    :yields: Lists of consecutive lines.
+
+    """
+    remainder = ""
+    block = text_stream.read(block_size)
+    while block:
+        lines = (remainder + block).split("\n")
+        remainder = lines.pop()
+        if lines:
+            yield lines
+        block = text_stream.read(block_size)
+    yield [remainder]
+
+
+def split_fields(line: str) -> List[str]:
+    """Split a single CSV line into its fields.
+
+    >>> split_fields('a,"b,c",d')
+    ['a', 'b,c', 'd']
+
+    """
+    return next(csv.reader([line]), [])
+
+
+def column_positions(header: str, fieldnames: Sequence[str]) -> Tuple[int, ...]:
+    """Locate columns from a CSV header line.
+
+    >>> column_positions("order_id,barcode", BARCODE_FIELDS)
+    (1, 0)
+
+    :param header: The header line.
+    :param fieldnames: The names of the columns to locate.
+    :returns: The position of each column, in the order of `fieldnames`.
+
+    """
+    fields = split_fields(header.strip())
+
+    # Make sure the field names are following the schema as per the assignment.
+    for fieldname in fieldnames:
+        assert fieldname in fields
+
+    return tuple(fields.index(fieldname) for fieldname in fieldnames)
+
+
+def _read_table(
+    text_stream: TextIO, block_size: int, fieldnames: Sequence[str]
+) -> Tuple[Tuple[int, ...], Iterator[List[str]]]:
+    """Locate the columns of a CSV text stream and get its remaining lines.
+
+    :param text_stream: The text stream to read from.
+    :param block_size: The amount of characters to read at once.
+    :param fieldnames: The names of the columns to locate in the header.
+    :returns: The position of each requested column and the blocks of lines
+        following the header.
+
+    """
+    blocks = _read_blocks(text_stream, block_size)
+    first_block = next(blocks)
+    positions = column_positions(first_block[0], fieldnames)
+
+    return positions, itertools.chain([first_block[1:]], blocks)
+
+
+def read_barcodes(
+    text_stream: TextIO,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    report: IngestionReport = None,
+) -> Iterator[ExportedBarcode]:
+    r"""Yield barcodes optionally assigned to orders from a CSV text stream.
+
+    This is the fast path of :py:func:`parse_barcodes`: the column positions are
+    determined once from the header, the stream is read in large blocks, and the
+    rows are split without building an intermediate dictionary. The semantics
+    are otherwise the same.
+
+    >>> from io import StringIO
+    >>> data = read_barcodes(StringIO("barcode,order_id\nabc,1\n  g, \n"))
+    >>> next(data)
+    ExportedBarcode(barcode='abc', order_id=1)
+    >>> next(data)
+    ExportedBarcode(barcode='g', order_id=None)
+
+    The column ordering does not matter and lines without barcodes are ignored:
+
+        >>> data = read_barcodes(StringIO("order_id,barcode\n123,abc\n7,\n"))
+        >>> list(data)
+        [ExportedBarcode(barcode='abc', order_id=123)]
+
+    Lines are read across block boundaries:
+
+        >>> data = read_barcodes(StringIO("barcode,order_id\nabcdef,12"), 4)
+        >>> list(data)
+        [ExportedBarcode(barcode='abcdef', order_id=12)]
+
+    :param text_stream: The CSV text stream to parse, header included.
+    :param block_size: The amount of characters to read at once.
+    :param report: The report to account for the rejected rows in, if any.
+    :yields: The :py:class:`ExportedBarcode` as they are read.
+
+    """
+    positions, blocks = _read_table(text_stream, block_size, BARCODE_FIELDS)
+    barcode_index, order_index = positions
+    width = max(positions) + 1
+
+    for block in blocks:
+        for line in block:
+            line = line.strip()
+            if not line:
+                continue
+
+            fields = split_fields(line) if '"' in line else line.split(",")
+            if len(fields) < width:
+                fields.extend([""] * (width - len(fields)))
+
+            barcode = fields[barcode_index]
+            order_id = fields[order_index]
+            order_id = int(order_id) if order_id else None
+
+            if not barcode:
+                if report is not None:
+                    report.reject_barcode(MISSING_BARCODE, barcode, order_id)
+                continue
+            if order_id is not None and order_id not in IDENTIFIERS:
+                if report is not None:
+                    report.reject_barcode(OUT_OF_RANGE_IDENTIFIER, barcode, order_id)
+                continue
+
+            yield ExportedBarcode(barcode, order_id)
+
+
+def read_orders(
+    text_stream: TextIO,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    report: IngestionReport = None,
+) -> Iterator[ExportedOrder]:
+    r"""Yield orders and their customers from a CSV text stream.
+
+    This is the fast path of :py:func:`parse_orders`, see
+    :py:func:`read_barcodes`.
+
+    >>> from io import StringIO
+    >>> data = read_orders(StringIO("customer_id,order_id\n42,24\n1,\n\n"))
+    >>> list(data)
+    [ExportedOrder(order_id=24, customer_id=42)]
+
+    :param text_stream: The CSV text stream to parse, header included.
+    :param block_size: The amount of characters to read at once.
+    :param report: The report to account for the rejected rows in, if any.
+    :yields: The :py:class:`ExportedOrder` as they are read.
+
+    """
+    positions, blocks = _read_table(text_stream, block_size, ORDER_FIELDS)
+    order_index, customer_index = positions
+    width = max(positions) + 1
+
+    for block in blocks:
+        for line in block:
+            line = line.strip()
+            if not line:
+                continue
+
+            fields = split_fields(line) if '"' in line else line.split(",")
+            if len(fields) < width:
+                fields.extend([""] * (width - len(fields)))
+
+            order_id = fields[order_index]
+            customer_id = fields[customer_index]
+            order_id = int(order_id) if order_id else None
+            customer_id = int(customer_id) if customer_id else None
+
+            if not order_id or not customer_id:
+                if report is not None:
+                    report.reject_order(MISSING_IDENTIFIERS, order_id, customer_id)
+                continue
+            if order_id not in IDENTIFIERS or customer_id not in IDENTIFIERS:
+                if report is not None:
+                    report.reject_order(OUT_OF_RANGE_IDENTIFIER, order_id, customer_id)
+                continue
+
+            yield ExportedOrder(order_id, customer_id)
+
+
+def parse_barcode_block(
+    lines: Iterable[str], positions: Tuple[int, int], report: IngestionReport = None
+) -> BarcodeBatch:
+    """Parse a block of CSV lines into a columnar batch of barcodes.
+
+    >>> parse_barcode_block(["abc,1", "", "  g,  ", ",2"], (0, 1))
+    BarcodeBatch(barcodes=['abc', 'g'], order_ids=array('q', [1, 0]))
+    >>> report = IngestionReport()
+    >>> parse_barcode_block(["h,9223372036854775808"], (0, 1), report)
+    BarcodeBatch(barcodes=[], order_ids=array('q'))
+    >>> report.counts
+    {'identifier out of range': 1}
+
+    :param lines: The lines to parse, without the header.
+    :param positions: The positions of the `barcode` and `order_id` columns, see
+        :py:func:`column_positions`.
+    :param report: The report to account for the rejected rows in, if any.
+    :returns: The barcodes read, possibly none.
+
+    """
+    barcode_index, order_index = positions
+    width = max(positions) + 1
+
+    barcodes: List[str] = []
+    order_ids = array("q")
+    add_barcode = barcodes.append
+    add_order_id = order_ids.append
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        fields = split_fields(line) if '"' in line else line.split(",")
+        if len(fields) < width:
+            fields.extend([""] * (width - len(fields)))
+
+        barcode = fields[barcode_index]
+        order_id = fields[order_index]
+        order_id = int(order_id) if order_id else NO_ORDER_ID
+
+        if not barcode:
+            if report is not None:
+                report.reject_barcode(MISSING_BARCODE, barcode, order_id)
+            continue
+        if order_id not in IDENTIFIERS:
+            if report is not None:
+                report.reject_barcode(OUT_OF_RANGE_IDENTIFIER, barcode, order_id)
+            continue
+
+        add_barcode(barcode)
+        add_order_id(order_id)
+
+    return BarcodeBatch(barcodes, order_ids)
+
+
+def parse_order_block(
+    lines: Iterable[str], positions: Tuple[int, int], report: IngestionReport = None
+) -> OrderBatch:
+    """Parse a block of CSV lines into a columnar batch of orders.
+
+    >>> parse_order_block(["1,7", "2,", "3,8"], (0, 1))
+    OrderBatch(order_ids=array('q', [1, 3]), customer_ids=array('q', [7, 8]))
+
+    :param lines: The lines to parse, without the header.
+    :param positions: The positions of the `order_id` and `customer_id`
+        columns, see :py:func:`column_positions`.
+    :param report: The report to account for the rejected rows in, if any.
+    :returns: The orders read, possibly none.
+
+    """
+    order_index, customer_index = positions
+    width = max(positions) + 1
+
+    order_ids = array("q")
+    customer_ids = array("q")
+    add_order_id = order_ids.append
+    add_customer_id = customer_ids.append
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        fields = split_fields(line) if '"' in line else line.split(",")
+        if len(fields) < width:
+            fields.extend([""] * (width - len(fields)))
+
+        order_id = fields[order_index]
+        customer_id = fields[customer_index]
+        order_id = int(order_id) if order_id else None
+        customer_id = int(customer_id) if customer_id else None
+
+        if not order_id or not customer_id:
+            if report is not None:
+                report.reject_order(MISSING_IDENTIFIERS, order_id, customer_id)
+            continue
+        if order_id not in IDENTIFIERS or customer_id not in IDENTIFIERS:
+            if report is not None:
+                report.reject_order(OUT_OF_RANGE_IDENTIFIER, order_id, customer_id)
+            continue
+
+        add_order_id(order_id)
+        add_customer_id(customer_id)
+
+    return OrderBatch(order_ids, customer_ids)
+
+
+def read_barcode_batches(
+    text_stream: TextIO,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    report: IngestionReport = None,
+) -> Iterator[BarcodeBatch]:
+    r"""Yield columnar batches of barcodes from a CSV text stream.
+
+    This is the columnar counterpart of :py:func:`read_barcodes`: one batch is
+    yielded per block read and no tuple is built per row.
+
+    >>> from io import StringIO
+    >>> batches = read_barcode_batches(StringIO("barcode,order_id\nabc,1\ng,\n,2\n"))
+    >>> batch = next(batches)
+    >>> batch.barcodes
+    ['abc', 'g']
+    >>> batch.order_ids
+    array('q', [1, 0])
+
+    :param text_stream: The CSV text stream to parse, header included.
+    :param block_size: The amount of characters to read at once.
+    :param report: The report to account for the rejected rows in, if any.
+    :yields: The :py:class:`BarcodeBatch` as they are read.
+
+    """
+    positions, blocks = _read_table(text_stream, block_size, BARCODE_FIELDS)
+
+    for block in blocks:
+        batch = parse_barcode_block(block, positions, report)
+        if batch.barcodes:
+            yield batch
+
+
+def read_order_batches(
+    text_stream: TextIO,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    report: IngestionReport = None,
+) -> Iterator[OrderBatch]:
+    r"""Yield columnar batches of orders from a CSV text stream.
+
+    This is the columnar counterpart of :py:func:`read_orders`.
+
+    >>> from io import StringIO
+    >>> batches = read_order_batches(StringIO("order_id,customer_id\n1,7\n,3\n"))
+    >>> next(batches)
+    OrderBatch(order_ids=array('q', [1]), customer_ids=array('q', [7]))
+
+    :param text_stream: The CSV text stream to parse, header included.
+    :param block_size: The amount of characters to read at once.
+    :param report: The report to account for the rejected rows in, if any.
+    :yields: The :py:class:`OrderBatch` as they are read.
+
+    """
+    positions, blocks = _read_table(text_stream, block_size, ORDER_FIELDS)
+
+    for block in blocks:
+        batch = parse_order_block(block, positions, report)
+        if batch.order_ids:
+            yield batch
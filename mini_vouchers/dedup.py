@@ -0,0 +1,369 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Streaming deduplication of barcodes, within a memory budget.
+
+The barcodes are deduplicated in memory, and yielded as they are first seen,
+until the distinct barcodes reach the memory budget. The barcodes seen so far
+and all the following rows are then partitioned by hash to temporary files.
+Each partition is eventually deduplicated on its own, being partitioned again
+should it not fit in the budget either, and the rows of the partitions are
+merged back in their original order: those of the partitions of a partition
+first, so that the amount of files open at once stays bounded.
+
+The first occurrence of each barcode is kept, as when populating a
+:py:class:`~mini_vouchers.voucher_system.VoucherSystem`.
+"""
+
+from array import array
+from contextlib import closing
+import csv
+import hashlib
+import heapq
+import itertools
+import pickle
+import sys
+import tempfile
+from typing import IO, Iterable, Iterator, List, Set, TextIO, Tuple
+
+from mini_vouchers.csv_utils import (
+    BARCODE_FIELDS,
+    NO_ORDER_ID,
+    BarcodeBatch,
+    ExportedBarcode,
+)
+from mini_vouchers.external_sort import BLOCK_SIZE
+from mini_vouchers.report import DUPLICATE_BARCODE, IngestionReport
+
+
+DEFAULT_BUDGET = 256 << 20
+"""The default memory budget, in bytes."""
+DEFAULT_PARTITIONS = 32
+"""The default amount of partitions the rows are spilled to."""
+ENTRY_OVERHEAD = 48
+"""The approximate size of a set entry besides its barcode, in bytes."""
+MAX_DEPTH = 4
+"""The amount of times a partition may be partitioned again."""
+
+_SEEN = -1
+"""The index of the barcodes yielded before spilling, in the partitions."""
+
+Row = Tuple[int, str, int]
+"""A row of a partition: its index, its barcode and its order identifier."""
+
+
+def partition_of(barcode: str, partitions: int, depth: int = 0) -> int:
+    """Get the partition of a barcode.
+
+    The digest is stable across processes, unlike :py:func:`hash`, and is
+    salted by the depth so that a partition is partitioned again evenly.
+
+    >>> partition_of("B00001", 32) == partition_of("B00001", 32)
+    True
+
+    :param barcode: The barcode value.
+    :param partitions: The amount of partitions.
+    :param depth: The amount of times the rows were partitioned before.
+    :returns: The partition, in `[0, partitions)`.
+
+    """
+    digest = hashlib.blake2b(
+        barcode.encode(), digest_size=8, salt=depth.to_bytes(1, "little")
+    ).digest()
+    return int.from_bytes(digest, "little") % partitions
+
+
+class _Spill:
+    """Rows written to an anonymous temporary file, block by block."""
+
+    def __init__(self, directory: str = None):
+        self._file: IO[bytes] = tempfile.TemporaryFile(dir=directory)
+        self._block: List[tuple] = []
+
+    def append(self, row: tuple):
+        self._block.append(row)
+        if len(self._block) >= BLOCK_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._block:
+            pickle.dump(self._block, self._file, pickle.HIGHEST_PROTOCOL)
+            self._block = []
+
+    def rows(self) -> Iterator[tuple]:
+        """Read the rows back from the start, block by block."""
+        self._flush()
+        self._file.seek(0)
+        while True:
+            try:
+                block = pickle.load(self._file)
+            except EOFError:
+                return
+            yield from block
+
+    def close(self):
+        self._file.close()
+
+
+def _partition(
+    rows: Iterable[Row], partitions: int, depth: int, directory: str = None
+) -> List[_Spill]:
+    """Spill rows to partitions by the hash of their barcode."""
+    spills = [_Spill(directory) for _ in range(partitions)]
+    try:
+        for row in rows:
+            spills[partition_of(row[1], partitions, depth)].append(row)
+    except BaseException:
+        for spill in spills:
+            spill.close()
+        raise
+    return spills
+
+
+def _merge_runs(runs: List[_Spill], directory: str = None) -> _Spill:
+    """Merge runs of rows sorted by index into a single run, closing them."""
+    if len(runs) == 1:
+        return runs[0]
+
+    merged = _Spill(directory)
+    try:
+        for row in heapq.merge(*(run.rows() for run in runs)):
+            merged.append(row)
+    except BaseException:
+        merged.close()
+        raise
+    finally:
+        for run in runs:
+            run.close()
+    return merged
+
+
+def _deduplicate_partition(
+    spill: _Spill, budget: int, partitions: int, depth: int, directory: str = None
+) -> _Spill:
+    """Deduplicate a partition, partitioning it again if it is too large.
+
+    :returns: The run of rows, sorted by index, holding the rows of the
+        partition but the barcodes seen before spilling. Each row is flagged
+        as a duplicate or not.
+
+    """
+    seen: Set[str] = set()
+    size = 0
+    run = _Spill(directory)
+    try:
+        for index, barcode, order_id in spill.rows():
+            if barcode in seen:
+                if index != _SEEN:
+                    run.append((index, barcode, order_id, True))
+                continue
+
+            seen.add(barcode)
+            size += sys.getsizeof(barcode) + ENTRY_OVERHEAD
+            # Past the last depth, the partition is deduplicated over the budget.
+            if size >= budget and depth < MAX_DEPTH:
+                break
+            if index != _SEEN:
+                run.append((index, barcode, order_id, False))
+        else:
+            return run
+    except BaseException:
+        run.close()
+        raise
+
+    run.close()
+    del seen
+    sub_spills = _partition(spill.rows(), partitions, depth + 1, directory)
+    runs: List[_Spill] = []
+    try:
+        for sub_spill in sub_spills:
+            with closing(sub_spill):
+                runs.append(
+                    _deduplicate_partition(
+                        sub_spill, budget, partitions, depth + 1, directory
+                    )
+                )
+    except BaseException:
+        for run in runs:
+            run.close()
+        raise
+    finally:
+        for sub_spill in sub_spills:
+            sub_spill.close()
+    # The sub-runs are merged right away, so that only one run per partition
+    # is left open for the final merge.
+    return _merge_runs(runs, directory)
+
+
+def deduplicate(
+    rows: Iterable[Tuple[str, int]],
+    report: IngestionReport = None,
+    budget: int = DEFAULT_BUDGET,
+    partitions: int = DEFAULT_PARTITIONS,
+    directory: str = None,
+) -> Iterator[ExportedBarcode]:
+    """Deduplicate barcodes within a memory budget, spilling to disk if need be.
+
+    >>> rows = [('a', 10), ('b', 0), ('a', 11), ('c', 12), ('b', 0)]
+    >>> report = IngestionReport()
+    >>> list(deduplicate(rows, report, budget=128, partitions=2))
+    [ExportedBarcode(barcode='a', order_id=10), \
+ExportedBarcode(barcode='b', order_id=None), \
+ExportedBarcode(barcode='c', order_id=12)]
+    >>> report.counts
+    {'duplicate barcode': 2}
+
+    No file is written when the distinct barcodes fit in the budget.
+
+    :param rows: The barcode values and order identifiers, e.g. of
+        :py:class:`~mini_vouchers.csv_utils.ExportedBarcode` or zipped from a
+        :py:class:`~mini_vouchers.csv_utils.BarcodeBatch`. Falsy order
+        identifiers stand for available barcodes.
+    :param report: The report to account for the duplicate rows in, if any.
+    :param budget: The approximate amount of bytes the distinct barcodes held
+        in memory may take.
+    :param partitions: The amount of partitions the rows are spilled to.
+    :param directory: The directory of the temporary files. Defaults to the
+        platform default.
+    :yields: The first occurrence of each barcode, in the order of `rows`.
+
+    """
+    assert budget > 0 and partitions > 1
+
+    seen: Set[str] = set()
+    size = 0
+    indexed_rows = enumerate(rows)
+    for index, (barcode, order_id) in indexed_rows:
+        if barcode in seen:
+            if report is not None:
+                report.reject_barcode(DUPLICATE_BARCODE, barcode, order_id)
+            continue
+
+        seen.add(barcode)
+        yield ExportedBarcode(barcode, order_id or None)
+
+        size += sys.getsizeof(barcode) + ENTRY_OVERHEAD
+        if size >= budget:
+            break
+    else:
+        return
+
+    # The barcodes already yielded lead each partition, to flag their later
+    # occurrences as duplicates.
+    spilled = itertools.chain(
+        ((_SEEN, barcode, 0) for barcode in seen),
+        ((index, barcode, order_id) for index, (barcode, order_id) in indexed_rows),
+    )
+    spills = _partition(spilled, partitions, 0, directory)
+    del seen
+
+    runs: List[_Spill] = []
+    try:
+        for spill in spills:
+            with closing(spill):
+                runs.append(
+                    _deduplicate_partition(spill, budget, partitions, 0, directory)
+                )
+
+        for _, barcode, order_id, duplicate in heapq.merge(
+            *(run.rows() for run in runs)
+        ):
+            if not duplicate:
+                yield ExportedBarcode(barcode, order_id or None)
+            elif report is not None:
+                report.reject_barcode(DUPLICATE_BARCODE, barcode, order_id)
+    finally:
+        for spill in itertools.chain(spills, runs):
+            spill.close()
+
+
+def deduplicate_batches(
+    barcode_batches: Iterable[BarcodeBatch],
+    report: IngestionReport = None,
+    budget: int = DEFAULT_BUDGET,
+    batch_size: int = BLOCK_SIZE,
+) -> Iterator[BarcodeBatch]:
+    """Deduplicate batches of barcodes within a memory budget.
+
+    This is the columnar counterpart of :py:func:`deduplicate`.
+
+    >>> batches = [BarcodeBatch(['a', 'b'], array('q', [10, 0])),
+    ...            BarcodeBatch(['a', 'c'], array('q', [11, 12]))]
+    >>> list(deduplicate_batches(batches, batch_size=2))
+    [BarcodeBatch(barcodes=['a', 'b'], order_ids=array('q', [10, 0])), \
+BarcodeBatch(barcodes=['c'], order_ids=array('q', [12]))]
+
+    :param barcode_batches: The batches of barcodes previously exported.
+    :param report: The report to account for the duplicate rows in, if any.
+    :param budget: The approximate amount of bytes the distinct barcodes held
+        in memory may take.
+    :param batch_size: The amount of barcodes of each batch yielded.
+    :yields: The batches of the first occurrence of each barcode, in order.
+
+    """
+    assert batch_size > 0
+
+    exported_barcodes = deduplicate(
+        itertools.chain.from_iterable(
+            zip(barcodes, order_ids) for barcodes, order_ids in barcode_batches
+        ),
+        report,
+        budget,
+    )
+    while True:
+        chunk = list(itertools.islice(exported_barcodes, batch_size))
+        if not chunk:
+            return
+        yield BarcodeBatch(
+            [barcode for barcode, _ in chunk],
+            array("q", [order_id or NO_ORDER_ID for _, order_id in chunk]),
+        )
+
+
+def write_barcodes(
+    exported_barcodes: Iterable[ExportedBarcode],
+    output: TextIO,
+    chunk_size: int = BLOCK_SIZE,
+) -> int:
+    r"""Write barcodes as a barcodes CSV file, with its header.
+
+    >>> import io
+    >>> output = io.StringIO()
+    >>> write_barcodes([ExportedBarcode('a', 10), ExportedBarcode('b')], output)
+    2
+    >>> output.getvalue()
+    'barcode,order_id\na,10\nb,\n'
+
+    :param exported_barcodes: The barcodes to write, in order.
+    :param output: The text stream to write to, opened with `newline=""` if
+        it is a file.
+    :param chunk_size: The amount of barcodes written at once.
+    :returns: The amount of barcodes written.
+
+    """
+    assert chunk_size > 0
+
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow(BARCODE_FIELDS)
+    count = 0
+    exported_barcodes = iter(exported_barcodes)
+    while True:
+        chunk = list(itertools.islice(exported_barcodes, chunk_size))
+        if not chunk:
+            return count
+        writer.writerows((barcode, order_id or "") for barcode, order_id in chunk)
+        count += len(chunk)
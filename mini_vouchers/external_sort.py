@@ -0,0 +1,172 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""External merge sort, to sort more items than the memory can hold.
+
+The items are gathered until their approximate size reaches a memory budget.
+Each such run is then sorted and spilled to a temporary file, and the runs are
+eventually merged back in a single sorted stream. Only one block of items per
+run is held in memory while merging.
+
+Runs are merged at most :py:const:`MAX_FAN_IN` at a time: as soon as that many
+runs of the same pass are spilled, they are merged into a run of the next pass,
+so that the amount of files open at once only grows with the logarithm of the
+amount of items.
+"""
+
+import heapq
+import itertools
+import pickle
+import sys
+import tempfile
+from typing import IO, Any, Callable, Iterable, Iterator, List, Optional
+
+
+DEFAULT_BUDGET = 256 << 20
+"""The default memory budget, in bytes."""
+BLOCK_SIZE = 1024
+"""The amount of items written to or read from a run at once."""
+MAX_FAN_IN = 16
+"""The amount of runs merged at once."""
+
+
+def parse_size(value: str) -> int:
+    """Parse an amount of bytes, optionally suffixed by a binary unit.
+
+    >>> parse_size("512"), parse_size("64K"), parse_size("1g")
+    (512, 65536, 1073741824)
+
+    :param value: The amount, e.g. `64M`.
+    :returns: The amount of bytes.
+    :raises ValueError: If the amount is malformed or negative.
+
+    """
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    factor = units.get(value[-1:].upper(), 1)
+    if factor != 1:
+        value = value[:-1]
+
+    amount = int(value) * factor
+    if amount < 0:
+        raise ValueError(f"Negative amount of bytes: {amount}")
+    return amount
+
+
+def _spill(items: Iterable[Any], directory: Optional[str]) -> IO[bytes]:
+    """Write sorted items to an anonymous temporary file, block by block."""
+    run = tempfile.TemporaryFile(dir=directory)
+    try:
+        items = iter(items)
+        while True:
+            block = list(itertools.islice(items, BLOCK_SIZE))
+            if not block:
+                break
+            pickle.dump(block, run, pickle.HIGHEST_PROTOCOL)
+    except BaseException:
+        run.close()
+        raise
+    run.seek(0)
+    return run
+
+
+def _read_run(run: IO[bytes]) -> Iterator[Any]:
+    """Read the items of a run back, block by block, and close it."""
+    with run:
+        while True:
+            try:
+                block = pickle.load(run)
+            except EOFError:
+                return
+            yield from block
+
+
+def _merge_last_runs(
+    runs: List[IO[bytes]], key: Optional[Callable[[Any], Any]], directory: str
+):
+    """Merge the last runs stably into a single run, in place, closing them."""
+    merged = _spill(
+        heapq.merge(*map(_read_run, runs[-MAX_FAN_IN:]), key=key), directory
+    )
+    runs[-MAX_FAN_IN:] = [merged]
+
+
+def external_sorted(
+    iterable: Iterable[Any],
+    key: Callable[[Any], Any] = None,
+    budget: int = DEFAULT_BUDGET,
+    sizeof: Callable[[Any], int] = sys.getsizeof,
+    directory: str = None,
+) -> Iterator[Any]:
+    """Sort items within a memory budget, spilling sorted runs to disk.
+
+    The result is the same as :py:func:`sorted`, including its stability, but
+    is yielded lazily.
+
+    >>> list(external_sorted([5, 3, 9, 1, 3, 7], budget=64, sizeof=lambda _: 32))
+    [1, 3, 3, 5, 7, 9]
+
+    No file is written when every item fits in the budget.
+
+    :param iterable: The items to sort. They must be picklable.
+    :param key: The sorting function to apply. Defaults to sorted by value.
+    :param budget: The approximate amount of bytes the items held in memory
+        may take.
+    :param sizeof: The function computing the approximate size of an item.
+    :param directory: The directory of the temporary files. Defaults to the
+        platform default.
+    :yields: The items, sorted.
+
+    """
+    assert budget > 0
+
+    runs: List[IO[bytes]] = []
+    # The amount of merges each run went through.
+    passes: List[int] = []
+    items: List[Any] = []
+    size = 0
+
+    try:
+        for item in iterable:
+            items.append(item)
+            size += sizeof(item)
+
+            if size >= budget:
+                items.sort(key=key)
+                runs.append(_spill(items, directory))
+                passes.append(0)
+                items = []
+                size = 0
+
+                while len(runs) >= MAX_FAN_IN and passes[-MAX_FAN_IN] == passes[-1]:
+                    merged_passes = passes[-1] + 1
+                    _merge_last_runs(runs, key, directory)
+                    passes[-MAX_FAN_IN:] = [merged_passes]
+
+        items.sort(key=key)
+        if not runs:
+            yield from items
+            return
+
+        # Merge the runs stably: earlier runs hold earlier items.
+        runs.append(_spill(items, directory))
+        del items
+        while len(runs) > MAX_FAN_IN:
+            _merge_last_runs(runs, key, directory)
+        yield from heapq.merge(*map(_read_run, runs), key=key)
+    finally:
+        for run in runs:
+            run.close()
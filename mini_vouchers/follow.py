@@ -0,0 +1,333 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Following of CSV files as they grow.
+
+Each file is read from the offset it was last read up to, and only its lines
+completed since then are parsed, by the block parsers of
+:py:mod:`mini_vouchers.csv_utils`. The first rows read populate the system,
+while the next ones are applied to it as deltas, see
+:py:meth:`~mini_vouchers.voucher_system.VoucherSystem.apply_delta`: the cost of
+an update is that of the rows appended.
+
+The rules of a delta apply to the rows appended: a barcode appended before its
+order is attributed to it once the order is appended, while a barcode appended
+again with an order once available is attributed to that order, where a single
+population would have discarded it. Files that shrink are read again from the
+start.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+from mini_vouchers.csv_utils import (
+    BARCODE_FIELDS,
+    DEFAULT_BLOCK_SIZE,
+    ORDER_FIELDS,
+    BarcodeBatch,
+    OrderBatch,
+    column_positions,
+    parse_barcode_block,
+    parse_order_block,
+)
+from mini_vouchers.mapped import ENCODING
+from mini_vouchers.profiling import NULL_PROFILER
+from mini_vouchers.report import IngestionReport
+from mini_vouchers.voucher_system import VoucherSystem
+
+
+DEFAULT_INTERVAL = 5.0
+"""The default time between two updates, in seconds."""
+
+
+class FollowedFile:
+    r"""A CSV file read as it grows, a complete line at a time.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("w", suffix=".csv") as csv_file:
+    ...     followed = FollowedFile.barcodes(csv_file.name)
+    ...     _ = csv_file.write("barcode,order_id\nabc,1\ng"); csv_file.flush()
+    ...     list(followed.batches())
+    ...     _ = csv_file.write(",\n"); csv_file.flush()
+    ...     list(followed.batches())
+    [BarcodeBatch(barcodes=['abc'], order_ids=array('q', [1]))]
+    [BarcodeBatch(barcodes=['g'], order_ids=array('q', [0]))]
+
+    """
+
+    path: str
+    """The path of the file."""
+    offset: int
+    """The amount of bytes read and parsed, up to the end of a line."""
+    fieldnames: Sequence[str]
+    """The names of the columns to locate in the header."""
+    parse_block: Callable[..., Any]
+    """The function parsing a block of lines into a batch, e.g.
+    :py:func:`~mini_vouchers.csv_utils.parse_barcode_block`."""
+    block_size: int
+    """The amount of bytes read at once."""
+    _positions: Optional[Tuple[int, ...]]
+    """The positions of the columns, once the header is read."""
+
+    def __init__(
+        self,
+        path: str,
+        fieldnames: Sequence[str],
+        parse_block: Callable[..., Any],
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ):
+        """Initialise the file, to be read from its start.
+
+        :param path: The path of the file.
+        :param fieldnames: The names of the columns to locate in the header.
+        :param parse_block: The function parsing a block of lines into a
+            batch, given the lines, the positions of the columns and a report.
+        :param block_size: The amount of bytes read at once.
+
+        """
+        assert block_size > 0
+
+        self.path = path
+        self.offset = 0
+        self.fieldnames = fieldnames
+        self.parse_block = parse_block
+        self.block_size = block_size
+        self._positions = None
+
+    @classmethod
+    def barcodes(cls, path: str, block_size: int = DEFAULT_BLOCK_SIZE):
+        """Follow a barcodes CSV file.
+
+        :param path: The path of the file.
+        :param block_size: The amount of bytes read at once.
+        :returns: The file, yielding :py:class:`BarcodeBatch`.
+
+        """
+        return cls(path, BARCODE_FIELDS, parse_barcode_block, block_size)
+
+    @classmethod
+    def orders(cls, path: str, block_size: int = DEFAULT_BLOCK_SIZE):
+        """Follow an orders CSV file.
+
+        :param path: The path of the file.
+        :param block_size: The amount of bytes read at once.
+        :returns: The file, yielding :py:class:`OrderBatch`.
+
+        """
+        return cls(path, ORDER_FIELDS, parse_order_block, block_size)
+
+    def batches(self, report: IngestionReport = None) -> Iterator[Any]:
+        """Parse the lines completed since the last read.
+
+        The offset moves forward as the batches are yielded. A line not ended
+        yet is left to a later read.
+
+        :param report: The report to account for the rejected rows in, if any.
+        :yields: The batches of the lines parsed, none of them empty.
+
+        """
+        with open(self.path, "rb") as csv_file:
+            if os.fstat(csv_file.fileno()).st_size < self.offset:
+                logging.warning("%s shrank, reading it again", self.path)
+                self.offset = 0
+                self._positions = None
+            csv_file.seek(self.offset)
+
+            pending = b""
+            block = csv_file.read(self.block_size)
+            while block:
+                data = pending + block
+                end = data.rfind(b"\n") + 1
+                pending = data[end:]
+                block = csv_file.read(self.block_size)
+                if not end:
+                    continue
+
+                lines = data[:end].decode(ENCODING).split("\n")
+                lines.pop()
+                self.offset += end
+                if self._positions is None:
+                    self._positions = column_positions(lines[0], self.fieldnames)
+                    del lines[0]
+
+                batch = self.parse_block(lines, self._positions, report)
+                if batch[0]:
+                    yield batch
+
+
+class Follower:
+    r"""A voucher system kept up to date with CSV files as they grow.
+
+    >>> import tempfile
+    >>> directory = tempfile.TemporaryDirectory()
+    >>> barcodes_path = os.path.join(directory.name, "barcodes.csv")
+    >>> orders_path = os.path.join(directory.name, "orders.csv")
+    >>> def append(path, text):
+    ...     with open(path, "a") as csv_file:
+    ...         _ = csv_file.write(text)
+    >>> append(barcodes_path, "barcode,order_id\na,10\nb,\n")
+    >>> append(orders_path, "order_id,customer_id\n10,7\n")
+    >>> follower = Follower(VoucherSystem(), [barcodes_path], [orders_path])
+    >>> follower.update(), follower.system.get_top_customers(1)
+    (3, [(7, 1)])
+    >>> append(orders_path, "11,8\n")
+    >>> append(barcodes_path, "c,11\nd,11\n")
+    >>> follower.update(), follower.system.get_top_customers(1)
+    (3, [(8, 2)])
+    >>> follower.update()
+    0
+
+    A barcode appended before its order is attributed to it once the order is
+    appended, as if the files had been read at once:
+
+    >>> append(barcodes_path, "e,12\n")
+    >>> follower.update(), follower.system.stats().discarded_barcodes
+    (1, 1)
+    >>> append(orders_path, "12,9\n")
+    >>> follower.update()
+    1
+    >>> fresh = Follower(VoucherSystem(), [barcodes_path], [orders_path])
+    >>> fresh.update()
+    8
+    >>> follower.system.get_orders() == fresh.system.get_orders()
+    True
+    >>> follower.system.stats() == fresh.system.stats()
+    True
+    >>> follower.system.get_top_customers(3) == fresh.system.get_top_customers(3)
+    True
+    >>> directory.cleanup()
+
+    """
+
+    system: VoucherSystem
+    """The system to keep up to date."""
+    barcode_files: List[FollowedFile]
+    """The barcodes files followed, in order."""
+    order_files: List[FollowedFile]
+    """The orders files followed, in order."""
+    _populated: bool
+    """Whether the system was populated by a first update."""
+
+    def __init__(
+        self,
+        system: VoucherSystem,
+        barcode_paths: Sequence[str],
+        order_paths: Sequence[str],
+        block_size: int = DEFAULT_BLOCK_SIZE,
+    ):
+        """Initialise the follower of files not read yet.
+
+        :param system: The empty system to keep up to date.
+        :param barcode_paths: The paths of the barcodes files, in order.
+        :param order_paths: The paths of the orders files, in order.
+        :param block_size: The amount of bytes read at once.
+
+        """
+        self.system = system
+        self.barcode_files = [
+            FollowedFile.barcodes(path, block_size) for path in barcode_paths
+        ]
+        self.order_files = [
+            FollowedFile.orders(path, block_size) for path in order_paths
+        ]
+        self._populated = False
+
+    def update(self, report: IngestionReport = None) -> int:
+        """Read the rows appended since the last update and apply them.
+
+        The orders are read before the barcodes.
+
+        :param report: The report to account for the rejected rows in, if any.
+        :returns: The amount of rows read.
+
+        """
+        rows = 0
+
+        def counted(batches: Iterator[Any]) -> Iterator[Any]:
+            nonlocal rows
+            for batch in batches:
+                rows += len(batch[0])
+                yield batch
+
+        order_batches: Iterator[OrderBatch] = counted(
+            itertools.chain.from_iterable(
+                followed.batches(report) for followed in self.order_files
+            )
+        )
+        barcode_batches: Iterator[BarcodeBatch] = counted(
+            itertools.chain.from_iterable(
+                followed.batches(report) for followed in self.barcode_files
+            )
+        )
+
+        if not self._populated:
+            self.system.populate_batches(barcode_batches, order_batches, report)
+            self._populated = True
+        else:
+            self.system.apply_delta(barcode_batches, order_batches, report)
+        return rows
+
+    def run(
+        self,
+        on_update: Callable[[IngestionReport], None],
+        interval: float = DEFAULT_INTERVAL,
+        report: IngestionReport = None,
+        rounds: int = None,
+        stopping: threading.Event = None,
+        profiler=NULL_PROFILER,
+    ):
+        """Update the system periodically, until stopped.
+
+        :param on_update: The function called after the first update and
+            after each update reading rows, given the report of the update.
+        :param interval: The time between the start of two updates, in
+            seconds.
+        :param report: The report to account for all the rejected rows in, if
+            any. Defaults to an empty report.
+        :param rounds: The amount of updates before returning. Defaults to
+            updating until stopped.
+        :param stopping: The event to set to return once the update in
+            progress, if any, is over.
+        :param profiler: The profiler to measure the updates with.
+
+        """
+        assert interval >= 0 and (rounds is None or rounds > 0)
+
+        if report is None:
+            report = IngestionReport()
+        if stopping is None:
+            stopping = threading.Event()
+
+        for round_index in itertools.count():
+            start = time.monotonic()
+            update_report = report.empty_copy()
+            with profiler.measure("update") as stage:
+                rows = self.update(update_report)
+                stage.rows += rows
+            report.merge(update_report)
+
+            if round_index == 0 or rows or update_report.total():
+                on_update(update_report)
+
+            if rounds is not None and round_index + 1 >= rounds:
+                return
+            if stopping.wait(max(0.0, interval - (time.monotonic() - start))):
+                return
@@ -0,0 +1,289 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Memory-mapped readers of the CSV files.
+
+The files are mapped in memory and parsed one block of bytes at a time. Only
+the fields that are kept are decoded: barcodes are decoded to strings while
+identifiers are converted to integers straight from their bytes. The peak
+memory is thus bounded by the block size rather than by the file size, and the
+page cache is shared instead of being copied into a text stream.
+"""
+
+from array import array
+from contextlib import contextmanager
+import mmap
+from typing import Iterator, List, Sequence, Tuple, Union
+
+from mini_vouchers.csv_utils import (
+    BARCODE_FIELDS,
+    DEFAULT_BLOCK_SIZE,
+    IDENTIFIERS,
+    NO_ORDER_ID,
+    ORDER_FIELDS,
+    BarcodeBatch,
+    OrderBatch,
+    column_positions,
+    split_fields,
+)
+from mini_vouchers.report import (
+    MISSING_BARCODE,
+    MISSING_IDENTIFIERS,
+    OUT_OF_RANGE_IDENTIFIER,
+    IngestionReport,
+)
+
+
+ENCODING = "utf-8"
+"""The encoding of the CSV files."""
+
+QUOTE = ord('"')
+"""The quote character, as a byte value: looking it up is much faster than
+looking up a one-byte string."""
+
+Buffer = Union[bytes, mmap.mmap]
+
+
+@contextmanager
+def map_file(path: str) -> Iterator[Buffer]:
+    """Map a file in memory, read-only.
+
+    Empty files cannot be mapped and are represented by an empty buffer.
+
+    :param path: The path of the file to map.
+    :yields: The mapped buffer, closed on exit.
+
+    """
+    with open(path, "rb") as mapped_file:
+        try:
+            buffer = mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            yield b""
+            return
+
+        with buffer:
+            yield buffer
+
+
+def read_header(
+    buffer: Buffer, fieldnames: Sequence[str]
+) -> Tuple[Tuple[int, ...], int]:
+    r"""Locate the columns of a mapped CSV file.
+
+    >>> read_header(b"order_id,barcode\r\nabc,1\n", BARCODE_FIELDS)
+    ((1, 0), 18)
+
+    :param buffer: The mapped CSV file.
+    :param fieldnames: The names of the columns to locate.
+    :returns: The position of each column and the offset of the first line
+        following the header.
+
+    """
+    end = buffer.find(b"\n")
+    end = len(buffer) if end < 0 else end + 1
+    header = buffer[:end].decode(ENCODING)
+
+    return column_positions(header, fieldnames), end
+
+
+def iter_blocks(
+    buffer: Buffer, start: int, end: int, block_size: int = DEFAULT_BLOCK_SIZE
+) -> Iterator[List[bytes]]:
+    r"""Yield the lines of a mapped buffer, one block of lines at a time.
+
+    The blocks are cut on line boundaries.
+
+    >>> list(iter_blocks(b"ab\ncd\nef", 0, 8, 4))
+    [[b'ab', b'cd', b''], [b'ef']]
+
+    :param buffer: The mapped buffer.
+    :param start: The offset of the first line to read.
+    :param end: The offset past the last byte to read.
+    :param block_size: The approximate amount of bytes to read at once.
+    :yields: Lists of consecutive lines, not trimmed.
+
+    """
+    assert block_size > 0
+
+    while start < end:
+        stop = buffer.find(b"\n", min(start + block_size, end) - 1, end)
+        stop = end if stop < 0 else stop + 1
+        yield buffer[start:stop].split(b"\n")
+        start = stop
+
+
+def _split_quoted_bytes(line: bytes) -> List[bytes]:
+    """Split a single CSV line of bytes holding quoted fields."""
+    return [field.encode(ENCODING) for field in split_fields(line.decode(ENCODING))]
+
+
+def parse_barcode_lines(
+    lines: Sequence[bytes], positions: Tuple[int, int], report: IngestionReport = None
+) -> BarcodeBatch:
+    """Parse lines of bytes into a columnar batch of barcodes.
+
+    This is the counterpart of :py:func:`mini_vouchers.csv_utils.parse_barcode_block`
+    for lines that were not decoded.
+
+    >>> parse_barcode_lines([b"abc,1", b"", b'"d,e",', b",2"], (0, 1))
+    BarcodeBatch(barcodes=['abc', 'd,e'], order_ids=array('q', [1, 0]))
+
+    :param lines: The lines to parse, without the header.
+    :param positions: The positions of the `barcode` and `order_id` columns.
+    :param report: The report to account for the rejected rows in, if any.
+    :returns: The barcodes read, possibly none.
+
+    """
+    barcode_index, order_index = positions
+    width = max(positions) + 1
+
+    barcodes: List[str] = []
+    order_ids = array("q")
+    add_barcode = barcodes.append
+    add_order_id = order_ids.append
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        fields = _split_quoted_bytes(line) if QUOTE in line else line.split(b",")
+        if len(fields) < width:
+            fields.extend([b""] * (width - len(fields)))
+
+        barcode = fields[barcode_index]
+        order_id = fields[order_index]
+        order_id = int(order_id) if order_id else NO_ORDER_ID
+
+        if not barcode:
+            if report is not None:
+                report.reject_barcode(MISSING_BARCODE, "", order_id)
+            continue
+        if order_id not in IDENTIFIERS:
+            if report is not None:
+                report.reject_barcode(
+                    OUT_OF_RANGE_IDENTIFIER, barcode.decode(ENCODING), order_id
+                )
+            continue
+
+        add_barcode(barcode.decode(ENCODING))
+        add_order_id(order_id)
+
+    return BarcodeBatch(barcodes, order_ids)
+
+
+def parse_order_lines(
+    lines: Sequence[bytes], positions: Tuple[int, int], report: IngestionReport = None
+) -> OrderBatch:
+    """Parse lines of bytes into a columnar batch of orders.
+
+    This is the counterpart of :py:func:`mini_vouchers.csv_utils.parse_order_block`
+    for lines that were not decoded.
+
+    >>> parse_order_lines([b"1,7", b"2,", b"3,8"], (0, 1))
+    OrderBatch(order_ids=array('q', [1, 3]), customer_ids=array('q', [7, 8]))
+
+    :param lines: The lines to parse, without the header.
+    :param positions: The positions of the `order_id` and `customer_id` columns.
+    :param report: The report to account for the rejected rows in, if any.
+    :returns: The orders read, possibly none.
+
+    """
+    order_index, customer_index = positions
+    width = max(positions) + 1
+
+    order_ids = array("q")
+    customer_ids = array("q")
+    add_order_id = order_ids.append
+    add_customer_id = customer_ids.append
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        fields = _split_quoted_bytes(line) if QUOTE in line else line.split(b",")
+        if len(fields) < width:
+            fields.extend([b""] * (width - len(fields)))
+
+        order_id = fields[order_index]
+        customer_id = fields[customer_index]
+        order_id = int(order_id) if order_id else None
+        customer_id = int(customer_id) if customer_id else None
+
+        if not order_id or not customer_id:
+            if report is not None:
+                report.reject_order(MISSING_IDENTIFIERS, order_id, customer_id)
+            continue
+        if order_id not in IDENTIFIERS or customer_id not in IDENTIFIERS:
+            if report is not None:
+                report.reject_order(OUT_OF_RANGE_IDENTIFIER, order_id, customer_id)
+            continue
+
+        add_order_id(order_id)
+        add_customer_id(customer_id)
+
+    return OrderBatch(order_ids, customer_ids)
+
+
+def read_mapped_barcode_batches(
+    path: str, block_size: int = DEFAULT_BLOCK_SIZE, report: IngestionReport = None
+) -> Iterator[BarcodeBatch]:
+    r"""Yield columnar batches of barcodes from a memory-mapped CSV file.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("w", suffix=".csv") as csv_file:
+    ...     _ = csv_file.write("order_id,barcode\n1,abc\n,def\n")
+    ...     csv_file.flush()
+    ...     list(read_mapped_barcode_batches(csv_file.name))
+    [BarcodeBatch(barcodes=['abc', 'def'], order_ids=array('q', [1, 0]))]
+
+    :param path: The path of the CSV file, header included.
+    :param block_size: The approximate amount of bytes to read at once.
+    :param report: The report to account for the rejected rows in, if any.
+    :yields: The non-empty :py:class:`~mini_vouchers.csv_utils.BarcodeBatch` as
+        they are read.
+
+    """
+    with map_file(path) as buffer:
+        positions, start = read_header(buffer, BARCODE_FIELDS)
+
+        for lines in iter_blocks(buffer, start, len(buffer), block_size):
+            batch = parse_barcode_lines(lines, positions, report)
+            if batch.barcodes:
+                yield batch
+
+
+def read_mapped_order_batches(
+    path: str, block_size: int = DEFAULT_BLOCK_SIZE, report: IngestionReport = None
+) -> Iterator[OrderBatch]:
+    """Yield columnar batches of orders from a memory-mapped CSV file.
+
+    :param path: The path of the CSV file, header included.
+    :param block_size: The approximate amount of bytes to read at once.
+    :param report: The report to account for the rejected rows in, if any.
+    :yields: The non-empty :py:class:`~mini_vouchers.csv_utils.OrderBatch` as
+        they are read.
+
+    """
+    with map_file(path) as buffer:
+        positions, start = read_header(buffer, ORDER_FIELDS)
+
+        for lines in iter_blocks(buffer, start, len(buffer), block_size):
+            batch = parse_order_lines(lines, positions, report)
+            if batch.order_ids:
+                yield batch
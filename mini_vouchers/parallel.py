@@ -0,0 +1,254 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Parallel ingestion of sharded or large barcode CSV files.
+
+The barcode files are cut into byte ranges aligned on line boundaries. Each
+range is parsed into a :py:class:`~mini_vouchers.csv_utils.BarcodeBatch` by a
+pool of worker processes, and the batches are handed back in the order of the
+files and of the ranges within them. Feeding them to
+:py:meth:`~mini_vouchers.voucher_system.VoucherSystem.populate_batches` thus
+keeps the "first occurrence wins" rule of a serial ingestion.
+"""
+
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+import glob
+import itertools
+import os
+from typing import Callable, Deque, Iterator, List, NamedTuple, Sequence, Tuple
+
+from mini_vouchers.csv_utils import (
+    BARCODE_FIELDS,
+    BarcodeBatch,
+    column_positions,
+    parse_barcode_block,
+)
+from mini_vouchers.mapped import ENCODING, iter_blocks, map_file, parse_barcode_lines
+from mini_vouchers.report import IngestionReport
+
+
+DEFAULT_CHUNK_SIZE = 64 << 20
+"""The approximate amount of bytes parsed by a worker at once."""
+
+
+class ByteRange(NamedTuple):
+    """A range of whole lines within a CSV file."""
+
+    path: str
+    """The path of the CSV file."""
+    start: int
+    """The offset of the first byte, at the beginning of a line."""
+    end: int
+    """The offset past the last byte, at the beginning of a line or at the end
+    of the file."""
+    positions: Tuple[int, int]
+    """The positions of the columns, as read from the header of the file."""
+
+
+def expand_paths(patterns: Sequence[str]) -> List[str]:
+    """Expand glob patterns into the paths they match.
+
+    The paths matching a pattern are sorted, while the patterns keep their
+    ordering. A pattern matching nothing is kept as is.
+
+    >>> expand_paths(["/nonexistent/*.csv", "/nonexistent/b.csv"])
+    ['/nonexistent/*.csv', '/nonexistent/b.csv']
+
+    :param patterns: The paths or glob patterns.
+    :returns: A fresh list of paths.
+
+    """
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+
+def split_file(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[ByteRange]:
+    r"""Split a barcodes CSV file into ranges of whole lines.
+
+    The header is excluded from the ranges.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("w", suffix=".csv") as csv_file:
+    ...     _ = csv_file.write("barcode,order_id\nabc,1\ndef,\nghi,2\n")
+    ...     csv_file.flush()
+    ...     [(r.start, r.end) for r in split_file(csv_file.name, 8)]
+    [(17, 28), (28, 34)]
+
+    :param path: The path of the CSV file.
+    :param chunk_size: The approximate size of each range, in bytes.
+    :returns: A fresh list of contiguous ranges covering the whole file.
+
+    """
+    assert chunk_size > 0
+
+    with open(path, "rb") as csv_file:
+        positions = column_positions(
+            csv_file.readline().decode(ENCODING), BARCODE_FIELDS
+        )
+        start = csv_file.tell()
+        size = os.fstat(csv_file.fileno()).st_size
+
+        ranges = []
+        while start < size:
+            # Move to the beginning of the line following the nominal boundary.
+            csv_file.seek(min(start + chunk_size, size) - 1)
+            csv_file.readline()
+            end = csv_file.tell()
+
+            ranges.append(ByteRange(path, start, end, positions))
+            start = end
+
+    return ranges
+
+
+def parse_range(byte_range: ByteRange, report: IngestionReport = None) -> BarcodeBatch:
+    """Parse a range of a barcodes CSV file.
+
+    :param byte_range: The range to parse.
+    :param report: The report to account for the rejected rows in, if any.
+    :returns: The barcodes read, possibly none.
+
+    """
+    with open(byte_range.path, "rb") as csv_file:
+        csv_file.seek(byte_range.start)
+        data = csv_file.read(byte_range.end - byte_range.start)
+
+    return parse_barcode_block(
+        data.decode(ENCODING).split("\n"), byte_range.positions, report
+    )
+
+
+def parse_mapped_range(
+    byte_range: ByteRange, report: IngestionReport = None
+) -> BarcodeBatch:
+    """Parse a range of a memory-mapped barcodes CSV file.
+
+    This is the counterpart of :py:func:`parse_range` only decoding the barcodes,
+    see :py:mod:`mini_vouchers.mapped`.
+
+    :param byte_range: The range to parse.
+    :param report: The report to account for the rejected rows in, if any.
+    :returns: The barcodes read, possibly none.
+
+    """
+    batch = BarcodeBatch([], array("q"))
+
+    with map_file(byte_range.path) as buffer:
+        for lines in iter_blocks(buffer, byte_range.start, byte_range.end):
+            block_batch = parse_barcode_lines(lines, byte_range.positions, report)
+            batch.barcodes.extend(block_batch.barcodes)
+            batch.order_ids.extend(block_batch.order_ids)
+
+    return batch
+
+
+def _parse_reported(
+    parse: Callable[[ByteRange, IngestionReport], BarcodeBatch],
+    report: IngestionReport,
+    byte_range: ByteRange,
+) -> Tuple[BarcodeBatch, IngestionReport]:
+    """Parse a range in a worker process, along with a report of its own.
+
+    :param parse: The function parsing the range.
+    :param report: An empty report, copied for the range.
+    :param byte_range: The range to parse.
+    :returns: The barcodes read and the report of the rows rejected.
+
+    """
+    report = report.empty_copy()
+    return parse(byte_range, report), report
+
+
+def read_barcode_files(
+    paths: Sequence[str],
+    jobs: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    mapped: bool = False,
+    report: IngestionReport = None,
+) -> Iterator[BarcodeBatch]:
+    r"""Yield columnar batches of barcodes from several CSV files.
+
+    Each file holds its own header. The batches follow the order of `paths`
+    and of the lines within each file.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     for name, content in [("a", "abc,1\nz,"), ("b", "abc,2\nd,3")]:
+    ...         with open(os.path.join(directory, name + ".csv"), "w") as shard:
+    ...             _ = shard.write("barcode,order_id\n" + content)
+    ...     paths = expand_paths([os.path.join(directory, "*.csv")])
+    ...     [batch.barcodes for batch in read_barcode_files(paths)]
+    [['abc', 'z'], ['abc', 'd']]
+
+    :param paths: The paths of the CSV files.
+    :param jobs: The amount of worker processes, or `1` to parse the files in
+        the current process. Each worker parses at most two ranges ahead of
+        the batch yielded.
+    :param chunk_size: The approximate amount of bytes parsed at once.
+    :param mapped: Whether to map the files in memory instead of reading them.
+    :param report: The report to account for the rejected rows in, if any. The
+        reports of the worker processes are merged into it in order.
+    :yields: The non-empty :py:class:`~mini_vouchers.csv_utils.BarcodeBatch` in
+        order.
+
+    """
+    assert jobs >= 1
+
+    ranges = [
+        byte_range for path in paths for byte_range in split_file(path, chunk_size)
+    ]
+
+    parse = parse_mapped_range if mapped else parse_range
+
+    if jobs == 1:
+        batches = (parse(byte_range, report) for byte_range in ranges)
+        yield from (batch for batch in batches if batch.barcodes)
+        return
+
+    if report is not None:
+        parse = partial(_parse_reported, parse, report.empty_copy())
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Only a window of ranges is submitted at once, so that the batches
+        # parsed ahead of the consumer stay bounded. The results are handed
+        # back in the order of submission.
+        remaining = iter(ranges)
+        in_flight: Deque[Future] = deque(
+            executor.submit(parse, byte_range)
+            for byte_range in itertools.islice(remaining, 2 * jobs)
+        )
+        try:
+            while in_flight:
+                result = in_flight.popleft().result()
+                for byte_range in itertools.islice(remaining, 1):
+                    in_flight.append(executor.submit(parse, byte_range))
+
+                if report is None:
+                    batch = result
+                else:
+                    batch, range_report = result
+                    report.merge(range_report)
+                if batch.barcodes:
+                    yield batch
+        finally:
+            for future in in_flight:
+                future.cancel()
@@ -0,0 +1,227 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Per-stage timing of a run.
+
+The stages of a run are measured as they are entered and left, a few calls
+each: the hooks only read the clocks, so that they are cheap enough to be left
+on. Iterators, such as the readers of the CSV files, are measured a batch at
+a time while they are consumed by another stage.
+
+The time of a stage excludes the time of the stages nested in it, while its
+peak memory includes them.
+"""
+
+from contextlib import contextmanager
+import resource
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+
+class Stage:
+    """The measures of a stage of a run."""
+
+    name: str
+    """The name of the stage, e.g. `populate`."""
+    calls: int
+    """The amount of times the stage was entered."""
+    wall: float
+    """The wall-clock time spent in the stage, in seconds."""
+    cpu: float
+    """The CPU time of the process spent in the stage, in seconds."""
+    rows: int
+    """The amount of rows processed by the stage."""
+    peak_traced: Optional[int]
+    """The peak memory traced by :py:mod:`tracemalloc` during the stage, in
+    bytes, if it is tracing."""
+
+    def __init__(self, name: str):
+        """Initialise an empty stage.
+
+        :param name: The name of the stage.
+
+        """
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rows = 0
+        self.peak_traced = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get the measures as a JSON object.
+
+        :returns: A fresh JSON object.
+
+        """
+        measures = {
+            "name": self.name,
+            "calls": self.calls,
+            "wall_seconds": round(self.wall, 6),
+            "cpu_seconds": round(self.cpu, 6),
+            "rows": self.rows,
+            "rows_per_second": (
+                round(self.rows / self.wall) if self.rows and self.wall else None
+            ),
+        }
+        if self.peak_traced is not None:
+            measures["peak_traced_kib"] = self.peak_traced >> 10
+        return measures
+
+
+class _Frame:
+    """A stage being measured."""
+
+    def __init__(self, stage: Stage):
+        self.stage = stage
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.peak_traced = 0
+
+
+class Profiler:
+    """The timing of the stages of a run.
+
+    >>> profiler = Profiler()
+    >>> with profiler.measure("populate"):
+    ...     batches = list(profiler.iterate("read", [[1, 2], [3]], len))
+    >>> [(stage.name, stage.calls, stage.rows) for stage in profiler.stages()]
+    [('populate', 1, 0), ('read', 3, 3)]
+
+    """
+
+    _stages: Dict[str, Stage]
+    """The stages measured, by name, in the order they were first entered."""
+    _frames: List[_Frame]
+    """The stages being measured, innermost last."""
+    _start_wall: float
+    """The wall-clock time the profiler was created at."""
+    _start_cpu: float
+    """The CPU time of the process when the profiler was created."""
+
+    def __init__(self):
+        """Initialise the profiler."""
+        self._stages = {}
+        self._frames = []
+        self._start_wall, self._start_cpu = time.perf_counter(), time.process_time()
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[Stage]:
+        """Measure a stage, accumulating with its previous measures.
+
+        :param name: The name of the stage.
+        :yields: The stage, e.g. to account for the rows processed.
+
+        """
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = Stage(name)
+
+        frame = _Frame(stage)
+        self._frames.append(frame)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.process_time() - start_cpu
+            self._frames.pop()
+
+            stage.calls += 1
+            stage.wall += wall - frame.child_wall
+            stage.cpu += cpu - frame.child_cpu
+
+            if tracemalloc.is_tracing():
+                peak = max(frame.peak_traced, tracemalloc.get_traced_memory()[1])
+                stage.peak_traced = max(stage.peak_traced or 0, peak)
+                if hasattr(tracemalloc, "reset_peak"):
+                    tracemalloc.reset_peak()
+            else:
+                peak = 0
+
+            if self._frames:
+                parent = self._frames[-1]
+                parent.child_wall += wall
+                parent.child_cpu += cpu
+                parent.peak_traced = max(parent.peak_traced, peak)
+
+    def iterate(
+        self, name: str, iterable: Iterable[Any], rows: Callable[[Any], int] = None
+    ) -> Iterator[Any]:
+        """Measure the production of the items of an iterable, as a stage.
+
+        :param name: The name of the stage.
+        :param iterable: The iterable to consume.
+        :param rows: The function counting the rows of an item, if any.
+        :yields: The items of `iterable`.
+
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.measure(name) as stage:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                if rows is not None:
+                    stage.rows += rows(item)
+            yield item
+
+    def stages(self) -> List[Stage]:
+        """Get the stages measured.
+
+        :returns: A fresh list of the stages, in the order they were first
+            entered.
+
+        """
+        return list(self._stages.values())
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Get the measures of the run as a JSON object.
+
+        :returns: A fresh JSON object, holding the measures of each stage as
+            well as the totals since the profiler was created, and the peak
+            resident memory of the process.
+
+        """
+        return {
+            "wall_seconds": round(time.perf_counter() - self._start_wall, 6),
+            "cpu_seconds": round(time.process_time() - self._start_cpu, 6),
+            # The resident set size is in KiB on Linux.
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "stages": [stage.as_dict() for stage in self._stages.values()],
+        }
+
+
+class NullProfiler:
+    """A profiler measuring nothing, at no cost."""
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[Stage]:
+        """See :py:meth:`Profiler.measure`."""
+        yield Stage(name)
+
+    def iterate(
+        self, name: str, iterable: Iterable[Any], rows: Callable[[Any], int] = None
+    ) -> Iterable[Any]:
+        """See :py:meth:`Profiler.iterate`."""
+        return iterable
+
+
+NULL_PROFILER = NullProfiler()
+"""The profiler to use when not profiling."""
@@ -0,0 +1,226 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""The report of the rows rejected while ingesting a dataset.
+
+Rejected rows are counted by reason rather than logged one by one: a few of
+them are sampled, and all of them may be kept to be written in bulk to a CSV
+file once the ingestion is over. Logging each row as it is rejected is opt-in.
+"""
+
+import csv
+import logging
+from typing import Dict, List, NamedTuple, Optional, TextIO
+
+
+MISSING_BARCODE = "missing barcode"
+"""A barcodes row without barcode."""
+MISSING_IDENTIFIERS = "missing identifiers"
+"""An orders row without order or customer identifier."""
+OUT_OF_RANGE_IDENTIFIER = "identifier out of range"
+"""A row with an order or customer identifier beyond a signed 64-bit integer."""
+DUPLICATE_BARCODE = "duplicate barcode"
+"""A barcode exported several times."""
+CONFLICTING_BARCODE = "conflicting barcode"
+"""A known barcode exported again with another attribution."""
+UNKNOWN_ORDER = "unknown order"
+"""A barcode attributed to an order that does not exist."""
+DUPLICATE_ORDER = "duplicate order"
+"""An order exported several times."""
+EMPTY_ORDER = "order without barcodes"
+"""An order no barcode was attributed to."""
+
+DEFAULT_SAMPLE_SIZE = 5
+"""The amount of rows sampled for each reason."""
+REJECTS_FIELDS = ("reason", "barcode", "order_id", "customer_id")
+"""The columns of a rejects CSV file."""
+
+
+class RejectedRow(NamedTuple):
+    """A row rejected while ingesting a dataset.
+
+    Barcode rows define a barcode and an optional order identifier, while order
+    rows define an order and a customer identifier.
+    """
+
+    reason: str
+    """Why the row was rejected, e.g. :py:const:`DUPLICATE_BARCODE`."""
+    barcode: Optional[str] = None
+    """The barcode value."""
+    order_id: Optional[int] = None
+    """The order identifier."""
+    customer_id: Optional[int] = None
+    """The customer identifier."""
+
+
+class IngestionReport:
+    """The rows rejected while ingesting a dataset, by reason.
+
+    >>> report = IngestionReport(sample_size=1)
+    >>> report.reject_barcode(DUPLICATE_BARCODE, 'a', 10)
+    >>> report.reject_barcode(DUPLICATE_BARCODE, 'b')
+    >>> report.reject_order(MISSING_IDENTIFIERS, 12)
+    >>> report.counts
+    {'duplicate barcode': 2, 'missing identifiers': 1}
+    >>> for line in report.summary():
+    ...     print(line)
+    Rejected 2 rows (duplicate barcode), e.g. barcode=a order_id=10
+    Rejected 1 rows (missing identifiers), e.g. order_id=12
+
+    A report is picklable and reports can be merged, e.g. once filled by
+    worker processes.
+    """
+
+    counts: Dict[str, int]
+    """The amount of rows rejected for each reason."""
+    samples: Dict[str, List[RejectedRow]]
+    """The first rows rejected for each reason."""
+    rejects: Optional[List[RejectedRow]]
+    """All the rows rejected, if they are kept."""
+    sample_size: int
+    """The amount of rows sampled for each reason."""
+    log_rows: bool
+    """Whether each row is logged as it is rejected."""
+
+    def __init__(
+        self,
+        sample_size: int = DEFAULT_SAMPLE_SIZE,
+        keep_rejects: bool = False,
+        log_rows: bool = False,
+    ):
+        """Initialise an empty report.
+
+        :param sample_size: The amount of rows sampled for each reason.
+        :param keep_rejects: Whether to keep all the rejected rows, e.g. to
+            write them with :py:meth:`write_rejects`.
+        :param log_rows: Whether to log each row as it is rejected.
+
+        """
+        assert sample_size >= 0
+
+        self.counts = {}
+        self.samples = {}
+        self.rejects = [] if keep_rejects else None
+        self.sample_size = sample_size
+        self.log_rows = log_rows
+
+    def empty_copy(self) -> "IngestionReport":
+        """Get an empty report with the same settings."""
+        return IngestionReport(
+            self.sample_size, self.rejects is not None, self.log_rows
+        )
+
+    def reject(self, row: RejectedRow):
+        """Account for a rejected row.
+
+        :param row: The row rejected.
+
+        """
+        count = self.counts.get(row.reason, 0)
+        self.counts[row.reason] = count + 1
+
+        if count < self.sample_size:
+            self.samples.setdefault(row.reason, []).append(row)
+        if self.rejects is not None:
+            self.rejects.append(row)
+        if self.log_rows:
+            logging.warning("Rejecting row (%s): %s", row.reason, _describe(row))
+
+    def reject_barcode(self, reason: str, barcode: str, order_id: int = None):
+        """Account for a rejected barcodes row.
+
+        :param reason: Why the row was rejected.
+        :param barcode: The barcode value.
+        :param order_id: The optional order identifier.
+
+        """
+        self.reject(RejectedRow(reason, barcode, order_id or None))
+
+    def reject_order(self, reason: str, order_id: int = None, customer_id: int = None):
+        """Account for a rejected orders row.
+
+        :param reason: Why the row was rejected.
+        :param order_id: The order identifier.
+        :param customer_id: The customer identifier.
+
+        """
+        self.reject(RejectedRow(reason, None, order_id, customer_id))
+
+    def merge(self, other: "IngestionReport"):
+        """Account for the rows rejected in another report.
+
+        The rows of `other` are considered rejected after the rows of this
+        report.
+
+        :param other: The report to merge into this one.
+
+        """
+        for reason, count in other.counts.items():
+            self.counts[reason] = self.counts.get(reason, 0) + count
+        for reason, rows in other.samples.items():
+            samples = self.samples.setdefault(reason, [])
+            room = max(0, self.sample_size - len(samples))
+            samples.extend(rows[:room])
+        if self.rejects is not None and other.rejects is not None:
+            self.rejects.extend(other.rejects)
+
+    def total(self) -> int:
+        """Count the rejected rows.
+
+        :returns: The amount of rows rejected for any reason.
+
+        """
+        return sum(self.counts.values())
+
+    def summary(self) -> List[str]:
+        """Describe the rejected rows, one line per reason.
+
+        :returns: A fresh list of lines, ordered by reason.
+
+        """
+        lines = []
+        for reason in sorted(self.counts):
+            samples = "; ".join(map(_describe, self.samples.get(reason, [])))
+            line = f"Rejected {self.counts[reason]} rows ({reason})"
+            lines.append(f"{line}, e.g. {samples}" if samples else line)
+        return lines
+
+    def log(self):
+        """Log the summary of the rejected rows, if any."""
+        for line in self.summary():
+            logging.warning(line)
+
+    def write_rejects(self, output: TextIO):
+        """Write the rejected rows to a CSV file, at once.
+
+        :param output: The text stream to write to.
+
+        """
+        assert self.rejects is not None
+
+        writer = csv.writer(output)
+        writer.writerow(REJECTS_FIELDS)
+        writer.writerows(self.rejects)
+
+
+def _describe(row: RejectedRow) -> str:
+    """Describe the defined fields of a rejected row."""
+    return " ".join(
+        f"{field}={value}"
+        for field, value in zip(RejectedRow._fields[1:], row[1:])
+        if value is not None
+    )
@@ -0,0 +1,441 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""A server answering queries about a voucher system loaded once.
+
+The protocol is line-based: each request is a line of text holding a command
+and its arguments, separated by spaces, and each response is a line holding a
+JSON object. The commands are:
+
+- ``summary``: the statistics of the dataset;
+- ``top N``: the `N` top customers;
+- ``order ID``: the order identified by `ID`;
+- ``owner BARCODE``: the order `BARCODE` is attributed to;
+- ``customer ID``: the orders of the customer identified by `ID`;
+- ``available``: the amount of available barcodes;
+- ``place CUSTOMER QUANTITY``: place an order of `QUANTITY` barcodes for the
+  customer identified by `CUSTOMER`.
+
+The requests of all the clients are queued and answered in batches by a single
+task, so that the system is never accessed concurrently and the orders placed
+at once are attributed their barcodes in a single call.
+
+A request that is not valid UTF-8 is answered with an error. So is a request
+longer than the limit of the stream, after which the connection is closed, as
+the rest of the line cannot be told apart from the next request.
+"""
+
+import asyncio
+import json
+import logging
+import signal
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from mini_vouchers.csv_utils import IDENTIFIERS
+from mini_vouchers.voucher_system import Order
+
+
+DEFAULT_HOST = "127.0.0.1"
+"""The default address to listen on."""
+DEFAULT_PORT = 8642
+"""The default port to listen on."""
+DEFAULT_MAX_BATCH = 1024
+"""The default amount of requests answered at once."""
+
+_get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+"""Get the running event loop, from a coroutine, before Python 3.7 as well."""
+
+Response = Dict[str, Any]
+
+
+class Request(NamedTuple):
+    """A parsed request."""
+
+    command: str
+    """The command, e.g. `top`."""
+    arguments: Tuple[Any, ...]
+    """The arguments of the command, e.g. integers."""
+
+
+def _integer(argument: str) -> int:
+    """Parse an integer argument, as stored by the systems.
+
+    :raises ValueError: If the argument is not an integer of
+        :py:const:`~mini_vouchers.csv_utils.IDENTIFIERS`.
+
+    """
+    value = int(argument)
+    if value not in IDENTIFIERS:
+        raise ValueError(f"Out of range integer {argument}")
+    return value
+
+
+_ARGUMENTS: Dict[str, Tuple[Callable[[str], Any], ...]] = {
+    "summary": (),
+    "top": (_integer,),
+    "order": (_integer,),
+    "owner": (str,),
+    "customer": (_integer,),
+    "available": (),
+    "place": (_integer, _integer),
+}
+"""The type of each argument of each command."""
+
+
+def parse_request(line: str) -> Request:
+    r"""Parse a request line.
+
+    >>> parse_request("place 7 3\n")
+    Request(command='place', arguments=(7, 3))
+    >>> parse_request("order 99999999999999999999")
+    Traceback (most recent call last):
+        ...
+    ValueError: Out of range integer 99999999999999999999
+
+    :param line: The request line.
+    :returns: The request.
+    :raises ValueError: If the command is unknown or its arguments are invalid.
+
+    """
+    fields = line.split()
+    if not fields:
+        raise ValueError("Empty request")
+
+    command, *arguments = fields
+    if command not in _ARGUMENTS:
+        raise ValueError(f"Unknown command {command!r}")
+    types = _ARGUMENTS[command]
+    if len(arguments) != len(types):
+        raise ValueError(f"Expected {len(types)} arguments to {command!r}")
+
+    return Request(
+        command, tuple(type_(argument) for type_, argument in zip(types, arguments))
+    )
+
+
+def render_order(order: Order) -> Response:
+    """Render an order as a JSON object.
+
+    :param order: The order to render.
+    :returns: A fresh JSON object, with the barcodes sorted by value.
+
+    """
+    return {
+        "order_id": order.order_id,
+        "customer_id": order.customer_id,
+        "barcodes": sorted(order.barcodes),
+    }
+
+
+class VoucherServer:
+    """A server answering queries about a populated voucher system.
+
+    >>> from mini_vouchers.csv_utils import ExportedBarcode, ExportedOrder
+    >>> from mini_vouchers.voucher_system import VoucherSystem
+    >>> system = VoucherSystem()
+    >>> system.populate([ExportedBarcode('a', 10), ExportedBarcode('b'),
+    ...                  ExportedBarcode('c')], [ExportedOrder(10, 7)])
+    >>> server = VoucherServer(system)
+    >>> for response in server.answer(["place 8 1", "available", "top 1", "z"]):
+    ...     print(json.dumps(response))
+    {"order_id": 11, "customer_id": 8, "barcodes": ["c"]}
+    {"available": 1}
+    {"customers": [[7, 1]]}
+    {"error": "Unknown command 'z'"}
+    >>> for response in server.answer(["owner a", "owner b", "customer 8"]):
+    ...     print(json.dumps(response))
+    {"order_id": 10, "customer_id": 7, "barcodes": ["a"]}
+    {"error": "No order owns barcode 'b'"}
+    {"customer_id": 8, "orders": [{"order_id": 11, "customer_id": 8, \
+"barcodes": ["c"]}]}
+
+    """
+
+    system: Any
+    """The populated system, e.g. a
+    :py:class:`~mini_vouchers.voucher_system.VoucherSystem`."""
+    max_batch: int
+    """The amount of requests answered at once."""
+    read_only: bool
+    """Whether placing orders is refused."""
+    _queue: Optional[asyncio.Queue]
+    """The requests waiting for an answer, along with their future."""
+    _worker: Optional[asyncio.Future]
+    """The task answering the queued requests."""
+
+    def __init__(
+        self, system, max_batch: int = DEFAULT_MAX_BATCH, read_only: bool = False
+    ):
+        """Initialise the server.
+
+        :param system: The populated system to query.
+        :param max_batch: The amount of requests answered at once.
+        :param read_only: Whether to refuse placing orders, even if the system
+            supports it.
+
+        """
+        assert max_batch > 0
+
+        self.system = system
+        self.max_batch = max_batch
+        self.read_only = read_only
+        self._queue = None
+        self._worker = None
+
+    def answer(self, lines: List[str]) -> List[Response]:
+        """Answer a batch of requests.
+
+        The orders of the batch are placed first, at once, then the other
+        requests are answered in order.
+
+        :param lines: The request lines.
+        :returns: A fresh list of the responses, in the order of `lines`.
+
+        """
+        responses: List[Optional[Response]] = [None] * len(lines)
+        requests: List[Optional[Request]] = [None] * len(lines)
+        for index, line in enumerate(lines):
+            try:
+                requests[index] = parse_request(line)
+            except ValueError as error:
+                responses[index] = {"error": str(error)}
+
+        placements = [
+            index
+            for index, request in enumerate(requests)
+            if request is not None and request.command == "place"
+        ]
+        if placements:
+            for index, response in zip(placements, self._place(requests, placements)):
+                responses[index] = response
+
+        for index, request in enumerate(requests):
+            if request is not None and responses[index] is None:
+                responses[index] = self._query(request)
+
+        return responses
+
+    def _place(self, requests: List[Request], indices: List[int]) -> List[Response]:
+        """Place the orders of several requests at once, if possible.
+
+        :param requests: The parsed requests.
+        :param indices: The indices of the `place` requests.
+        :returns: A fresh list of the responses to the `place` requests.
+
+        """
+        if self.read_only or not hasattr(self.system, "place_orders"):
+            return [{"error": "The system is read-only"}] * len(indices)
+
+        orders = [requests[index].arguments for index in indices]
+        if any(quantity <= 0 for _, quantity in orders):
+            return [self._place_one(*order) for order in orders]
+
+        try:
+            return list(map(render_order, self.system.place_orders(orders)))
+        except ValueError:
+            # Place as many orders as possible, one at a time.
+            return [self._place_one(*order) for order in orders]
+
+    def _place_one(self, customer_id: int, quantity: int) -> Response:
+        """Place a single order.
+
+        :param customer_id: The identifier of the customer placing the order.
+        :param quantity: The amount of barcodes to attribute.
+        :returns: The response.
+
+        """
+        if quantity <= 0:
+            return {"error": "The quantity must be positive"}
+
+        try:
+            return render_order(self.system.place_order(customer_id, quantity))
+        except ValueError as error:
+            return {"error": str(error)}
+
+    def _query(self, request: Request) -> Response:
+        """Answer a request that does not modify the system.
+
+        :param request: The request.
+        :returns: The response.
+
+        """
+        if request.command == "summary":
+            return dict(self.system.stats()._asdict())
+        if request.command == "top":
+            (limit,) = request.arguments
+            if limit < 0:
+                return {"error": "The limit must be positive"}
+            return {"customers": self.system.get_top_customers(limit)}
+        if request.command == "order":
+            (order_id,) = request.arguments
+            order = self.system.get_order(order_id)
+            if order is None:
+                return {"error": f"Unknown order {order_id}"}
+            return render_order(order)
+        if request.command == "owner":
+            (barcode,) = request.arguments
+            order = self.system.owner_of(barcode)
+            if order is None:
+                return {"error": f"No order owns barcode {barcode!r}"}
+            return render_order(order)
+        if request.command == "customer":
+            (customer_id,) = request.arguments
+            orders = self.system.orders_for_customer(customer_id)
+            return {
+                "customer_id": customer_id,
+                "orders": list(map(render_order, orders)),
+            }
+        if request.command == "available":
+            return {"available": self.system.count_available_barcodes()}
+
+        raise ValueError(f"Unknown command {request.command}")
+
+    async def query(self, line: str) -> Response:
+        """Queue a request and wait for its answer.
+
+        :param line: The request line.
+        :returns: The response.
+
+        """
+        future = _get_running_loop().create_future()
+        await self._queue.put((line, future))
+        return await future
+
+    async def _answer_batches(self):
+        """Answer the queued requests, as many at once as possible."""
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            responses = self.answer_safely([line for line, _ in batch])
+            for (_, future), response in zip(batch, responses):
+                if not future.cancelled():
+                    future.set_result(response)
+
+    def answer_safely(self, lines: List[str]) -> List[Response]:
+        """Answer a batch of requests, without raising unexpected errors.
+
+        See :py:meth:`answer`. Should the batch fail, the requests are answered
+        one at a time, for only the failing ones to be answered with an error.
+
+        :param lines: The request lines.
+        :returns: A fresh list of the responses, in the order of `lines`.
+
+        """
+        try:
+            return self.answer(lines)
+        except Exception:
+            logging.exception("Failed to answer %d requests", len(lines))
+        return list(map(self._answer_one, lines))
+
+    def _answer_one(self, line: str) -> Response:
+        """Answer a single request, with an error if it fails unexpectedly."""
+        try:
+            return self.answer([line])[0]
+        except Exception:
+            logging.exception("Failed to answer %r", line)
+            return {"error": "Internal error"}
+
+    async def _serve_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """Answer the requests of a client until it disconnects."""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    await self._reply(writer, {"error": "The request is too long"})
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                try:
+                    response = await self.query(line.decode("utf-8"))
+                except UnicodeDecodeError:
+                    response = {"error": "The request is not valid UTF-8"}
+                await self._reply(writer, response)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _reply(writer: asyncio.StreamWriter, response: Response):
+        """Write a response to a client."""
+        writer.write(json.dumps(response).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def start(
+        self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, path=None
+    ):
+        """Start answering the requests of the clients.
+
+        :param host: The address to listen on.
+        :param port: The port to listen on.
+        :param path: The path of a Unix socket to listen on instead of a port.
+        :returns: The underlying :py:class:`asyncio.AbstractServer`.
+
+        """
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.ensure_future(self._answer_batches())
+
+        if path is not None:
+            server = await asyncio.start_unix_server(self._serve_client, path)
+            logging.info("Serving on %s", path)
+        else:
+            server = await asyncio.start_server(self._serve_client, host, port)
+            logging.info("Serving on %s:%s", host, port)
+        return server
+
+    async def stop(self):
+        """Stop answering the queued requests."""
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+
+def serve(system, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, path=None):
+    """Serve a populated system until interrupted or terminated.
+
+    See :py:class:`VoucherServer`.
+
+    :param system: The populated system to query.
+    :param host: The address to listen on.
+    :param port: The port to listen on.
+    :param path: The path of a Unix socket to listen on instead of a port.
+
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    voucher_server = VoucherServer(system)
+    server = loop.run_until_complete(voucher_server.start(host, port, path))
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.run_until_complete(voucher_server.stop())
+        loop.close()
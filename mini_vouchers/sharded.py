@@ -0,0 +1,549 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""A Voucher System sharded across worker processes.
+
+The :py:class:`ShardedVoucherSystem` answers the same queries as
+:py:class:`~mini_vouchers.voucher_system.VoucherSystem` but spreads its data
+over several worker processes, each holding a
+:py:class:`~mini_vouchers.voucher_system.VoucherSystem` of its own:
+
+- The orders are partitioned by the hash of their customer identifier, so that
+  each customer is wholly known to a single shard.
+- The barcodes attributed to an order are routed to the shard owning the
+  order, while the available barcodes are partitioned by their hash.
+
+The queries are answered by merging the partial results of the shards: the
+figures are summed, the top customers of each shard are ranked together, and
+the sorted sequences are merged in a single pass.
+
+The duplicate barcodes are detected before being routed, by the shard owning
+the hash of each barcode, so that the first occurrence of a barcode wins
+whichever shard it ends up in.
+"""
+
+from array import array
+import heapq
+import itertools
+import multiprocessing
+from multiprocessing.connection import Connection
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+import weakref
+
+from mini_vouchers.csv_utils import (
+    NO_ORDER_ID,
+    BarcodeBatch,
+    ExportedBarcode,
+    ExportedOrder,
+    OrderBatch,
+)
+from mini_vouchers.report import (
+    DUPLICATE_BARCODE,
+    DUPLICATE_ORDER,
+    UNKNOWN_ORDER,
+    IngestionReport,
+)
+from mini_vouchers.voucher_system import Order, Statistics, VoucherSystem
+
+
+DEFAULT_SHARDS = 2
+"""The default amount of shards."""
+CHUNK_SIZE = 1 << 12
+"""The amount of items a shard streams back at once."""
+STOP_TIMEOUT = 1.0
+"""The amount of seconds a shard is given to stop before being terminated."""
+
+
+class ShardedVoucherSystem:
+    """The Voucher System logic, sharded by customer across worker processes.
+
+    The system can only be populated once. The worker processes are stopped
+    when the system is closed or garbage collected.
+
+    >>> exported_barcodes = [ExportedBarcode('b', 10), ExportedBarcode('b', 12)]
+    >>> exported_barcodes += [ExportedBarcode('z'), ExportedBarcode('c', 11)]
+    >>> exported_barcodes += [ExportedBarcode('a', 12), ExportedBarcode('d', 12)]
+    >>> exported_orders = [ExportedOrder(10, 7), ExportedOrder(12, 8)]
+    >>> with ShardedVoucherSystem(2) as system:
+    ...     system.populate(exported_barcodes, exported_orders)
+    ...     system.get_available_barcodes()
+    ...     [(order.order_id, sorted(order.barcodes)) for order in system.get_orders()]
+    ...     system.get_top_customers(2)
+    ...     system.stats()
+    ['z']
+    [(10, ['b']), (12, ['a', 'd'])]
+    [(8, 2), (7, 1)]
+    Statistics(orders=2, customers=2, attributed_barcodes=3, \
+available_barcodes=1, discarded_barcodes=2)
+
+    """
+
+    _connections: List[Connection]
+    """The connections to the shards."""
+    _streaming: List[bool]
+    """Whether each shard is streaming items back."""
+    _owners: Dict[int, int]
+    """The shard owning each order, by order identifier."""
+    _discarded_count: int
+    """The amount of barcodes discarded before being routed."""
+
+    def __init__(self, shards: int = DEFAULT_SHARDS):
+        """Initialise the system and start its worker processes.
+
+        :param shards: The amount of shards, one worker process each.
+
+        """
+        assert shards >= 1
+
+        self._connections = []
+        self._streaming = [False] * shards
+        self._owners = {}
+        self._discarded_count = 0
+        self._populated = False
+
+        processes = []
+        for _ in range(shards):
+            connection, shard_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_run_shard, args=(shard_connection,), daemon=True
+            )
+            process.start()
+            shard_connection.close()
+            self._connections.append(connection)
+            processes.append(process)
+
+        self._finalizer = weakref.finalize(
+            self, _stop_shards, self._connections, processes
+        )
+
+    def __enter__(self) -> "ShardedVoucherSystem":
+        """Use the system as a context manager closing it on exit."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the system."""
+        self.close()
+
+    def close(self):
+        """Stop the worker processes."""
+        self._finalizer()
+
+    def _send(self, shard: int, command: str, argument: Any = None):
+        """Send a command to a shard.
+
+        The items the shard was still streaming back, if any, are dropped.
+        """
+        connection = self._connections[shard]
+        while self._streaming[shard]:
+            self._streaming[shard] = bool(connection.recv())
+        connection.send((command, argument))
+
+    def _ask(self, command: str, argument: Any = None) -> List[Any]:
+        """Send a command to every shard and get their answers."""
+        for shard in range(len(self._connections)):
+            self._send(shard, command, argument)
+        return [connection.recv() for connection in self._connections]
+
+    def _stream(self, command: str, argument: Any = None) -> List[Iterator[Any]]:
+        """Send a command to every shard and stream the items they answer.
+
+        The shards all start working on the command at once. The system must
+        not be queried again before the streams are consumed.
+
+        :returns: A fresh list of iterators of the items of each shard.
+
+        """
+        for shard in range(len(self._connections)):
+            self._send(shard, command, argument)
+            self._streaming[shard] = True
+        return [self._receive_chunks(shard) for shard in range(len(self._streaming))]
+
+    def _receive_chunks(self, shard: int) -> Iterator[Any]:
+        """Yield the items streamed back by a shard, a chunk at a time."""
+        connection = self._connections[shard]
+        while self._streaming[shard]:
+            chunk = connection.recv()
+            self._streaming[shard] = bool(chunk)
+            yield from chunk
+
+    def stats(self) -> Statistics:
+        """Get the figures describing the dataset, summed over the shards.
+
+        :returns: The current figures.
+
+        """
+        figures = [sum(values) for values in zip(*self._ask("stats"))]
+        figures[-1] += self._discarded_count
+        return Statistics(*figures)
+
+    def count_available_barcodes(self) -> int:
+        """Count the available barcodes.
+
+        :returns: The amount of available barcodes.
+
+        """
+        return self.stats().available_barcodes
+
+    def iter_available_barcodes(self) -> Iterator[str]:
+        """Iterate over the available barcodes, merging the shards.
+
+        :returns: An iterator of the available barcodes, sorted by value.
+
+        """
+        return heapq.merge(*self._stream("available"))
+
+    def get_available_barcodes(self) -> Sequence[str]:
+        """Get the available barcodes.
+
+        :returns: A fresh sequence of the available barcodes, sorted by value.
+
+        """
+        return list(self.iter_available_barcodes())
+
+    def iter_orders(self) -> Iterator[Order]:
+        """Iterate over the orders known to the system, shard after shard.
+
+        :returns: An iterator of the orders, in no particular order.
+
+        """
+        return itertools.chain.from_iterable(self._stream("orders"))
+
+    def get_orders(self, key: Callable[[Order], Any] = None) -> Sequence[Order]:
+        """Get the orders known to the system.
+
+        Each shard sorts its own orders, which are then merged.
+
+        :param key: The sorting function to apply. Defaults to sorted by value.
+            It must be picklable, e.g.
+            :py:func:`~mini_vouchers.voucher_system.customer_order_key`.
+        :returns: A fresh sequence of the orders.
+
+        """
+        return list(heapq.merge(*self._stream("sorted orders", key), key=key))
+
+    def get_order(self, order_id: int) -> Optional[Order]:
+        """Get an order by identifier, from the shard owning it.
+
+        :param order_id: The identifier of the order.
+        :returns: The order, or `None` if unknown to the system.
+
+        """
+        shard = self._owners.get(order_id)
+        if shard is None:
+            return None
+
+        self._send(shard, "order", order_id)
+        return self._connections[shard].recv()
+
+    def owner_of(self, barcode: str) -> Optional[Order]:
+        """Get the order a barcode is attributed to, asking every shard.
+
+        :param barcode: The barcode value.
+        :returns: The order, or `None` if the barcode is available, discarded
+            or unknown to the system.
+
+        """
+        # An attributed barcode lives on the shard of its order, whichever.
+        owners = [order for order in self._ask("owner", barcode) if order is not None]
+        return owners[0] if owners else None
+
+    def orders_for_customer(self, customer_id: int) -> Sequence[Order]:
+        """Get the orders with barcodes of a customer, from the shard owning it.
+
+        :param customer_id: The identifier of the customer.
+        :returns: A fresh sequence of the orders, sorted by identifier.
+
+        """
+        shard = hash(customer_id) % len(self._connections)
+        self._send(shard, "customer", customer_id)
+        return self._connections[shard].recv()
+
+    def get_pending_orders(self) -> Sequence[Order]:
+        """Get the orders still waiting for barcodes.
+
+        :returns: A fresh sequence of the pending orders, sorted by value.
+
+        """
+        return list(heapq.merge(*self._stream("pending orders")))
+
+    def get_top_customers(self, limit: int) -> Sequence[Tuple[int, int]]:
+        """Get the top customers, ranking the top customers of each shard.
+
+        See :py:meth:`mini_vouchers.voucher_system.VoucherSystem.get_top_customers`.
+
+        :param limit: The amount of top customers to return.
+        :returns: A fresh sequence of tuples of customer identifier and their
+            amount of barcodes, ranked from high (most barcodes) to low.
+
+        """
+        assert limit >= 0
+
+        # Each customer is known to a single shard: its total is complete.
+        ranked = heapq.nlargest(
+            limit,
+            itertools.chain.from_iterable(self._ask("top", limit)),
+            key=lambda item: (item[1], -item[2]),
+        )
+        return [(customer_id, total) for customer_id, total, _ in ranked]
+
+    def populate(
+        self,
+        exported_barcodes: Iterable[ExportedBarcode],
+        exported_orders: Iterable[ExportedOrder],
+        report: IngestionReport = None,
+    ):
+        """Populate the system with data previously exported.
+
+        See :py:meth:`populate_batches`.
+
+        :param exported_barcodes: The barcodes previously exported.
+        :param exported_orders: The orders previously exported.
+        :param report: The report to account for the rejected rows in, if any.
+
+        """
+        exported_barcodes = list(exported_barcodes)
+        exported_orders = list(exported_orders)
+        self.populate_batches(
+            [
+                BarcodeBatch(
+                    [barcode for barcode, _ in exported_barcodes],
+                    array(
+                        "q",
+                        (order_id or NO_ORDER_ID for _, order_id in exported_barcodes),
+                    ),
+                )
+            ],
+            [
+                OrderBatch(
+                    array("q", (order_id for order_id, _ in exported_orders)),
+                    array("q", (customer_id for _, customer_id in exported_orders)),
+                )
+            ],
+            report,
+        )
+
+    def populate_batches(
+        self,
+        barcode_batches: Iterable[BarcodeBatch],
+        order_batches: Iterable[OrderBatch],
+        report: IngestionReport = None,
+    ):
+        """Populate the system with columnar batches of data previously exported.
+
+        The data is cleaned and validated following the rules of
+        :py:meth:`mini_vouchers.voucher_system.VoucherSystem.populate_batches`.
+        The batches are split and routed to the shards, which populate their
+        own system as the batches come.
+
+        :param barcode_batches: The batches of barcodes previously exported.
+        :param order_batches: The batches of orders previously exported.
+        :param report: The report to account for the rejected rows in, if any.
+            The reports of the shards are merged into it in order.
+        :raises ValueError: If the system is populated already.
+
+        """
+        if self._populated:
+            raise ValueError("The system is populated already")
+        self._populated = True
+
+        shards = len(self._connections)
+        owners = self._owners
+        shard_report = None if report is None else report.empty_copy()
+        for shard in range(shards):
+            self._send(shard, "populate", shard_report)
+
+        # Route the orders to the shard of their customer.
+        for order_ids, customer_ids in order_batches:
+            parts = [OrderBatch(array("q"), array("q")) for _ in range(shards)]
+            for order_id, customer_id in zip(order_ids, customer_ids):
+                if order_id not in owners:
+                    shard = owners[order_id] = hash(customer_id) % shards
+                    parts[shard].order_ids.append(order_id)
+                    parts[shard].customer_ids.append(customer_id)
+                elif report is not None:
+                    report.reject_order(DUPLICATE_ORDER, order_id, customer_id)
+            self._send_parts("batch", parts)
+        self._send_parts("end", [None] * shards)
+
+        # Route the barcodes to the shard of their order, once deduplicated.
+        for barcodes, order_ids in barcode_batches:
+            firsts = self._first_occurrences(barcodes)
+            parts = [BarcodeBatch([], array("q")) for _ in range(shards)]
+            for barcode, order_id, first in zip(barcodes, order_ids, firsts):
+                if not first:
+                    if report is not None:
+                        report.reject_barcode(DUPLICATE_BARCODE, barcode, order_id)
+                    self._discarded_count += 1
+                    continue
+
+                shard = owners.get(order_id) if order_id else hash(barcode) % shards
+                if shard is None:
+                    if report is not None:
+                        report.reject_barcode(UNKNOWN_ORDER, barcode, order_id)
+                    self._discarded_count += 1
+                    continue
+
+                parts[shard].barcodes.append(barcode)
+                parts[shard].order_ids.append(order_id)
+            self._send_parts("batch", parts)
+        self._send_parts("end", [None] * shards)
+
+        for shard_report in (connection.recv() for connection in self._connections):
+            if report is not None:
+                report.merge(shard_report)
+
+    def _send_parts(self, command: str, parts: List[Any]):
+        """Send a part of a batch to each shard, skipping the empty parts."""
+        for shard, part in enumerate(parts):
+            if part is None or part[0]:
+                self._send(shard, command, part)
+
+    def _first_occurrences(self, barcodes: Sequence[str]) -> bytearray:
+        """Find the barcodes of a batch seen for the first time.
+
+        Each shard checks the barcodes of its hash, all shards at once.
+
+        :param barcodes: The barcodes of the batch.
+        :returns: A fresh flag per barcode, set if seen for the first time.
+
+        """
+        shards = len(self._connections)
+        positions: List[List[int]] = [[] for _ in range(shards)]
+        for position, barcode in enumerate(barcodes):
+            positions[hash(barcode) % shards].append(position)
+
+        parts = [[barcodes[position] for position in part] for part in positions]
+        self._send_parts("deduplicate", [(part,) for part in parts])
+
+        firsts = bytearray(len(barcodes))
+        for shard, part in enumerate(positions):
+            if part:
+                flags = self._connections[shard].recv()
+                for position, flag in zip(part, flags):
+                    firsts[position] = flag
+        return firsts
+
+
+def _run_shard(connection: Connection):
+    """Answer the commands sent to a shard until told to stop.
+
+    :param connection: The connection to the sharded system.
+
+    """
+    system = VoucherSystem()
+    seen: Set[str] = set()
+
+    while True:
+        command, argument = connection.recv()
+        if command == "stop":
+            break
+        elif command == "populate":
+            system.populate_batches(
+                _receive_batches(connection, seen),
+                _receive_batches(connection, seen),
+                argument,
+            )
+            # The duplicates are only looked for while populating.
+            seen.clear()
+            connection.send(argument)
+        elif command == "stats":
+            connection.send(system.stats())
+        elif command == "available":
+            _send_chunks(connection, system.iter_available_barcodes())
+        elif command == "orders":
+            _send_chunks(connection, system.iter_orders())
+        elif command == "sorted orders":
+            _send_chunks(connection, system.get_orders(argument))
+        elif command == "pending orders":
+            _send_chunks(connection, system.get_pending_orders())
+        elif command == "order":
+            connection.send(system.get_order(argument))
+        elif command == "owner":
+            connection.send(system.owner_of(argument))
+        elif command == "customer":
+            connection.send(system.orders_for_customer(argument))
+        elif command == "top":
+            connection.send(
+                [
+                    (customer_id, total, system.get_customer_first_order(customer_id))
+                    for customer_id, total in system.get_top_customers(argument)
+                ]
+            )
+        else:
+            raise ValueError(f"Unknown command {command!r}")
+
+
+def _receive_batches(connection: Connection, seen: Set[str]) -> Iterator[Any]:
+    """Yield the batches sent to a shard while populating, until the end.
+
+    The barcodes to deduplicate are checked against the barcodes seen so far.
+    """
+    while True:
+        command, argument = connection.recv()
+        if command == "end":
+            return
+        elif command == "batch":
+            yield argument
+        elif command == "deduplicate":
+            (barcodes,) = argument
+            flags = bytearray(len(barcodes))
+            for position, barcode in enumerate(barcodes):
+                if barcode not in seen:
+                    seen.add(barcode)
+                    flags[position] = 1
+            connection.send(flags)
+        else:
+            raise ValueError(f"Unexpected command {command!r} while populating")
+
+
+def _send_chunks(connection: Connection, items: Iterable[Any]):
+    """Send items a chunk at a time, then an empty chunk."""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, CHUNK_SIZE))
+        connection.send(chunk)
+        if not chunk:
+            return
+
+
+def _stop_shards(
+    connections: List[Connection], processes: List[multiprocessing.Process]
+):
+    """Stop the worker processes of a sharded system."""
+    for connection in connections:
+        try:
+            connection.send(("stop", None))
+        except OSError:
+            pass
+    for process, connection in zip(processes, connections):
+        # A shard still streaming items back never reads the command.
+        process.join(STOP_TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+        connection.close()
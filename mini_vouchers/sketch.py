@@ -0,0 +1,325 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Approximate top customers, from a single pass over the dataset.
+
+The barcodes are counted per customer as they are read, without ever being
+held in memory. The totals are kept by a Space-Saving summary of a bounded
+amount of counters, so that they are not all held in memory either. The memory
+is not bounded as a whole, though: the customer of every order is held, to know
+the customer of each barcode.
+
+Each estimated total is an upper bound of the actual total, off by at most its
+reported error. The estimates are exact as long as there are no more customers
+than counters. Duplicate barcodes are counted each time they are read, unless
+they are dropped beforehand, e.g. by
+:py:func:`~mini_vouchers.dedup.deduplicate_batches`.
+"""
+
+from collections import Counter
+import heapq
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from mini_vouchers.csv_utils import BarcodeBatch, OrderBatch
+from mini_vouchers.report import DUPLICATE_ORDER, UNKNOWN_ORDER, IngestionReport
+
+
+DEFAULT_CAPACITY = 1 << 16
+"""The default amount of counters of a summary."""
+
+
+class Estimate(NamedTuple):
+    """The estimated frequency of an item of a stream."""
+
+    item: Hashable
+    """The item, e.g. a customer identifier."""
+    count: int
+    """The estimated count, never lower than the actual count."""
+    error: int
+    """The maximum overestimation of the count."""
+
+
+class SpaceSaving:
+    """The approximate most frequent items of a stream, in bounded memory.
+
+    Up to `capacity` items are counted. Once every counter is taken, a new item
+    replaces the item of the smallest count and inherits that count as its
+    error, so that counts are only ever overestimated.
+
+    >>> summary = SpaceSaving(2)
+    >>> for item in "aabacad":
+    ...     summary.add(item)
+    >>> summary.top(2)
+    [Estimate(item='a', count=4, error=0), Estimate(item='d', count=3, error=2)]
+    >>> summary.error_bound()
+    3
+
+    """
+
+    capacity: int
+    """The amount of items counted at most."""
+    total: int
+    """The amount of items added, with their weights."""
+    _counts: Dict[Hashable, int]
+    """The estimated count of each item counted."""
+    _errors: Dict[Hashable, int]
+    """The maximum overestimation of the count of each item counted."""
+    _heap: List[Tuple[int, Hashable]]
+    """The items counted by count, the counts being possibly outdated but never
+    greater than the current counts."""
+    _on_evict: Optional[Callable[[Hashable], object]]
+    """The function called with each item no longer counted, if any."""
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CAPACITY,
+        on_evict: Callable[[Hashable], object] = None,
+    ):
+        """Initialise an empty summary.
+
+        :param capacity: The amount of items counted at most.
+        :param on_evict: The function to call with each item no longer
+            counted, e.g. to drop what is kept along with the items.
+
+        """
+        assert capacity > 0
+
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        self._heap = []
+        self._on_evict = on_evict
+
+    def add(self, item: Hashable, weight: int = 1):
+        """Count an item.
+
+        :param item: The item, comparable to the other items.
+        :param weight: The amount of times the item occurred.
+
+        """
+        assert weight > 0
+
+        self.total += weight
+        counts = self._counts
+        if item in counts:
+            # The heap is only updated when looking for the smallest count.
+            counts[item] += weight
+            return
+
+        error = 0
+        if len(counts) >= self.capacity:
+            error = self._evict()
+
+        counts[item] = error + weight
+        self._errors[item] = error
+        heapq.heappush(self._heap, (error + weight, item))
+
+    def _evict(self) -> int:
+        """Stop counting the item of the smallest count.
+
+        :returns: The count of that item.
+
+        """
+        heap, counts = self._heap, self._counts
+        count, item = heap[0]
+        while counts[item] != count:
+            heapq.heapreplace(heap, (counts[item], item))
+            count, item = heap[0]
+
+        heapq.heappop(heap)
+        del counts[item], self._errors[item]
+        if self._on_evict is not None:
+            self._on_evict(item)
+        return count
+
+    def error_bound(self) -> int:
+        """Get the bound of the count of the items not counted anymore, or never.
+
+        :returns: The smallest count, once every counter is taken, or `0`.
+
+        """
+        if len(self._counts) < self.capacity:
+            return 0
+        return min(self._counts.values())
+
+    def top(self, limit: int) -> Sequence[Estimate]:
+        """Get the items of the highest estimated counts.
+
+        :param limit: The amount of items to return.
+        :returns: A fresh sequence of the estimates, from high to low count.
+            Items of the same count are ranked by value.
+
+        """
+        assert limit >= 0
+
+        return [
+            Estimate(item, count, self._errors[item])
+            for item, count in heapq.nsmallest(
+                limit, self._counts.items(), key=lambda item: (-item[1], item[0])
+            )
+        ]
+
+    def estimates(self) -> List[Estimate]:
+        """Get the estimates of all the items counted.
+
+        :returns: A fresh list of the estimates, in no particular order.
+
+        """
+        return [
+            Estimate(item, count, self._errors[item])
+            for item, count in self._counts.items()
+        ]
+
+
+class TopCustomersSketch:
+    """The approximate top customers of a dataset, read in a single pass.
+
+    This answers :py:meth:`get_top_customers` as a
+    :py:class:`~mini_vouchers.voucher_system.VoucherSystem` does, without
+    holding the barcodes.
+
+    >>> from array import array
+    >>> barcode_batches = [
+    ...     BarcodeBatch(['a', 'b', 'c'], array('q', [10, 11, 12])),
+    ...     BarcodeBatch(['d', 'e'], array('q', [0, 12])),
+    ... ]
+    >>> order_batches = [
+    ...     OrderBatch(array('q', [10, 11, 12]), array('q', [7, 8, 9])),
+    ... ]
+    >>> sketch = TopCustomersSketch(capacity=2)
+    >>> sketch.populate_batches(barcode_batches, order_batches)
+    >>> sketch.estimate_top_customers(2)
+    [Estimate(item=9, count=3, error=1), Estimate(item=8, count=1, error=0)]
+    >>> sketch.get_top_customers(1)
+    [(9, 3)]
+
+    """
+
+    summary: SpaceSaving
+    """The estimated totals of the customers."""
+    _customers: Dict[int, int]
+    """The customer of each order."""
+    _first_orders: Dict[int, int]
+    """The smallest identifier of the orders with barcodes of each customer
+    counted, since it was last counted."""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        """Initialise an empty sketch.
+
+        :param capacity: The amount of customers counted at most.
+
+        """
+        self._first_orders = {}
+        # The first orders are dropped along with the customers.
+        self.summary = SpaceSaving(capacity, self._first_orders.pop)
+        self._customers = {}
+
+    def populate_batches(
+        self,
+        barcode_batches: Iterable[BarcodeBatch],
+        order_batches: Iterable[OrderBatch],
+        report: IngestionReport = None,
+    ):
+        """Count the barcodes of each customer, a batch at a time.
+
+        The orders are all read first. The barcodes of a batch are then counted
+        by order, and each order is added to the summary once per batch, with
+        its amount of barcodes as weight.
+
+        :param barcode_batches: The batches of barcodes previously exported.
+        :param order_batches: The batches of orders previously exported.
+        :param report: The report to account for the duplicate orders and the
+            barcodes of unknown orders in, if any.
+
+        """
+        customers = self._customers
+        first_orders = self._first_orders
+        for order_ids, customer_ids in order_batches:
+            for order_id, customer_id in zip(order_ids, customer_ids):
+                if order_id in customers:
+                    if report is not None:
+                        report.reject_order(DUPLICATE_ORDER, order_id, customer_id)
+                    continue
+
+                customers[order_id] = customer_id
+
+        add = self.summary.add
+        for barcodes, order_ids in barcode_batches:
+            unknown_orders = set()
+            for order_id, amount in Counter(order_ids).items():
+                if not order_id:
+                    continue
+                customer_id = customers.get(order_id)
+                if customer_id is None:
+                    unknown_orders.add(order_id)
+                    continue
+
+                add(customer_id, amount)
+                first_order = first_orders.get(customer_id)
+                if first_order is None or order_id < first_order:
+                    first_orders[customer_id] = order_id
+
+            if unknown_orders and report is not None:
+                for barcode, order_id in zip(barcodes, order_ids):
+                    if order_id in unknown_orders:
+                        report.reject_barcode(UNKNOWN_ORDER, barcode, order_id)
+
+    def estimate_top_customers(self, limit: int) -> Sequence[Estimate]:
+        """Get the estimated top customers.
+
+        Customers with as many barcodes are ranked by their smallest order
+        identifier, among the orders counted since they were last counted.
+
+        :param limit: The amount of top customers to return.
+        :returns: A fresh sequence of the estimates of the customers, ranked
+            from high (most barcodes) to low.
+
+        """
+        assert limit >= 0
+
+        first_orders = self._first_orders
+        return heapq.nlargest(
+            limit,
+            self.summary.estimates(),
+            key=lambda estimate: (estimate.count, -first_orders[estimate.item]),
+        )
+
+    def get_top_customers(self, limit: int) -> Sequence[Tuple[int, int]]:
+        """Get the top customers, by estimated amount of barcodes.
+
+        See :py:meth:`mini_vouchers.voucher_system.VoucherSystem.get_top_customers`.
+
+        :param limit: The amount of top customers to return.
+        :returns: A fresh sequence of tuples of customer identifier and their
+            estimated amount of barcodes, ranked from high to low.
+
+        """
+        return [
+            (estimate.item, estimate.count)
+            for estimate in self.estimate_top_customers(limit)
+        ]
@@ -0,0 +1,271 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Binary snapshots of a populated voucher system.
+
+A snapshot holds the tables of a
+:py:class:`~mini_vouchers.compact.CompactVoucherSystem`, laid out as follows:
+
+- A header: the :py:const:`MAGIC` bytes, the format version, the byte order of
+  the tables, the two counters of the system and the offset and length of
+  each table;
+- The tables, each one aligned on 8 bytes, in the order of
+  :py:class:`~mini_vouchers.compact.CompactTables`.
+
+Loading a snapshot in a compact system maps the file in memory and casts the
+tables in place, without copying them: it takes about as long as opening the
+file. Only the layout of the file is validated, not the content of the tables.
+Loading it in any other system goes through its columnar ingestion.
+
+A snapshot holds the orders with barcodes and the available barcodes. The
+pending orders of a system, along with the barcodes held for unknown orders,
+are not saved, and neither are the discarded barcodes: they are only counted,
+and that count is lost when loading a snapshot in a system other than a
+compact one.
+"""
+
+from array import array
+import mmap
+import os
+import struct
+import sys
+from typing import BinaryIO, Iterator, List, Tuple
+
+from mini_vouchers.compact import CompactTables, CompactVoucherSystem
+from mini_vouchers.csv_utils import NO_ORDER_ID, BarcodeBatch, OrderBatch
+
+
+MAGIC = b"MVSNAP\r\n"
+"""The bytes a snapshot file starts with."""
+VERSION = 1
+"""The version of the snapshot format."""
+BATCH_SIZE = 1 << 16
+"""The amount of rows loaded at once in a non-compact system."""
+
+_TYPECODES = ("B", "Q", "q", "q", "q", "Q", "Q", "q", "q")
+"""The array type code of each table, in the order of
+:py:class:`~mini_vouchers.compact.CompactTables`."""
+_HEADER = struct.Struct("<8sIcxxxQQ")
+"""The fixed part of the header: magic, version, byte order and counters."""
+_SECTION = struct.Struct("<QQ")
+"""The offset and the length in bytes of each table."""
+_BYTE_ORDERS = {"little": b"<", "big": b">"}
+
+
+def _align(offset: int) -> int:
+    """Align an offset on 8 bytes."""
+    return (offset + 7) & ~7
+
+
+def save_snapshot(system, output: BinaryIO):
+    """Save a populated system into a snapshot.
+
+    >>> import io
+    >>> from mini_vouchers.csv_utils import ExportedBarcode, ExportedOrder
+    >>> from mini_vouchers.voucher_system import VoucherSystem
+    >>> system = VoucherSystem()
+    >>> system.populate([ExportedBarcode('a', 10), ExportedBarcode('z')],
+    ...                 [ExportedOrder(10, 7)])
+    >>> snapshot = io.BytesIO()
+    >>> save_snapshot(system, snapshot)
+    >>> loaded = load_snapshot(snapshot.getvalue())
+    >>> loaded.get_orders(), loaded.get_available_barcodes()
+    ([Order(order_id=10, customer_id=7, barcodes={'a'})], ['z'])
+
+    :param system: The system to save, e.g. a
+        :py:class:`~mini_vouchers.voucher_system.VoucherSystem`.
+    :param output: The binary stream to write to.
+
+    """
+    if not isinstance(system, CompactVoucherSystem):
+        system = CompactVoucherSystem.from_system(system)
+
+    tables = system.tables()
+    buffers = [memoryview(table).cast("B") for table in tables[:-2]]
+
+    offset = _HEADER.size + _SECTION.size * len(buffers)
+    sections: List[Tuple[int, int]] = []
+    for buffer in buffers:
+        offset = _align(offset)
+        sections.append((offset, buffer.nbytes))
+        offset += buffer.nbytes
+
+    output.write(
+        _HEADER.pack(
+            MAGIC,
+            VERSION,
+            _BYTE_ORDERS[sys.byteorder],
+            tables.available_count,
+            tables.discarded_count,
+        )
+    )
+    for section in sections:
+        output.write(_SECTION.pack(*section))
+
+    position = _HEADER.size + _SECTION.size * len(buffers)
+    for (offset, _), buffer in zip(sections, buffers):
+        output.write(bytes(offset - position))
+        output.write(buffer)
+        position = offset + buffer.nbytes
+
+
+def read_tables(buffer) -> CompactTables:
+    """Read the tables of a snapshot, in place.
+
+    >>> read_tables(MAGIC + bytes(8))
+    Traceback (most recent call last):
+        ...
+    ValueError: Corrupt snapshot: the header is truncated
+
+    :param buffer: The snapshot, e.g. a mapped file.
+    :returns: The tables, as views over `buffer`.
+    :raises ValueError: If the buffer is not a snapshot of a supported version,
+        or if its layout is corrupt.
+
+    """
+    view = memoryview(buffer)
+    if len(view) < len(MAGIC) or view[: len(MAGIC)] != MAGIC:
+        raise ValueError("Not a voucher system snapshot")
+    header_size = _HEADER.size + _SECTION.size * len(_TYPECODES)
+    if len(view) < header_size:
+        raise ValueError("Corrupt snapshot: the header is truncated")
+
+    magic, version, byte_order, available_count, discarded_count = _HEADER.unpack_from(
+        view
+    )
+    if magic != MAGIC:
+        raise ValueError("Not a voucher system snapshot")
+    if version != VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+    if byte_order != _BYTE_ORDERS[sys.byteorder]:
+        raise ValueError("The snapshot was written with another byte order")
+
+    tables = []
+    end = header_size
+    for index, typecode in enumerate(_TYPECODES):
+        offset, size = _SECTION.unpack_from(view, _HEADER.size + _SECTION.size * index)
+        if offset < end or offset != _align(offset) or offset + size > len(view):
+            raise ValueError(f"Corrupt snapshot: table {index} is out of bounds")
+        if size % struct.calcsize(typecode):
+            raise ValueError(f"Corrupt snapshot: table {index} is truncated")
+        end = offset + size
+        tables.append(view[offset:end].cast(typecode))
+    if end != len(view):
+        raise ValueError("Corrupt snapshot: the length does not match the tables")
+
+    compact_tables = CompactTables(*tables, available_count, discarded_count)
+    _check_sizes(compact_tables)
+    return compact_tables
+
+
+def _check_sizes(tables: CompactTables):
+    """Check that the sizes of the tables match each other.
+
+    :raises ValueError: If they do not.
+
+    """
+    if (
+        len(tables.barcode_offsets) != len(tables.barcode_orders) + 1
+        or len(tables.order_customers) != len(tables.order_ids)
+        or len(tables.order_offsets) != len(tables.order_ids) + 1
+        or len(tables.customer_totals) != len(tables.customer_ids)
+    ):
+        raise ValueError("Corrupt snapshot: the sizes of the tables do not match")
+    if tables.barcode_offsets[-1] != len(tables.barcode_data):
+        raise ValueError("Corrupt snapshot: the barcode offsets exceed the barcodes")
+    if tables.order_offsets[-1] != len(tables.order_barcodes):
+        raise ValueError("Corrupt snapshot: the order offsets exceed the barcodes")
+    if tables.available_count > len(tables.barcode_orders):
+        raise ValueError("Corrupt snapshot: the counters do not match the tables")
+
+
+def _barcode_batches(system: CompactVoucherSystem) -> Iterator[BarcodeBatch]:
+    """Yield the barcodes of a system in columnar batches."""
+    batch = BarcodeBatch([], array("q"))
+    for barcode in system.iter_available_barcodes():
+        batch.barcodes.append(barcode)
+        batch.order_ids.append(NO_ORDER_ID)
+        if len(batch.barcodes) >= BATCH_SIZE:
+            yield batch
+            batch = BarcodeBatch([], array("q"))
+
+    for order in system.iter_orders():
+        batch.barcodes.extend(order.barcodes)
+        batch.order_ids.extend([order.order_id] * len(order.barcodes))
+        if len(batch.barcodes) >= BATCH_SIZE:
+            yield batch
+            batch = BarcodeBatch([], array("q"))
+
+    yield batch
+
+
+def _order_batches(system: CompactVoucherSystem) -> Iterator[OrderBatch]:
+    """Yield the orders of a system in a columnar batch."""
+    yield OrderBatch(
+        array("q", (order.order_id for order in system.iter_orders())),
+        array("q", (order.customer_id for order in system.iter_orders())),
+    )
+
+
+def load_snapshot(source, storage=CompactVoucherSystem):
+    """Load a system from a snapshot.
+
+    Truncated or corrupt snapshots, and files of other formats or versions,
+    are rejected:
+
+    >>> import io
+    >>> from mini_vouchers.voucher_system import VoucherSystem
+    >>> snapshot = io.BytesIO()
+    >>> save_snapshot(VoucherSystem(), snapshot)
+    >>> load_snapshot(snapshot.getvalue()[:-8])
+    Traceback (most recent call last):
+        ...
+    ValueError: Corrupt snapshot: table 5 is out of bounds
+    >>> load_snapshot(b"junk" + snapshot.getvalue()[4:])
+    Traceback (most recent call last):
+        ...
+    ValueError: Not a voucher system snapshot
+    >>> load_snapshot(MAGIC + bytes([VERSION + 1]) + snapshot.getvalue()[9:])
+    Traceback (most recent call last):
+        ...
+    ValueError: Unsupported snapshot version 2
+
+    :param source: The path of the snapshot file, mapped in memory, or the
+        snapshot itself as bytes.
+    :param storage: The class of system to load into.
+    :returns: A fresh populated system.
+    :raises ValueError: If the source is not a snapshot of a supported version,
+        or if it is corrupt.
+
+    """
+    if isinstance(source, (bytes, bytearray)):
+        buffer = source
+    else:
+        with open(source, "rb") as snapshot_file:
+            if os.fstat(snapshot_file.fileno()).st_size < _HEADER.size:
+                # Too short to be mapped, if empty, or to be a snapshot anyway.
+                buffer = snapshot_file.read()
+            else:
+                buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    compact = CompactVoucherSystem.from_tables(read_tables(buffer))
+    if storage is CompactVoucherSystem:
+        return compact
+
+    system = storage()
+    system.populate_batches(_barcode_batches(compact), _order_batches(compact))
+    return system
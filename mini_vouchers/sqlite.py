@@ -0,0 +1,470 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""A Voucher System stored in an SQLite database.
+
+The :py:class:`SqliteVoucherSystem` answers the same queries as
+:py:class:`~mini_vouchers.voucher_system.VoucherSystem` but keeps its data in
+an SQLite database on disk, so that the datasets are not bounded by memory:
+
+- The barcodes are a table indexed by value, and by order identifier.
+- The orders are a table indexed by identifier, and by customer identifier.
+
+The rows are inserted in bulk, in a single transaction, and the data is then
+cleaned and validated by SQL statements. The figures and the top customers are
+aggregated by SQL queries.
+"""
+
+import itertools
+import os
+import sqlite3
+import tempfile
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    Tuple,
+)
+import weakref
+
+from mini_vouchers.csv_utils import (
+    BarcodeBatch,
+    ExportedBarcode,
+    ExportedOrder,
+    OrderBatch,
+)
+from mini_vouchers.report import (
+    DUPLICATE_BARCODE,
+    DUPLICATE_ORDER,
+    EMPTY_ORDER,
+    UNKNOWN_ORDER,
+    IngestionReport,
+)
+from mini_vouchers.voucher_system import Order, Statistics, customer_order_key
+
+
+SCHEMA = """
+CREATE TABLE orders (
+    order_id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    row INTEGER NOT NULL
+);
+CREATE TABLE pending_orders (
+    order_id INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL
+);
+CREATE TABLE barcodes (
+    barcode TEXT PRIMARY KEY,
+    order_id INTEGER,
+    row INTEGER NOT NULL
+);
+CREATE TEMP TABLE staged_orders (
+    row INTEGER PRIMARY KEY,
+    order_id INTEGER,
+    customer_id INTEGER
+);
+CREATE TEMP TABLE staged_barcodes (
+    row INTEGER PRIMARY KEY,
+    barcode TEXT,
+    order_id INTEGER
+);
+"""
+"""The tables of the database. The available barcodes have no order
+identifier, and the staged tables hold the rows as exported."""
+INDEXES = (
+    "CREATE INDEX barcodes_order ON barcodes (order_id, barcode)",
+    "CREATE INDEX orders_customer ON orders (customer_id, order_id)",
+)
+"""The indexes of the database, created once the rows are inserted."""
+
+
+class SqliteVoucherSystem:
+    """The Voucher System logic, backed by an SQLite database.
+
+    The system can only be populated once. The database is deleted when the
+    system is closed or garbage collected, unless its path was given.
+
+    >>> exported_barcodes = [ExportedBarcode('b', 10), ExportedBarcode('b', 12)]
+    >>> exported_barcodes += [ExportedBarcode('z'), ExportedBarcode('c', 11)]
+    >>> exported_orders = [ExportedOrder(10, 7), ExportedOrder(12, 7)]
+    >>> with SqliteVoucherSystem() as system:
+    ...     system.populate(exported_barcodes, exported_orders)
+    ...     system.get_available_barcodes()
+    ...     system.get_orders()
+    ...     system.get_pending_orders()
+    ...     system.get_top_customers(1)
+    ['z']
+    [Order(order_id=10, customer_id=7, barcodes={'b'})]
+    [Order(order_id=12, customer_id=7, barcodes=set())]
+    [(7, 1)]
+
+    """
+
+    path: str
+    """The path of the database."""
+    _connection: sqlite3.Connection
+    """The connection to the database."""
+    _discarded_count: int
+    """The amount of barcodes discarded."""
+
+    def __init__(self, path: str = None):
+        """Initialise the system in a new database.
+
+        :param path: The path of the database to create, or `None` for a
+            temporary file.
+
+        """
+        temporary = path is None
+        if temporary:
+            descriptor, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(descriptor)
+            os.unlink(path)
+
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        # The database is derived from the exports: it is not worth a journal.
+        self._connection.execute("PRAGMA journal_mode = OFF")
+        self._connection.execute("PRAGMA synchronous = OFF")
+        self._connection.executescript(SCHEMA)
+        self._discarded_count = 0
+        self._populated = False
+
+        self._finalizer = weakref.finalize(
+            self, _close, self._connection, path if temporary else None
+        )
+
+    def __enter__(self) -> "SqliteVoucherSystem":
+        """Use the system as a context manager closing it on exit."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Close the system."""
+        self.close()
+
+    def close(self):
+        """Close the database, deleting it if temporary."""
+        self._finalizer()
+
+    def _count(self, query: str, *parameters: Any) -> int:
+        """Get the single integer of a query."""
+        return self._connection.execute(query, parameters).fetchone()[0]
+
+    def stats(self) -> Statistics:
+        """Get the figures describing the dataset.
+
+        :returns: The current figures.
+
+        """
+        return Statistics(
+            orders=self._count("SELECT COUNT(*) FROM orders"),
+            customers=self._count("SELECT COUNT(DISTINCT customer_id) FROM orders"),
+            attributed_barcodes=self._count(
+                "SELECT COUNT(*) FROM barcodes WHERE order_id IS NOT NULL"
+            ),
+            available_barcodes=self.count_available_barcodes(),
+            discarded_barcodes=self._discarded_count,
+        )
+
+    def count_available_barcodes(self) -> int:
+        """Count the available barcodes, in the index.
+
+        :returns: The amount of available barcodes.
+
+        """
+        return self._count("SELECT COUNT(*) FROM barcodes WHERE order_id IS NULL")
+
+    def iter_available_barcodes(self) -> Iterator[str]:
+        """Iterate over the available barcodes, in the index.
+
+        :returns: An iterator of the available barcodes, sorted by value.
+
+        """
+        rows = self._connection.execute(
+            "SELECT barcode FROM barcodes WHERE order_id IS NULL ORDER BY barcode"
+        )
+        return (barcode for barcode, in rows)
+
+    def get_available_barcodes(self) -> Sequence[str]:
+        """Get the available barcodes.
+
+        :returns: A fresh sequence of the available barcodes, sorted by value.
+
+        """
+        return list(self.iter_available_barcodes())
+
+    def _iter_orders(
+        self, order_by: str, where: str = "1", *parameters: Any
+    ) -> Iterator[Order]:
+        """Iterate over the orders, building them from their rows of barcodes.
+
+        :param order_by: The columns to sort the orders by.
+        :param where: The condition on the orders to select.
+        :param parameters: The parameters of the condition.
+        :returns: An iterator of the orders.
+
+        """
+        rows = self._connection.execute(
+            "SELECT order_id, customer_id, barcode FROM orders "
+            f"JOIN barcodes USING (order_id) WHERE {where} ORDER BY {order_by}",
+            parameters,
+        )
+        return (
+            Order(order_id, customer_id, {barcode for _, _, barcode in group})
+            for (order_id, customer_id), group in itertools.groupby(
+                rows, key=lambda row: row[:2]
+            )
+        )
+
+    def iter_orders(self) -> Iterator[Order]:
+        """Iterate over the orders known to the system, building them lazily.
+
+        :returns: An iterator of the orders, sorted by identifier.
+
+        """
+        return self._iter_orders("order_id")
+
+    def get_orders(self, key: Callable[[Order], Any] = None) -> Sequence[Order]:
+        """Get the orders known to the system.
+
+        The orders are sorted by the database when sorted by
+        :py:func:`~mini_vouchers.voucher_system.customer_order_key`.
+
+        :param key: The sorting function to apply. Defaults to sorted by value.
+        :returns: A fresh sequence of the orders.
+
+        """
+        if key is customer_order_key:
+            return list(self._iter_orders("customer_id, order_id"))
+        if key is None:
+            return list(self.iter_orders())
+        return sorted(self.iter_orders(), key=key)
+
+    def get_order(self, order_id: int) -> Optional[Order]:
+        """Get an order by identifier, in the index.
+
+        :param order_id: The identifier of the order.
+        :returns: The order, or `None` if unknown to the system.
+
+        """
+        row = self._connection.execute(
+            "SELECT customer_id FROM orders WHERE order_id = ?", (order_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        barcodes = self._connection.execute(
+            "SELECT barcode FROM barcodes WHERE order_id = ?", (order_id,)
+        )
+        return Order(order_id, row[0], {barcode for barcode, in barcodes})
+
+    def owner_of(self, barcode: str) -> Optional[Order]:
+        """Get the order a barcode is attributed to, in the index.
+
+        :param barcode: The barcode value.
+        :returns: The order, or `None` if the barcode is available, discarded
+            or unknown to the system.
+
+        """
+        row = self._connection.execute(
+            "SELECT order_id FROM barcodes WHERE barcode = ?", (barcode,)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return self.get_order(row[0])
+
+    def orders_for_customer(self, customer_id: int) -> Sequence[Order]:
+        """Get the orders with barcodes of a customer, in the index.
+
+        :param customer_id: The identifier of the customer.
+        :returns: A fresh sequence of the orders, sorted by identifier.
+
+        """
+        return list(self._iter_orders("order_id", "customer_id = ?", customer_id))
+
+    def get_pending_orders(self) -> Sequence[Order]:
+        """Get the orders still waiting for barcodes.
+
+        :returns: A fresh sequence of the pending orders, sorted by value.
+
+        """
+        rows = self._connection.execute(
+            "SELECT order_id, customer_id FROM pending_orders ORDER BY order_id"
+        )
+        return [Order(order_id, customer_id, set()) for order_id, customer_id in rows]
+
+    def get_top_customers(self, limit: int) -> Sequence[Tuple[int, int]]:
+        """Get the top customers, aggregated by the database.
+
+        See :py:meth:`mini_vouchers.voucher_system.VoucherSystem.get_top_customers`.
+
+        :param limit: The amount of top customers to return.
+        :returns: A fresh sequence of tuples of customer identifier and their
+            amount of barcodes, ranked from high (most barcodes) to low.
+
+        """
+        assert limit >= 0
+
+        rows = self._connection.execute(
+            "SELECT customer_id, COUNT(*) AS total, MIN(order_id) AS first_order "
+            "FROM orders JOIN barcodes USING (order_id) GROUP BY customer_id "
+            "ORDER BY total DESC, first_order LIMIT ?",
+            (limit,),
+        )
+        return [(customer_id, total) for customer_id, total, _ in rows]
+
+    def populate(
+        self,
+        exported_barcodes: Iterable[ExportedBarcode],
+        exported_orders: Iterable[ExportedOrder],
+        report: IngestionReport = None,
+    ):
+        """Populate the system with data previously exported.
+
+        See :py:meth:`populate_batches`.
+
+        :param exported_barcodes: The barcodes previously exported.
+        :param exported_orders: The orders previously exported.
+        :param report: The report to account for the rejected rows in, if any.
+
+        """
+        self._ingest(exported_barcodes, exported_orders, report)
+
+    def populate_batches(
+        self,
+        barcode_batches: Iterable[BarcodeBatch],
+        order_batches: Iterable[OrderBatch],
+        report: IngestionReport = None,
+    ):
+        """Populate the system with columnar batches of data previously exported.
+
+        The data is cleaned and validated following the rules of
+        :py:meth:`mini_vouchers.voucher_system.VoucherSystem.populate_batches`.
+        The rejected rows are accounted for in the report reason by reason,
+        rather than in the order of the rows.
+
+        :param barcode_batches: The batches of barcodes previously exported.
+        :param order_batches: The batches of orders previously exported.
+        :param report: The report to account for the rejected rows in, if any.
+
+        """
+        self._ingest(
+            itertools.chain.from_iterable(itertools.starmap(zip, barcode_batches)),
+            itertools.chain.from_iterable(itertools.starmap(zip, order_batches)),
+            report,
+        )
+
+    def _ingest(
+        self,
+        barcode_rows: Iterable[Tuple[str, Optional[int]]],
+        order_rows: Iterable[Tuple[int, int]],
+        report: Optional[IngestionReport],
+    ):
+        """Insert the exported rows, then clean and validate them.
+
+        :param barcode_rows: The barcode values and optional order identifiers.
+        :param order_rows: The order identifiers and customer identifiers.
+        :param report: The report to account for the rejected rows in, if any.
+        :raises ValueError: If the system is populated already.
+
+        """
+        if self._populated:
+            raise ValueError("The system is populated already")
+        self._populated = True
+
+        database = self._connection
+        with database:
+            # The first order of an identifier wins.
+            database.executemany(
+                "INSERT INTO staged_orders (order_id, customer_id) VALUES (?, ?)",
+                order_rows,
+            )
+            database.execute(
+                "INSERT OR IGNORE INTO orders (order_id, customer_id, row) "
+                "SELECT order_id, customer_id, row FROM staged_orders ORDER BY row"
+            )
+            if report is not None:
+                for order_id, customer_id in database.execute(
+                    "SELECT staged.order_id, staged.customer_id "
+                    "FROM staged_orders AS staged JOIN orders USING (order_id) "
+                    "WHERE staged.row != orders.row ORDER BY staged.row"
+                ):
+                    report.reject_order(DUPLICATE_ORDER, order_id, customer_id)
+
+            # The first barcode of a value wins, even if its order is unknown.
+            database.executemany(
+                "INSERT INTO staged_barcodes (barcode, order_id) "
+                "VALUES (?, NULLIF(?, 0))",
+                barcode_rows,
+            )
+            changes = database.total_changes
+            database.execute(
+                "INSERT OR IGNORE INTO barcodes (barcode, order_id, row) "
+                "SELECT barcode, order_id, row FROM staged_barcodes ORDER BY row"
+            )
+            staged = self._count("SELECT COUNT(*) FROM staged_barcodes")
+            self._discarded_count += staged - (database.total_changes - changes)
+            if report is not None:
+                for barcode, order_id in database.execute(
+                    "SELECT staged.barcode, staged.order_id "
+                    "FROM staged_barcodes AS staged JOIN barcodes USING (barcode) "
+                    "WHERE staged.row != barcodes.row ORDER BY staged.row"
+                ):
+                    report.reject_barcode(DUPLICATE_BARCODE, barcode, order_id)
+
+            unknown = (
+                "FROM barcodes WHERE order_id IS NOT NULL "
+                "AND order_id NOT IN (SELECT order_id FROM orders)"
+            )
+            if report is not None:
+                for barcode, order_id in database.execute(
+                    f"SELECT barcode, order_id {unknown} ORDER BY row"
+                ):
+                    report.reject_barcode(UNKNOWN_ORDER, barcode, order_id)
+            changes = database.total_changes
+            database.execute(f"DELETE {unknown}")
+            self._discarded_count += database.total_changes - changes
+
+            for index in INDEXES:
+                database.execute(index)
+
+            # The orders without barcodes are held aside as pending.
+            empty = (
+                "FROM orders WHERE NOT EXISTS "
+                "(SELECT 1 FROM barcodes WHERE barcodes.order_id = orders.order_id)"
+            )
+            if report is not None:
+                for order_id, customer_id in database.execute(
+                    f"SELECT order_id, customer_id {empty} ORDER BY row"
+                ):
+                    report.reject_order(EMPTY_ORDER, order_id, customer_id)
+            database.execute(
+                f"INSERT INTO pending_orders SELECT order_id, customer_id {empty}"
+            )
+            database.execute(f"DELETE {empty}")
+
+            database.execute("DELETE FROM staged_orders")
+            database.execute("DELETE FROM staged_barcodes")
+
+
+def _close(connection: sqlite3.Connection, path: Optional[str]):
+    """Close a database, deleting its file if given."""
+    connection.close()
+    if path is not None:
+        os.unlink(path)
@@ -17,11 +17,36 @@
 
 """The Voucher System definition."""
 
-from collections import Counter
-import logging
-from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence, Set, Tuple
-
-from mini_vouchers.csv_utils import ExportedBarcode, ExportedOrder
+import heapq
+import itertools
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from mini_vouchers.csv_utils import (
+    BarcodeBatch,
+    ExportedBarcode,
+    ExportedOrder,
+    OrderBatch,
+)
+from mini_vouchers.report import (
+    CONFLICTING_BARCODE,
+    DUPLICATE_BARCODE,
+    DUPLICATE_ORDER,
+    EMPTY_ORDER,
+    UNKNOWN_ORDER,
+    IngestionReport,
+)
 
 
 class Order(NamedTuple):
@@ -35,6 +60,34 @@ class Order(NamedTuple):
     """The attributed barcodes."""
 
 
+class Statistics(NamedTuple):
+    """The figures describing the dataset of a voucher system."""
+
+    orders: int
+    """The amount of orders."""
+    customers: int
+    """The amount of distinct customers with orders."""
+    attributed_barcodes: int
+    """The amount of barcodes attributed to orders."""
+    available_barcodes: int
+    """The amount of available barcodes."""
+    discarded_barcodes: int
+    """The amount of barcodes discarded, being duplicates or attributed to
+    unknown orders."""
+
+
+def customer_order_key(order: Order) -> Tuple[int, int]:
+    """Get the key sorting orders by customer, then by order identifier.
+
+    Unlike a lambda, the key can be handed over to other processes.
+
+    :param order: The order to sort.
+    :returns: The customer identifier and the order identifier.
+
+    """
+    return order.customer_id, order.order_id
+
+
 class VoucherSystem:
     """The Voucher System logic.
 
@@ -45,31 +98,148 @@ class VoucherSystem:
         (:py:meth:`get_orders`).
 
     Each order has a unique identifier, while barcodes are unique themselves.
+    Orders without barcodes are held aside as pending
+    (:py:meth:`get_pending_orders`) until a delta attributes them barcodes
+    (:py:meth:`apply_delta`).
 
     """
 
     _all_barcodes: Dict[str, Optional[int]]
     """The pool of available barcodes mapped to their order identifier."""
     _orders: Dict[int, Order]
-    """The orders addressed by their identifier."""
+    """The orders with barcodes addressed by their identifier."""
+    _pending_orders: Dict[int, Order]
+    """The orders without barcodes addressed by their identifier."""
+    _pending_barcodes: Dict[int, List[str]]
+    """The barcodes of unknown orders by order identifier, discarded until
+    their order is added by a delta."""
+    _available: List[str]
+    """The index of available barcodes, sorted by value unless marked
+    otherwise. It may still hold barcodes removed since."""
+    _available_sorted: bool
+    """Whether :py:attr:`_available` is currently sorted."""
+    _removed_available: Set[str]
+    """The barcodes of :py:attr:`_available` attributed since, to filter out
+    when it is next queried."""
+    _customer_totals: Dict[int, int]
+    """The amount of barcodes attributed to each customer."""
+    _customer_first_orders: Dict[int, int]
+    """The smallest identifier of the orders with barcodes of each customer."""
+    _attributed_count: int
+    """The amount of barcodes attributed to orders."""
+    _discarded_count: int
+    """The amount of barcodes discarded."""
+    _next_order_id: Optional[int]
+    """The identifier of the next order placed, if known already."""
+    _customer_orders: Optional[Dict[int, List[int]]]
+    """The identifiers of the orders with barcodes of each customer, sorted,
+    if indexed already."""
+    _populated: bool
+    """Whether the system was populated already."""
 
     def __init__(self):
         """Initialise the system."""
         self._all_barcodes = {}
         self._orders = {}
+        self._pending_orders = {}
+        self._pending_barcodes = {}
+        self._available = []
+        self._available_sorted = True
+        self._removed_available = set()
+        self._customer_totals = {}
+        self._customer_first_orders = {}
+        self._attributed_count = 0
+        self._discarded_count = 0
+        self._next_order_id = None
+        self._customer_orders = None
+        self._populated = False
+
+    def stats(self) -> Statistics:
+        """Get the figures describing the dataset, in constant time.
+
+        The figures are maintained while the system is populated.
+
+        >>> exported_barcodes = [ExportedBarcode('a', 10), ExportedBarcode('b', 10)]
+        >>> exported_barcodes += [ExportedBarcode('a'), ExportedBarcode('z')]
+        >>> exported_orders = [ExportedOrder(10, 7), ExportedOrder(11, 7)]
+        >>> system = VoucherSystem()
+        >>> system.populate(exported_barcodes, exported_orders)
+        >>> system.stats()
+        Statistics(orders=1, customers=1, attributed_barcodes=2, \
+available_barcodes=1, discarded_barcodes=1)
+
+        :returns: The current figures.
+
+        """
+        return Statistics(
+            orders=len(self._orders),
+            customers=len(self._customer_totals),
+            attributed_barcodes=self._attributed_count,
+            available_barcodes=self.count_available_barcodes(),
+            discarded_barcodes=self._discarded_count,
+        )
+
+    def _sorted_available(self) -> List[str]:
+        """Get the index of available barcodes, sorting it if need be.
+
+        Barcodes are appended to the index as they are added, and the index is
+        only sorted when queried. Sorting an index which is mostly sorted
+        already is close to linear. The barcodes removed since the last query
+        are filtered out at once.
+        """
+        if self._removed_available:
+            removed = self._removed_available
+            self._available = [
+                barcode for barcode in self._available if barcode not in removed
+            ]
+            self._removed_available = set()
+        if not self._available_sorted:
+            self._available.sort()
+            self._available_sorted = True
+        return self._available
+
+    def count_available_barcodes(self) -> int:
+        """Count the available barcodes, in constant time.
+
+        :returns: The amount of available barcodes.
+
+        """
+        return len(self._available) - len(self._removed_available)
+
+    def iter_available_barcodes(self) -> Iterator[str]:
+        """Iterate over the available barcodes without copying them.
+
+        The system must not be modified during the iteration.
+
+        :returns: An iterator of the available barcodes, sorted by value.
+
+        """
+        return iter(self._sorted_available())
 
     def get_available_barcodes(self) -> Sequence[str]:
         """Get the available barcodes.
 
+        >>> system = VoucherSystem()
+        >>> system.populate([ExportedBarcode('b'), ExportedBarcode('a')], [])
+        >>> system.get_available_barcodes()
+        ['a', 'b']
+        >>> system.count_available_barcodes()
+        2
+
         :returns: A fresh sequence of the available barcodes, sorted by value.
 
         """
-        return sorted(
-            filter(
-                lambda barcode: not self._all_barcodes[barcode],
-                self._all_barcodes.keys(),
-            )
-        )
+        return list(self._sorted_available())
+
+    def iter_orders(self) -> Iterator[Order]:
+        """Iterate over the orders known to the system, in no particular order.
+
+        The system must not be modified during the iteration.
+
+        :returns: An iterator of the orders.
+
+        """
+        return iter(self._orders.values())
 
     def get_orders(self, key: Callable[[Order], Any] = None) -> Sequence[Order]:
         """Get the orders known to the system.
@@ -80,11 +250,98 @@ class VoucherSystem:
         """
         return sorted(self._orders.values(), key=key)
 
+    def get_order(self, order_id: int) -> Optional[Order]:
+        """Get an order by identifier, in constant time.
+
+        >>> system = VoucherSystem()
+        >>> system.populate([ExportedBarcode('a', 10)], [ExportedOrder(10, 7)])
+        >>> system.get_order(10), system.get_order(11)
+        (Order(order_id=10, customer_id=7, barcodes={'a'}), None)
+
+        Pending orders are not returned, see :py:meth:`get_pending_orders`.
+
+        :param order_id: The identifier of the order.
+        :returns: The order, or `None` if unknown to the system.
+
+        """
+        return self._orders.get(order_id)
+
+    def owner_of(self, barcode: str) -> Optional[Order]:
+        """Get the order a barcode is attributed to, in constant time.
+
+        >>> system = VoucherSystem()
+        >>> system.populate([ExportedBarcode('a', 10), ExportedBarcode('z')],
+        ...                 [ExportedOrder(10, 7)])
+        >>> system.owner_of('a'), system.owner_of('z')
+        (Order(order_id=10, customer_id=7, barcodes={'a'}), None)
+
+        :param barcode: The barcode value.
+        :returns: The order, or `None` if the barcode is available, discarded
+            or unknown to the system.
+
+        """
+        order_id = self._all_barcodes.get(barcode)
+        return self._orders.get(order_id) if order_id else None
+
+    def orders_for_customer(self, customer_id: int) -> Sequence[Order]:
+        """Get the orders with barcodes of a customer.
+
+        The orders of all the customers are indexed on the first call, and the
+        index is kept up to date until the system is populated again.
+
+        >>> system = VoucherSystem()
+        >>> system.populate([ExportedBarcode('a', 12), ExportedBarcode('b', 10)],
+        ...                 [ExportedOrder(12, 7), ExportedOrder(10, 7)])
+        >>> [order.order_id for order in system.orders_for_customer(7)]
+        [10, 12]
+
+        :param customer_id: The identifier of the customer.
+        :returns: A fresh sequence of the orders, sorted by identifier.
+
+        """
+        orders = self._orders
+        if self._customer_orders is None:
+            self._customer_orders = {}
+            for order_id in sorted(orders):
+                order_ids = self._customer_orders.setdefault(
+                    orders[order_id].customer_id, []
+                )
+                order_ids.append(order_id)
+
+        return [
+            orders[order_id] for order_id in self._customer_orders.get(customer_id, ())
+        ]
+
+    def get_pending_orders(self) -> Sequence[Order]:
+        """Get the orders still waiting for barcodes.
+
+        Pending orders are neither returned by :py:meth:`get_orders` nor
+        accounted for in :py:meth:`stats`.
+
+        :returns: A fresh sequence of the pending orders, sorted by value.
+
+        """
+        return sorted(self._pending_orders.values())
+
+    def get_customer_first_order(self, customer_id: int) -> Optional[int]:
+        """Get the smallest identifier of the orders with barcodes of a customer.
+
+        It ranks the customers with as many barcodes, see
+        :py:meth:`get_top_customers`.
+
+        :param customer_id: The identifier of the customer.
+        :returns: The order identifier, or `None` if the customer has no orders
+            with barcodes.
+
+        """
+        return self._customer_first_orders.get(customer_id)
+
     def get_top_customers(self, limit: int) -> Sequence[Tuple[int, int]]:
         """Get the top customers.
 
         Compute and yield the top customers based on how many barcodes they
-        ordered.
+        ordered. Customers with as many barcodes are ranked by their smallest
+        order identifier.
 
         >>> # Begin the range at 1 to avoid empty barcodes.
         >>> exported_barcodes = [ExportedBarcode('a'*i, 100+i) for i in range(1,5)]
@@ -98,6 +355,9 @@ class VoucherSystem:
         >>> system.get_top_customers(2)
         [(44, 19), (55, 9)]
 
+        The totals are maintained as barcodes are attributed, and only the
+        `limit` top customers are kept in a heap while ranking them.
+
         :param limit: The amount of top customers to return.
         :returns: A fresh sequence of tuples of customer identifier and their
             amount of barcodes, ranked from high (most barcodes) to low.
@@ -105,17 +365,18 @@ class VoucherSystem:
         """
         assert limit >= 0
 
-        customer_total_barcodes: Counter = Counter()
-
-        for order in self.get_orders():
-            customer_total_barcodes.update({order.customer_id: len(order.barcodes)})
-
-        return customer_total_barcodes.most_common()[:limit]
+        first_orders = self._customer_first_orders
+        return heapq.nlargest(
+            limit,
+            self._customer_totals.items(),
+            key=lambda item: (item[1], -first_orders[item[0]]),
+        )
 
     def populate(
         self,
         exported_barcodes: Sequence[ExportedBarcode],
         exported_orders: Sequence[ExportedOrder],
+        report: IngestionReport = None,
     ):
         """Populate the system with data previously exported.
 
@@ -151,7 +412,8 @@ class VoucherSystem:
             >>> system.get_available_barcodes()
             ['a']
 
-        #.  An order must have barcodes assigned to it, it is otherwise dropped:
+        #.  An order must have barcodes assigned to it, it is otherwise held
+            as pending:
 
             >>> exported_barcodes = []
             >>> exported_orders = [ExportedOrder(10, 7)]
@@ -159,41 +421,458 @@ class VoucherSystem:
             >>> system.populate(exported_barcodes, exported_orders)
             >>> len(system.get_orders())
             0
+            >>> system.get_pending_orders()
+            [Order(order_id=10, customer_id=7, barcodes=set())]
+
+        A system is only populated once, the later exports being applied as
+        deltas, see :py:meth:`apply_delta`:
+
+        >>> system.populate([], [])
+        Traceback (most recent call last):
+            ...
+        ValueError: The system is populated already, apply a delta instead
 
         :param exported_barcodes: The barcodes previously exported.
         :param exported_orders: The orders previously exported.
+        :param report: The report to account for the rejected rows in, if any.
+        :raises ValueError: If the system is populated already.
 
         """
+        self._start_populating()
+
         # Populate the orders
         for exported_order in exported_orders:
             order_id, customer_id = exported_order
 
             if order_id not in self._orders:
-                logging.debug("Adding new order %s", exported_order)
                 self._orders[order_id] = Order(order_id, customer_id, set())
-            else:
-                logging.warning("Discarding duplicate order %s", exported_order)
+            elif report is not None:
+                report.reject_order(DUPLICATE_ORDER, order_id, customer_id)
 
         # Populate the barcodes
         for exported_barcode in exported_barcodes:
             barcode, opt_order_id = exported_barcode
 
             if barcode in self._all_barcodes:
-                logging.warning("Discarding duplicate barcode %s", exported_barcode)
+                if report is not None:
+                    report.reject_barcode(DUPLICATE_BARCODE, barcode, opt_order_id)
+                self._discarded_count += 1
                 continue
 
-            logging.debug("Adding new barcode %s", exported_barcode)
             self._all_barcodes[barcode] = opt_order_id
 
-            if opt_order_id and opt_order_id in self._orders:
-                self._orders[opt_order_id].barcodes.add(barcode)
-            elif opt_order_id:
-                logging.warning(
-                    "Discarding barcode %s from unknown order", exported_barcode
-                )
+            if not opt_order_id:
+                self._available.append(barcode)
+                self._available_sorted = False
+            elif opt_order_id in self._orders:
+                self._attribute(self._orders[opt_order_id], barcode)
+            else:
+                if report is not None:
+                    report.reject_barcode(UNKNOWN_ORDER, barcode, opt_order_id)
+                self._hold_barcode(opt_order_id, barcode)
+
+        self._hold_empty_orders(report)
+        self._next_order_id = None
+        self._customer_orders = None
+
+    def populate_batches(
+        self,
+        barcode_batches: Iterable[BarcodeBatch],
+        order_batches: Iterable[OrderBatch],
+        report: IngestionReport = None,
+    ):
+        """Populate the system with columnar batches of data previously exported.
+
+        This is the columnar counterpart of :py:meth:`populate` and follows the
+        very same rules. The columns are walked a batch at a time, without
+        building nor unpacking a tuple per row.
+
+        >>> from array import array
+        >>> barcode_batches = [
+        ...     BarcodeBatch(['a', 'z'], array('q', [10, 0])),
+        ...     BarcodeBatch(['a', 'b'], array('q', [0, 11])),
+        ... ]
+        >>> order_batches = [OrderBatch(array('q', [10, 12]), array('q', [7, 8]))]
+        >>> system = VoucherSystem()
+        >>> system.populate_batches(barcode_batches, order_batches)
+        >>> system.get_available_barcodes()
+        ['z']
+        >>> system.get_orders()
+        [Order(order_id=10, customer_id=7, barcodes={'a'})]
+
+        Orders are only validated once every batch is consumed since their
+        barcodes may come from any batch. The rows rejected along the way are
+        accounted for in the report, if any:
+
+        >>> from mini_vouchers.report import IngestionReport
+        >>> report = IngestionReport()
+        >>> VoucherSystem().populate_batches(barcode_batches, order_batches, report)
+        >>> report.counts
+        {'duplicate barcode': 1, 'unknown order': 1, 'order without barcodes': 1}
+
+        :param barcode_batches: The batches of barcodes previously exported.
+        :param order_batches: The batches of orders previously exported.
+        :param report: The report to account for the rejected rows in, if any.
+        :raises ValueError: If the system is populated already.
+
+        """
+        self._start_populating()
+
+        orders = self._orders
+        all_barcodes = self._all_barcodes
+        add_available = self._available.append
+        available_count = len(self._available)
+        customer_totals = self._customer_totals
+        attributed_count = 0
+        discarded_count = 0
+
+        # Populate the orders
+        for order_ids, customer_ids in order_batches:
+            for order_id, customer_id in zip(order_ids, customer_ids):
+                if order_id not in orders:
+                    orders[order_id] = Order(order_id, customer_id, set())
+                elif report is not None:
+                    report.reject_order(DUPLICATE_ORDER, order_id, customer_id)
+
+        # Populate the barcodes
+        for barcodes, order_ids in barcode_batches:
+            for barcode, order_id in zip(barcodes, order_ids):
+                if barcode in all_barcodes:
+                    if report is not None:
+                        report.reject_barcode(DUPLICATE_BARCODE, barcode, order_id)
+                    discarded_count += 1
+                    continue
+
+                if not order_id:
+                    all_barcodes[barcode] = None
+                    add_available(barcode)
+                    continue
+
+                all_barcodes[barcode] = order_id
+                order = orders.get(order_id)
+                if order is not None:
+                    # Inline :py:meth:`_attribute` for the common case.
+                    if order.barcodes:
+                        order.barcodes.add(barcode)
+                        customer_totals[order.customer_id] += 1
+                        attributed_count += 1
+                    else:
+                        self._attribute(order, barcode)
+                else:
+                    if report is not None:
+                        report.reject_barcode(UNKNOWN_ORDER, barcode, order_id)
+                    self._hold_barcode(order_id, barcode)
+
+        self._attributed_count += attributed_count
+        self._discarded_count += discarded_count
+        if len(self._available) != available_count:
+            self._available_sorted = False
+
+        self._hold_empty_orders(report)
+        self._next_order_id = None
+        self._customer_orders = None
+
+    def apply_delta(
+        self,
+        barcode_batches: Iterable[BarcodeBatch],
+        order_batches: Iterable[OrderBatch],
+        report: IngestionReport = None,
+    ):
+        """Apply columnar batches of data exported since the last population.
+
+        Only the rows of the delta are walked, on top of a system populated
+        beforehand. The rules of :py:meth:`populate` apply, along with:
+
+        #.  New orders are pending until a barcode is attributed to them, in
+            this delta or a later one;
+        #.  Barcodes of unknown orders, from the population or a delta, are
+            discarded until their order is added, in this delta or a later
+            one, and are then attributed to it;
+        #.  A known available barcode exported with an order identifier is
+            attributed to that order, provided the order is known or pending;
+        #.  A known barcode exported again with the same attribution is
+            ignored, while any other attribution is discarded: barcodes are
+            never unattributed nor moved to another order.
+
+        >>> from array import array
+        >>> system = VoucherSystem()
+        >>> system.populate_batches(
+        ...     [BarcodeBatch(['a', 'b'], array('q', [10, 0]))],
+        ...     [OrderBatch(array('q', [10, 11]), array('q', [7, 8]))],
+        ... )
+        >>> system.get_pending_orders()
+        [Order(order_id=11, customer_id=8, barcodes=set())]
+        >>> system.apply_delta(
+        ...     [BarcodeBatch(['a', 'b', 'c', 'd'], array('q', [10, 11, 12, 0]))],
+        ...     [OrderBatch(array('q', [12]), array('q', [7]))],
+        ... )
+        >>> [(order.order_id, order.barcodes) for order in system.get_orders()]
+        [(10, {'a'}), (11, {'b'}), (12, {'c'})]
+        >>> system.get_available_barcodes(), system.get_pending_orders()
+        (['d'], [])
+
+        A barcode exported before its order ends up as if both were exported
+        at once, even when the very same row is exported again:
+
+        >>> system.apply_delta([BarcodeBatch(['e'], array('q', [13]))], [])
+        >>> system.stats().discarded_barcodes
+        1
+        >>> system.apply_delta(
+        ...     [BarcodeBatch(['e'], array('q', [13]))],
+        ...     [OrderBatch(array('q', [13]), array('q', [9]))],
+        ... )
+        >>> fresh = VoucherSystem()
+        >>> fresh.populate_batches(
+        ...     [BarcodeBatch(['a', 'b', 'c', 'd', 'e'],
+        ...                   array('q', [10, 11, 12, 0, 13]))],
+        ...     [OrderBatch(array('q', [10, 11, 12, 13]), array('q', [7, 8, 7, 9]))],
+        ... )
+        >>> system.get_orders() == fresh.get_orders()
+        True
+        >>> system.stats() == fresh.stats()
+        True
+
+        :param barcode_batches: The batches of barcodes of the delta.
+        :param order_batches: The batches of orders of the delta.
+        :param report: The report to account for the rejected rows in, if any.
+
+        """
+        self._populated = True
+
+        orders = self._orders
+        pending_orders = self._pending_orders
+        pending_barcodes = self._pending_barcodes
+        all_barcodes = self._all_barcodes
+        added: List[str] = []
+
+        # Populate the orders, pending until they get barcodes.
+        for order_ids, customer_ids in order_batches:
+            for order_id, customer_id in zip(order_ids, customer_ids):
+                if order_id in orders or order_id in pending_orders:
+                    if report is not None:
+                        report.reject_order(DUPLICATE_ORDER, order_id, customer_id)
+                    continue
+
+                order = Order(order_id, customer_id, set())
+                held = pending_barcodes.pop(order_id, None)
+                if held is None:
+                    pending_orders[order_id] = order
+                    continue
+
+                orders[order_id] = order
+                for barcode in held:
+                    self._attribute(order, barcode)
+                self._discarded_count -= len(held)
+
+        # Populate the barcodes
+        for barcodes, order_ids in barcode_batches:
+            for barcode, order_id in zip(barcodes, order_ids):
+                if barcode in all_barcodes:
+                    known_order_id = all_barcodes[barcode]
+                    if known_order_id == (order_id or None):
+                        # The very same row, exported again.
+                        continue
+                    if known_order_id is None and self._claim(order_id, barcode):
+                        # Filtered out of the index when it is next queried.
+                        self._removed_available.add(barcode)
+                        continue
+                    if report is not None:
+                        report.reject_barcode(CONFLICTING_BARCODE, barcode, order_id)
+                    self._discarded_count += 1
+                    continue
+
+                all_barcodes[barcode] = order_id or None
+                if not order_id:
+                    added.append(barcode)
+                elif not self._claim(order_id, barcode):
+                    # Its order may come with a later delta.
+                    self._hold_barcode(order_id, barcode)
+
+        if added:
+            self._available.extend(added)
+            self._available_sorted = False
+
+        self._next_order_id = None
+        self._customer_orders = None
+
+    def place_order(self, customer_id: int, quantity: int) -> Order:
+        """Place a new order, attributing it available barcodes.
+
+        >>> system = VoucherSystem()
+        >>> system.populate([ExportedBarcode(b) for b in 'abcde'], [])
+        >>> order = system.place_order(7, 2)
+        >>> order.order_id, order.customer_id, sorted(order.barcodes)
+        (1, 7, ['d', 'e'])
+        >>> system.get_available_barcodes()
+        ['a', 'b', 'c']
+
+        See :py:meth:`place_orders`.
+
+        :param customer_id: The identifier of the customer placing the order.
+        :param quantity: The amount of barcodes to attribute.
+        :returns: The order placed.
+        :raises ValueError: If the quantity is not positive, or if there are not
+            enough available barcodes.
+
+        """
+        return self.place_orders([(customer_id, quantity)])[0]
+
+    def place_orders(self, requests: Sequence[Tuple[int, int]]) -> List[Order]:
+        """Place new orders at once, attributing them available barcodes.
 
-        # Validate the orders
+        The orders are given identifiers following the greatest identifier
+        known to the system. The barcodes are taken from the end of the index
+        of available barcodes, the greatest first, which takes time in
+        proportion to the amount of barcodes taken only.
+
+        >>> system = VoucherSystem()
+        >>> system.populate([ExportedBarcode('a', 10), ExportedBarcode('b'),
+        ...                  ExportedBarcode('c'), ExportedBarcode('d')],
+        ...                 [ExportedOrder(10, 7)])
+        >>> [(o.order_id, o.customer_id, sorted(o.barcodes))
+        ...  for o in system.place_orders([(7, 1), (8, 2)])]
+        [(11, 7, ['b']), (12, 8, ['c', 'd'])]
+        >>> system.get_top_customers(2)
+        [(7, 2), (8, 2)]
+
+        Either all the orders are placed, or none is:
+
+        >>> system.place_orders([(9, 1)])
+        Traceback (most recent call last):
+            ...
+        ValueError: Cannot attribute 1 barcodes out of 0 available
+        >>> system.place_orders([(9, 0)])
+        Traceback (most recent call last):
+            ...
+        ValueError: Cannot attribute 0 barcodes to an order
+
+        :param requests: The identifier of the customer placing each order
+            and the amount of barcodes to attribute to it.
+        :returns: A fresh list of the orders placed, in the order of `requests`.
+        :raises ValueError: If a quantity is not positive, or if there are not
+            enough available barcodes.
+
+        """
+        total = 0
+        for _, quantity in requests:
+            if quantity <= 0:
+                raise ValueError(f"Cannot attribute {quantity} barcodes to an order")
+            total += quantity
+
+        available = self._sorted_available()
+        if total > len(available):
+            raise ValueError(
+                f"Cannot attribute {total} barcodes out of {len(available)} available"
+            )
+
+        if self._next_order_id is None:
+            known_order_ids = itertools.chain(
+                self._orders,
+                self._pending_orders,
+                filter(None, self._all_barcodes.values()),
+            )
+            self._next_order_id = max(known_order_ids, default=0) + 1
+
+        # Take the barcodes from the end of the index, without shifting it.
+        start = len(available) - total
+        taken = available[start:]
+        del available[start:]
+
+        all_barcodes = self._all_barcodes
+        customer_totals = self._customer_totals
+        first_orders = self._customer_first_orders
+        orders = []
+        end = 0
+
+        for order_id, (customer_id, quantity) in enumerate(
+            requests, self._next_order_id
+        ):
+            start, end = end, end + quantity
+            barcodes = taken[start:end]
+            order = Order(order_id, customer_id, set(barcodes))
+
+            self._orders[order_id] = order
+            all_barcodes.update(zip(barcodes, itertools.repeat(order_id)))
+            customer_totals[customer_id] = (
+                customer_totals.get(customer_id, 0) + quantity
+            )
+            # The new order identifier is greater than any previous one.
+            first_orders.setdefault(customer_id, order_id)
+            if self._customer_orders is not None:
+                self._customer_orders.setdefault(customer_id, []).append(order_id)
+            orders.append(order)
+
+        self._next_order_id += len(requests)
+        self._attributed_count += total
+        return orders
+
+    def _claim(self, order_id: int, barcode: str) -> bool:
+        """Attribute a barcode to a known or pending order.
+
+        :param order_id: The identifier of the order, pending or not.
+        :param barcode: The barcode, already known to the system.
+        :returns: Whether the order exists.
+
+        """
+        order = self._orders.get(order_id)
+        if order is None:
+            order = self._pending_orders.pop(order_id, None)
+            if order is None:
+                return False
+            self._orders[order_id] = order
+
+        self._all_barcodes[barcode] = order_id
+        self._attribute(order, barcode)
+        return True
+
+    def _attribute(self, order: Order, barcode: str):
+        """Attribute a barcode to an order and account for it.
+
+        :param order: The order to attribute the barcode to.
+        :param barcode: The barcode, already known to the system.
+
+        """
+        customer_id = order.customer_id
+
+        if not order.barcodes:
+            first_order = self._customer_first_orders.get(customer_id)
+            if first_order is None or order.order_id < first_order:
+                self._customer_first_orders[customer_id] = order.order_id
+
+        order.barcodes.add(barcode)
+        self._customer_totals[customer_id] = (
+            self._customer_totals.get(customer_id, 0) + 1
+        )
+        self._attributed_count += 1
+
+    def _start_populating(self):
+        """Mark the system as populated.
+
+        :raises ValueError: If the system is populated already.
+
+        """
+        if self._populated:
+            raise ValueError("The system is populated already, apply a delta instead")
+        self._populated = True
+
+    def _hold_barcode(self, order_id: int, barcode: str):
+        """Hold a barcode of an unknown order, discarded until the order is added.
+
+        :param order_id: The identifier of the unknown order.
+        :param barcode: The barcode, already known to the system.
+
+        """
+        self._pending_barcodes.setdefault(order_id, []).append(barcode)
+        self._discarded_count += 1
+
+    def _hold_empty_orders(self, report: Optional[IngestionReport]):
+        """Hold the orders without barcodes aside as pending.
+
+        :param report: The report to account for the pending orders in, if any.
+
+        """
         for order in list(self._orders.values()):
             if not order.barcodes:
-                logging.warning("Discarding order without barcodes %s", order)
-                self._orders.pop(order.order_id)
+                if report is not None:
+                    report.reject_order(EMPTY_ORDER, order.order_id, order.customer_id)
+                self._pending_orders[order.order_id] = self._orders.pop(order.order_id)
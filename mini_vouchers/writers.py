@@ -0,0 +1,197 @@
+#
+# Copyright 2019 Borjan Tchakaloff
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+"""Writers of the vouchers of orders, in several formats.
+
+The barcodes of each voucher are sorted by value, so that the output only
+depends on the dataset. The vouchers are rendered a chunk at a time and each
+chunk is written at once. The formats are:
+
+- ``text``: a line per order, in the form of
+  ``customer_id, order_id, barcode[, barcode...]``;
+- ``jsonl``: a JSON object per order and per line;
+- ``csv``: a CSV file with a header and a row per barcode, in the form of
+  ``customer_id,order_id,barcode``.
+"""
+
+import itertools
+import json
+from typing import Callable, Dict, Iterable, NamedTuple, TextIO
+
+from mini_vouchers.voucher_system import Order
+
+
+DEFAULT_CHUNK_SIZE = 1 << 12
+"""The amount of vouchers rendered and written at once."""
+_CSV_SPECIALS = frozenset(',"\r\n')
+"""The characters of a CSV field that require quoting it."""
+
+
+def render_text(order: Order) -> str:
+    r"""Render the voucher of an order as a line of text.
+
+    >>> render_text(Order(10, 7, {'b', 'a'}))
+    '7, 10, a, b\n'
+
+    :param order: The order to render.
+    :returns: The line, in the form of `customer_id, order_id, barcode[,
+        barcode...]`.
+
+    """
+    barcodes = ", ".join(sorted(order.barcodes))
+    return f"{order.customer_id}, {order.order_id}, {barcodes}\n"
+
+
+def render_jsonl(order: Order) -> str:
+    r"""Render the voucher of an order as a line of JSON.
+
+    >>> render_jsonl(Order(10, 7, {'b', 'a'}))
+    '{"customer_id":7,"order_id":10,"barcodes":["a","b"]}\n'
+
+    :param order: The order to render.
+    :returns: The line, holding a JSON object.
+
+    """
+    return (
+        json.dumps(
+            {
+                "customer_id": order.customer_id,
+                "order_id": order.order_id,
+                "barcodes": sorted(order.barcodes),
+            },
+            separators=(",", ":"),
+        )
+        + "\n"
+    )
+
+
+def render_csv(order: Order) -> str:
+    r"""Render the voucher of an order as CSV rows, one per barcode.
+
+    >>> render_csv(Order(10, 7, {'b', 'a,1'}))
+    '7,10,"a,1"\n7,10,b\n'
+
+    :param order: The order to render.
+    :returns: The rows, in the form of `customer_id,order_id,barcode`.
+
+    """
+    prefix = f"{order.customer_id},{order.order_id},"
+    return "".join(
+        f"{prefix}{_csv_field(barcode)}\n" for barcode in sorted(order.barcodes)
+    )
+
+
+def _csv_field(value: str) -> str:
+    """Quote a CSV field, if need be."""
+    if _CSV_SPECIALS.isdisjoint(value):
+        return value
+    escaped = value.replace('"', '""')
+    return f'"{escaped}"'
+
+
+class VoucherFormat(NamedTuple):
+    """A format of vouchers."""
+
+    render: Callable[[Order], str]
+    """The function rendering the voucher of an order."""
+    header: str = ""
+    """The text written before the vouchers."""
+
+
+FORMATS: Dict[str, VoucherFormat] = {
+    "text": VoucherFormat(render_text),
+    "jsonl": VoucherFormat(render_jsonl),
+    "csv": VoucherFormat(render_csv, "customer_id,order_id,barcode\n"),
+}
+"""The formats of vouchers, by name."""
+
+
+class VoucherWriter:
+    """A writer of vouchers in a given format, a chunk at a time.
+
+    >>> import io
+    >>> output = io.StringIO()
+    >>> writer = VoucherWriter(output, "csv")
+    >>> writer.write_orders([Order(10, 7, {'b', 'a'}), Order(12, 8, {'c'})])
+    2
+    >>> print(output.getvalue(), end="")
+    customer_id,order_id,barcode
+    7,10,a
+    7,10,b
+    8,12,c
+
+    """
+
+    output: TextIO
+    """The text stream to write to."""
+    render: Callable[[Order], str]
+    """The function rendering the voucher of an order."""
+    chunk_size: int
+    """The amount of vouchers rendered and written at once."""
+    _header: str
+    """The text still to write before the vouchers."""
+
+    def __init__(
+        self,
+        output: TextIO,
+        format_name: str = "text",
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        """Initialise the writer.
+
+        :param output: The text stream to write to.
+        :param format_name: The name of the format, see :py:const:`FORMATS`.
+        :param chunk_size: The amount of vouchers rendered and written at once.
+
+        """
+        assert chunk_size > 0
+
+        voucher_format = FORMATS[format_name]
+        self.output = output
+        self.render = voucher_format.render
+        self.chunk_size = chunk_size
+        self._header = voucher_format.header
+
+    def write_orders(self, orders: Iterable[Order]) -> int:
+        """Render and write the vouchers of orders.
+
+        :param orders: The orders to write the vouchers of, in order.
+        :returns: The amount of vouchers written.
+
+        """
+        return self.write_rendered(map(self.render, orders))
+
+    def write_rendered(self, vouchers: Iterable[str]) -> int:
+        """Write vouchers already rendered, e.g. by :py:attr:`render`.
+
+        :param vouchers: The rendered vouchers, in order.
+        :returns: The amount of vouchers written.
+
+        """
+        if self._header:
+            self.output.write(self._header)
+            self._header = ""
+
+        count = 0
+        vouchers = iter(vouchers)
+        while True:
+            chunk = list(itertools.islice(vouchers, self.chunk_size))
+            if not chunk:
+                return count
+            # A single write per chunk, where `writelines` writes per voucher.
+            self.output.write("".join(chunk))
+            count += len(chunk)